@@ -1,22 +1,24 @@
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import spacy
+from scipy.sparse import csr_matrix
+import numpy as np
+import re
 import string
-from functools import lru_cache
+from collections import Counter
+from collections.abc import Mapping
+import os
+import sys
 
-nlp = spacy.load("nl_core_news_lg", disable=["ner", "parser"])
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models import get_nlp
+from annotation import split_sentences, merge_punctuation
 
 """
 This script was used to to obtain the recall, coverage, and cosine similarity scores
 """
 
-@lru_cache(maxsize=None)
-def lemmatize_cached(word: str) -> str:
-    return lemmatize(word)
-
+# sklearn is only imported by the functions that use it, importing it takes longer than the rest of the evaluation setup
 
 def lemmatize(n):
-    doc = nlp(n.lower())
+    doc = get_nlp()(n.lower())
     return " ".join([token.lemma_ for token in doc])
 
 # Function to calculate the precision, recall and F1 score
@@ -52,6 +54,9 @@ def compute_recall_coverage(overall_language, generated, list_of_words = False,
 
 # Function to calculate the cosine similarity between two word lists
 def compute_cosine_similarity(overall_language, generated, verbose=False):
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+
     overall_language_ = " ".join(overall_language)
     generated_ = " ".join(generated)
 
@@ -70,3 +75,215 @@ def compute_cosine_similarity(overall_language, generated, verbose=False):
 
     return similarity
 
+
+# The analyzer of the default CountVectorizer, the cosine similarity is computed over these terms
+token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+def analyze(word):
+    return token_pattern.findall(word.lower())
+
+def normalize_rows(X):
+    """ Returns the rows of the sparse matrix X divided by their euclidean norm, as sklearn.preprocessing.normalize does """
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0.0] = 1.0
+    return csr_matrix(X.multiply(1 / norms[:, None]))
+
+class MetricsKernel:
+    """
+    Computes compute_recall_coverage (for lists of words) and compute_cosine_similarity for many comparisons at once.
+    The words of all comparisons are mapped to IDs in a shared vocabulary, the observed and generated sets are
+    sparse vectors over this vocabulary and the bags of terms are count vectors, 
+    and the metrics of all comparisons are computed with matrix operations
+    (the cosine similarity is that of compute_cosine_similarity up to floating point rounding).
+    """
+
+    def __init__(self):
+        self.items = {}         # word -> ID, for the set based recall and coverage
+        self.terms = {}         # analyzed term -> ID, for the count based cosine similarity
+        self.pairs = []
+        self.generated = {}     # the ID vectors of the generated lists, which are reused for every window
+
+    def _ids(self, vocabulary, words):
+        return [vocabulary.setdefault(w, len(vocabulary)) for w in words]
+
+    def _vectors(self, words, cosine):
+        # words is a list of words, or a bag (a mapping of the words to their counts)
+        counts = words if isinstance(words, Mapping) else Counter(words)
+        items = self._ids(self.items, counts)
+        terms = {}
+        if cosine:
+            for w, count in counts.items():
+                for t in analyze(w):
+                    i = self.terms.setdefault(t, len(self.terms))
+                    terms[i] = terms.get(i, 0) + count
+        return items, terms
+
+    def add(self, overall_language, generated, cosine=True):
+        """ Adds a comparison (of two lists or bags of words) and returns its index in the results, the cosine similarity is None if cosine is False """
+        items_O, terms_O = self._vectors(overall_language, cosine)
+        # The same generated list (of a profile) is compared with many windows, its ID vectors are computed once.
+        # The list is kept with its vectors, so its id is not reused by another list
+        key = (id(generated), cosine)
+        if key not in self.generated:
+            self.generated[key] = (generated, self._vectors(generated, cosine))
+        items_G, terms_G = self.generated[key][1]
+        self.pairs.append((items_O, items_G, terms_O, terms_G, bool(overall_language), bool(generated), cosine))
+        return len(self.pairs) - 1
+
+    def _sets(self, column):
+        # Sparse 0/1 matrix with a row per comparison, marking the words in the set
+        rows = [i for i, pair in enumerate(self.pairs) for _ in pair[column]]
+        cols = [c for pair in self.pairs for c in pair[column]]
+        return csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(self.pairs), len(self.items)))
+
+    def _counts(self, column):
+        # Sparse count matrix with a row per comparison, over the shared vocabulary of terms
+        rows = [i for i, pair in enumerate(self.pairs) for _ in pair[column]]
+        cols = [t for pair in self.pairs for t in pair[column]]
+        data = [count for pair in self.pairs for count in pair[column].values()]
+        return csr_matrix((data, (rows, cols)), shape=(len(self.pairs), len(self.terms)), dtype=float)
+
+    def _cosines(self):
+        # The cosine similarity of every comparison is the row-wise dot product of the normalised count vectors
+        X = normalize_rows(self._counts(2))
+        Y = normalize_rows(self._counts(3))
+        return np.asarray(X.multiply(Y).sum(axis=1)).ravel()
+
+    def compute(self):
+        """
+        This function computes the metrics of all added comparisons
+        
+        Returns:
+        list: recall, list: coverage, list: cosine similarity (in the order the comparisons were added)
+        """
+        if not self.pairs:
+            return [], [], []
+        O = self._sets(0)
+        G = self._sets(1)
+        overlap = np.asarray(O.multiply(G).sum(axis=1)).ravel()
+        size_O = np.asarray(O.sum(axis=1)).ravel()
+        size_G = np.asarray(G.sum(axis=1)).ravel()
+
+        cosine = self._cosines()
+
+        recall, coverage, cosines = [], [], []
+        for i, (items_O, items_G, terms_O, terms_G, has_O, has_G, with_cosine) in enumerate(self.pairs):
+            if with_cosine and not terms_O and not terms_G:
+                # CountVectorizer does not accept comparisons without any terms
+                raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+            recall.append(float(overlap[i] / size_G[i]) if has_G else 0)
+            coverage.append(float(overlap[i] / size_O[i]) if has_O else 0)
+            cosines.append(float(cosine[i]) if with_cosine else None)
+        return recall, coverage, cosines
+
+
+def candidate_words(candidate):
+    """ Returns the words of a generated sentence, split and stripped as in compute_recall_coverage """
+    return [word.strip(string.punctuation).lower() for word in candidate.split()]
+
+class CandidateScorer:
+    """
+    Scores many generated sentences (candidate responses) against the same profile at once.
+    The words, terms and ngrams of the profile are mapped to IDs once, when the scorer is created,
+    the candidates of a batch are tokenised (and lemmatised) together and their metrics are computed with matrix operations.
+    The recall and coverage are those of compute_recall_coverage(profile, [candidate]) and the cosine similarity is that of
+    compute_cosine_similarity(profile, candidate words), up to floating point rounding.
+    """
+
+    def __init__(self, profile_words, profile_ngrams=(), lemmatize=None, n_values=(2, 3, 4, 5), model=None):
+        """
+        Parameters:
+        arg1 (profile_words): the (common) words of the profile, the overall language the candidates are compared with
+        arg2 (profile_ngrams): the (common) ngrams of the profile
+        arg3 (lemmatize): function that returns the lemmas of a list of words or ngrams (e.g. Lemmatizer.lemmatize_all),
+                          only the exact matches are scored if None
+        arg4 (n_values): the n's of the ngrams of the candidates
+        arg5 (model): the spaCy model (or its name) used to tokenise the candidates for the ngrams, None for the default model
+        """
+        self.lemmatize = lemmatize
+        self.n_values = list(n_values)
+        self.model = model
+        self.terms = {}         # analyzed term -> ID of the terms of the profiles, for the cosine similarity
+        self.profiles = {"Exact": self._profile(profile_words, profile_ngrams)}
+        if lemmatize is not None:
+            self.profiles["Lemma"] = self._profile(lemmatize(list(profile_words)), lemmatize(list(profile_ngrams)))
+
+    def _profile(self, words, ngrams):
+        # The set of words and ngrams of the profile and its normalised term vector
+        counts = Counter(t for w in words for t in analyze(w))
+        ids = [self.terms.setdefault(t, len(self.terms)) for t in counts]
+        vector = np.array(list(counts.values()), dtype=float)
+        norm = np.linalg.norm(vector)
+        return {"words": set(words), "ngrams": set(ngrams), "term_ids": ids,
+                "term_vector": vector / norm if norm else vector, "has_words": bool(words)}
+
+    def _ngrams(self, tokens):
+        return {" ".join(tokens[i:i + n]) for n in self.n_values for i in range(len(tokens) - n + 1)}
+
+    def tokenize(self, candidates):
+        """ Returns the tokens of every sentence of every candidate, all sentences are tokenised in one nlp.pipe call """
+        sentences = [[s for s in split_sentences(c) if s != ""] for c in candidates]
+        nlp = get_nlp(self.model)
+        docs = iter(nlp.tokenizer.pipe([s for c in sentences for s in c]))
+        return [[merge_punctuation([token.text for token in next(docs)], {','}) for _ in c] for c in sentences]
+
+    def score(self, candidates):
+        """
+        This function takes one argument and returns the metrics of every candidate, compared with the profile
+
+        Parameters:
+        arg1 (candidates): the generated sentences
+
+        Returns:
+        dictionary: per match type (Exact, and Lemma when lemmatize is given) the arrays of the Recall, Coverage and Cosine
+                    of the words and the Ngram_recall and Ngram_coverage of the ngrams, in the order of the candidates
+        """
+        words = [candidate_words(c) for c in candidates]
+        tokenized = self.tokenize(candidates)
+        batches = {"Exact": (words, [[self._ngrams(tokens) for tokens in c] for c in tokenized])}
+        if self.lemmatize is not None:
+            # The words and tokens of all candidates are lemmatised in one batch
+            flat = [w for c in words for w in c] + [t for c in tokenized for tokens in c for t in tokens]
+            lemmas = iter(self.lemmatize(flat))
+            lemma_words = [[next(lemmas) for _ in c] for c in words]
+            lemma_tokens = [[[next(lemmas) for _ in tokens] for tokens in c] for c in tokenized]
+            batches["Lemma"] = (lemma_words, [[self._ngrams(tokens) for tokens in c] for c in lemma_tokens])
+        return {matchtype: self._score(self.profiles[matchtype], *batch) for matchtype, batch in batches.items()}
+
+    def _score(self, profile, words, ngrams):
+        size = len(words)
+        overlap, size_G = np.zeros(size), np.zeros(size)
+        ngram_overlap, ngram_size = np.zeros(size), np.zeros(size)
+        rows, cols, data = [], [], []
+        # The terms that are not in the profiles get an ID for this batch only, so the vocabulary of a
+        # long-lived scorer (e.g. in the profile service) does not grow with every batch
+        extra = {}
+        for i, (gen, sentences) in enumerate(zip(words, ngrams)):
+            gen_set = set(gen)
+            overlap[i] = len(gen_set & profile["words"])
+            size_G[i] = len(gen_set)
+            gen_ngrams = set().union(*sentences)
+            ngram_overlap[i] = len(gen_ngrams & profile["ngrams"])
+            ngram_size[i] = len(gen_ngrams)
+            counts = Counter(t for w in gen for t in analyze(w))
+            rows.extend([i] * len(counts))
+            cols.extend(self.terms[t] if t in self.terms else len(self.terms) + extra.setdefault(t, len(extra)) for t in counts)
+            data.extend(counts.values())
+
+        # Cosine similarity of the term counts, the profile vector is normalised once
+        # (one empty column when there are no terms at all, e.g. an empty live profile, normalize needs a column)
+        from sklearn.preprocessing import normalize
+        width = max(1, len(self.terms) + len(extra))
+        C = normalize(csr_matrix((data, (rows, cols)), shape=(size, width), dtype=float))
+        p = np.zeros(width)
+        p[profile["term_ids"]] = profile["term_vector"]
+        cosine = C @ p
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {
+                "Recall": np.where(size_G > 0, overlap / size_G, 0.0),
+                "Coverage": overlap / len(profile["words"]) if profile["has_words"] else np.zeros(size),
+                "Cosine": cosine,
+                "Ngram_recall": np.where(ngram_size > 0, ngram_overlap / ngram_size, 0.0),
+                "Ngram_coverage": ngram_overlap / len(profile["ngrams"]) if profile["ngrams"] else np.zeros(size),
+            }
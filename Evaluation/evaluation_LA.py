@@ -1,152 +1,307 @@
 import sys
 import os
-import json
 import csv
-import re
-
-from functools import lru_cache
+import json
+import hashlib
+import argparse
+from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from LA_evaluation import compute_recall_coverage, compute_cosine_similarity, lemmatize
-from functions import preprocess, get_ngram, frequency_term_POS
-
-@lru_cache(maxsize=None)
-def lemmatize_cached(word: str) -> str:
-    return lemmatize(word)
+from LA_evaluation import MetricsKernel
+from functions import get_ngrams, annotator, ObservedWindows
+from annotation import split_sentences
+from annotation_store import open_transcript, close_transcript
+from lemmatizer import Lemmatizer
+from models import model_key
+from profiles import read_profile, ProfileRepository
+from results import ResultsWriter, EXTENSIONS
+import config
+import telemetry
+from telemetry import stage
 
 ## Obtain the relevant information from the lexical profile 
 def get_generated(filename, timeframe):
-    dir = os.path.join(filename, "Lexical_profiles_3")      # Manually adjust the profiles that are evaluated 
+    dir = os.path.join(filename, profile_folder)
 
     file_path = os.path.join(dir, str(timeframe)+"_database.json")
-    with open(file_path, 'r', encoding = "utf-8") as f:
-        database = json.load(f)
+    database = read_profile(file_path)      # The compact profile (see profiles.py) is used when it exists, the bulky sections are not read
 
     ngrams = database["ngrams"]["common"]
   
     return database, ngrams 
 
-## Create the results csv file for the Lexical Alignment evaluation
-results_path = os.path.join("Results", "results_LA_summary_train_30_3.csv")     # Manually adjust the name for the evaluation that was done.
-os.makedirs(os.path.dirname(results_path), exist_ok=True)
-results_file = open(results_path, mode="w", newline="", encoding="utf-8")
-writer = csv.writer(results_file)
-writer.writerow([
+## The header of the results csv file for the Lexical Alignment evaluation
+header = [
     "Model", "Transcript_nr", "Timeframe_LP", "Timeframe_EVAL", "Split",
     "Amount", "Metric", "Value", "POS", "Matchtype"
-])
+]
 
-def word_based_measures(tokens_O, tokens_GEN, pos, transcript, timeframe_LP, timeframe_EVAL, split):
+## The POS categories that are evaluated
+POS_list = ["NOUN", "PRON", "ADJ", "CONJ", "VERB", "ADV"]
+
+def word_based_measures(kernel, measures, tokens_O, tokens_GEN, pos, transcript, timeframe_LP, timeframe_EVAL, split, lemmas_GEN=None):
+    row = ["Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split, 0]
     ## Exact repetition
-    COS_E = compute_cosine_similarity(tokens_O, tokens_GEN)
-    Recall_E, Coverage_E = compute_recall_coverage(tokens_O, tokens_GEN, list_of_words = True, generated_questions=False)
-
-    # Store exact measures
-    for metric, val in zip(
-        ["Recall", "Coverage", "Cosine"],
-        [Recall_E, Coverage_E, COS_E]
-    ):
-        writer.writerow([
-            "Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split,
-            0, metric, val, pos, "Exact"
-        ])
-    ## Lemmatised repetition
-    tokens_O = [lemmatize_cached(p) for p in tokens_O]
-    tokens_GEN = [lemmatize_cached(p) for p in tokens_GEN]
-    COS_L = compute_cosine_similarity(tokens_O, tokens_GEN)
-    Recall_L, Coverage_L = compute_recall_coverage(tokens_O, tokens_GEN, list_of_words = True, generated_questions=False)
-
-    # Store lemma measures
-    for metric, val in zip(
-        ["Recall", "Coverage", "Cosine"],
-        [Recall_L, Coverage_L, COS_L]
-    ):
-        writer.writerow([
-            "Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split,
-            0, metric, val, pos, "Lemma"
-        ])
-
-def ngram_based_measures(text_O, ngrams_GEN, transcript, timeframe_LP, timeframe_EVAL, split):
-    n_values = [2,3,4,5]
-    ngrams_O = []
-    sentences = re.split(r'(?<=[.!?])\s+|(?<=BREAK)\s+|(?<=\.)', text_O)
+    measures.append((kernel.add(tokens_O, tokens_GEN), row, pos, "Exact"))
 
-    
-    for n in n_values:
-        all_ngrams = get_ngram(sentences, int(n))
-        ngrams_O.extend(all_ngrams)
-    # Exact repetition
-    Recall_ngram_E, Coverage_ngram_E = compute_recall_coverage(ngrams_O, ngrams_GEN, list_of_words = True, generated_questions=False)
-
-    # Store exact measures
-    for metric, val in zip(
-        ["Recall", "Coverage", "Cosine"],
-        [Recall_ngram_E, Coverage_ngram_E, None]
-    ):
-        writer.writerow([
-            "Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split,
-            0, metric, val, "ngram", "Exact"
-        ])
+    ## Lemmatised repetition, the lemmas of the profile are passed when they were already computed
+    tokens_O = lemmatize_bag(tokens_O)
+    if lemmas_GEN is None:
+        lemmas_GEN = get_lemmatizer().lemmatize_all(tokens_GEN)
+    measures.append((kernel.add(tokens_O, lemmas_GEN), row, pos, "Lemma"))
+
+def lemmatize_bag(tokens):
+    """ Returns the lemmas of a list of tokens, or of a bag of tokens (a mapping to their counts) with the counts merged per lemma """
+    if not isinstance(tokens, Mapping):
+        return get_lemmatizer().lemmatize_all(tokens)
+    lemmas = Counter()
+    for lemma, count in zip(get_lemmatizer().lemmatize_all(list(tokens)), tokens.values()):
+        lemmas[lemma] += count
+    return lemmas
+
+def ngram_based_measures(kernel, measures, text_O, ngrams_GEN, transcript, timeframe_LP, timeframe_EVAL, split, lemmas_GEN=None, ngrams_O=None):
+    row = ["Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split, 0]
+    if ngrams_O is None:
+        sentences = split_sentences(text_O)
+        ngrams_O = get_ngrams(sentences, n_values)
+    # Exact repetition, no cosine similarity is computed for the ngrams
+    measures.append((kernel.add(ngrams_O, ngrams_GEN, cosine=False), row, "ngram", "Exact"))
 
     ## Lemmatised repetition
-    ngrams_O = [lemmatize_cached(p) for p in ngrams_O]
-    ngrams_GEN = [lemmatize_cached(p) for p in ngrams_GEN]
-    Recall_ngram_L, Coverage_ngram_L = compute_recall_coverage(ngrams_O, ngrams_GEN, list_of_words = True, generated_questions=False)
-
-    # Store lemma measures
-    for metric, val in zip(
-        ["Recall", "Coverage", "Cosine"],
-        [Recall_ngram_L, Coverage_ngram_L, None]
-    ):
-        writer.writerow([
-            "Lexical profile", transcript, timeframe_LP, timeframe_EVAL, split,
-            0, metric, val, "ngram", "Lemma"
-        ])
+    ngrams_O = get_lemmatizer().lemmatize_all(ngrams_O)
+    if lemmas_GEN is None:
+        lemmas_GEN = get_lemmatizer().lemmatize_all(ngrams_GEN)
+    measures.append((kernel.add(ngrams_O, lemmas_GEN, cosine=False), row, "ngram", "Lemma"))
+
+def write_measures(writer, kernel, measures):
+    """ Computes the metrics of all comparisons in the kernel at once and stores them (in the order of measures) """
+    recall, coverage, cosine = kernel.compute()
+    for i, row, pos, matchtype in measures:
+        for metric, val in zip(
+            ["Recall", "Coverage", "Cosine"],
+            [recall[i], coverage[i], cosine[i]]
+        ):
+            writer.writerow(row + [metric, val, pos, matchtype])
 
 ## Obtain the results
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 directory = os.path.join(parent_dir, "Data")
-folders = [f for f in os.listdir(directory) if f.isdigit()]
 
 timeframes = [5, 10, 15, 20, 25, 30]        # The timeframes at which a lexical profile was created
 split_increase = 30      # The splits that are used to evaluate the lexical profile, this was at 10 and 30
 
-## Loop over all the transcripts
-for transcript in folders:
-    print(transcript)
-    file_path = os.path.join(directory, transcript)
-
-    # Get the file of transcript splits for the current transcript
-    dir = os.path.join(directory, transcript)
-    file_p = os.path.join(dir, "splits" + '.json')
-    with open(file_p, "r", encoding = "utf-8") as file:
-            data = json.load(file)
-
-    ## Loop over the timeframes at which the lexical profiles were generated
-    for timeframe in timeframes:
-        print(timeframe)
-        t = timeframe
-        split_start = timeframe
-
-        while split_start + split_increase <= max(map(int, data.keys())):
-            split_end = split_start + split_increase
-
-            ### Get the data for the next timeframe block to be compared with
-            text_O, tokens_O = preprocess(data, split_start, split_end)  
-            POS_terms_O, _, _ = frequency_term_POS(tokens_O, 5, target_pos=["NOUN", "PRON", "ADJ", "CONJ", "VERB", "ADV"])                                     
-                                                # This number does not need to change!
-
-            ### Obtain the generated results for this transcript at this timeframe
-            database, ngrams_GEN = get_generated(file_path, t)
-            POS_list = ["NOUN", "PRON", "ADJ", "CONJ", "VERB", "ADV"]
+results_path = os.path.join("Results", "results_LA_summary_train_30_3.csv")     # Manually adjust the name for the evaluation that was done.
+results_format = "csv"      # csv, or parquet / arrow (columnar, needs pyarrow), the extension of results_path is adjusted
+shard_dir = os.path.splitext(results_path)[0] + "_shards"      # The results per (transcript, timeframe) are written here first
+workers = min(4, os.cpu_count() or 1)      # The nr of shards that are evaluated at the same time (every worker loads its own spaCy model)
+resume = False              # Keep the shards of an earlier (interrupted) run with the same settings and only evaluate the missing ones
+lemma_path = os.path.join(directory, "lemmas.sqlite")     # The word -> lemma table that is kept between runs
+lemma_cache_size = 100_000  # The nr of words and ngrams of which the lemmas are kept in memory
+profile_folder = "Lexical_profiles_3"      # Manually adjust the profiles that are evaluated (see get_generated)
+profile_cache_size = 16     # The nr of profiles (with their lemmatised common lists) that are kept in memory per worker
+n_values = [2, 3, 4, 5]     # The n's for the ngrams of the evaluated windows
+
+## The settings that can be changed with a config file (section "evaluation") or on the command line, see config.py
+SETTINGS = ["directory", "timeframes", "split_increase", "results_path", "results_format", "shard_dir", "workers", "resume",
+            "lemma_path", "lemma_cache_size", "profile_folder", "profile_cache_size", "n_values"]
+
+## Each worker opens its own connection to the lemma table
+lemmatizers = {}
+
+def get_lemmatizer():
+    if os.getpid() not in lemmatizers:
+        lemmatizers[os.getpid()] = Lemmatizer(None, lemma_path, maxsize=lemma_cache_size)
+    return lemmatizers[os.getpid()]
+
+## The common lists of a profile are lemmatised once, when the profile is first read
+def common_lists(database):
+    """ Returns the common terms per POS category and the common ngrams (key ngram) of a profile """
+    common = {pos: database[pos]["common"] for pos in POS_list}
+    common["ngram"] = database["ngrams"]["common"]
+    return common
+
+def prepare_profile(database):
+    common = common_lists(database)
+    lemmas = {key: get_lemmatizer().lemmatize_all(items) for key, items in common.items()}
+    return common, lemmas
+
+profiles = ProfileRepository(directory, profile_folder, maxsize=profile_cache_size, prepare=prepare_profile)
+
+## Each worker keeps the annotations and the observed windows of the transcript it is evaluating
+opened = {}
+
+def get_transcript(transcript, splits=None):
+    """ Returns the SplitCache and ObservedWindows of a transcript, the splits can be passed when the transcript is already opened """
+    if transcript not in opened or (splits is not None and opened[transcript][1] is not splits):
+        opened.clear()
+        file_p = os.path.join(directory, transcript, "splits" + '.json')
+        if splits is None:
+            with stage("annotation store", transcript):
+                splits = open_transcript(file_p, None, annotator)      # Each split is parsed once and reused for all windows
+        opened[transcript] = (file_p, splits, ObservedWindows(splits, n_values))      # Each window is computed once for all timeframes
+        # The lemmas of the annotations are used for the words of this transcript, they are set once for all windows
+        with stage("lemmatisation", transcript):
+            get_lemmatizer().set_context(file_p, [splits.annotation(i) for i in range(len(splits))])
+    return opened[transcript][1], opened[transcript][2]
+
+## The hash of the settings that the results of a shard depend on, made once per run (see configure)
+settings_key = None
+
+def shard_settings():
+    """ Returns the hash of the settings that the results of a shard depend on """
+    global settings_key
+    if settings_key is None:
+        settings = dict(model_key(), directory=os.path.abspath(directory), split_increase=split_increase,
+                        profile_folder=profile_folder, n_values=n_values)
+        settings_key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return settings_key
+
+def shard_path(transcript, timeframe):
+    # The hash of the settings is part of the name, so resume only keeps the shards of a run with the same settings
+    return os.path.join(shard_dir, f"{transcript}_{timeframe}_{shard_settings()}.csv")
+
+def evaluate_profile(kernel, measures, transcript, timeframe, get_profile, increase, profile_n_values=None):
+    """
+    This function takes seven arguments and adds the comparisons of all windows evaluated against one lexical profile to the kernel
+
+    Parameters:
+    arg1 (kernel): the MetricsKernel in which the comparisons are collected
+    arg2 (measures): the list in which the rows of the comparisons are collected (see write_measures)
+    arg3 (transcript): the transcript number
+    arg4 (timeframe): the timeframe at which the lexical profile was created
+    arg5 (get_profile): function that returns the common lists of the profile and their lemmas (see prepare_profile),
+                        it is called after the first window is annotated
+    arg6 (increase): the nr of splits in a window (split_increase)
+    arg7 (profile_n_values): the n's of the ngrams of the profile, a part of n_values (all of n_values if None)
+    """
+    splits, windows = get_transcript(transcript)
+    t = timeframe
+    split_start = timeframe
+
+    while split_start + increase <= max(map(int, splits.keys)):
+        split_end = split_start + increase
+
+        ### Get the data for the next timeframe block to be compared with,
+        ### the terms per POS (with their counts) and the ngrams of the window as preprocess and frequency_term_POS_tagged would give them
+        with stage("counting", transcript):
+            POS_terms_O = windows.terms(split_start, split_end, target_pos=POS_list)
+        with stage("ngram extraction", transcript):
+            ngrams_O = windows.ngrams(split_start, split_end, profile_n_values)
+
+        ### Obtain the generated results for this transcript at this timeframe, the profile is read only once for all windows
+        with stage("profile I/O", transcript):
+            common, lemmas = get_profile()
+        with stage("lemmatisation", transcript):
             for i in POS_list:
-                tokens_GEN = database[i]["common"]
+                tokens_GEN = common[i]
                 tokens_O = POS_terms_O[i]
-                word_based_measures(tokens_O, tokens_GEN, i, transcript, t, f"{split_start} - {split_end}", split_increase)
-            ngram_based_measures(text_O, ngrams_GEN, transcript, t, f"{split_start} - {split_end}", split_increase)
-            
-            split_start = split_end
+                word_based_measures(kernel, measures, tokens_O, tokens_GEN, i, transcript, t, f"{split_start} - {split_end}", increase, lemmas[i])
+            ngram_based_measures(kernel, measures, None, common["ngram"], transcript, t, f"{split_start} - {split_end}", increase, lemmas["ngram"], ngrams_O)
+        
+        split_start = split_end
+
+def evaluate_shard(transcript, timeframe):
+    """
+    This function takes two arguments and writes the results of all windows evaluated against one lexical profile to a shard
+    
+    Parameters:
+    arg1 (transcript): the transcript number
+    arg2 (timeframe): the timeframe at which the lexical profile was created
+    """
+    print(transcript, timeframe)
+
+    # The comparisons of all windows are collected first and their metrics are computed in one batch
+    kernel = MetricsKernel()
+    measures = []
+    evaluate_profile(kernel, measures, transcript, timeframe, lambda: profiles.get(transcript, timeframe), split_increase)
+
+    path = shard_path(transcript, timeframe)
+    with stage("metrics", transcript):
+        with open(path + ".tmp", mode="w", newline="", encoding="utf-8") as shard_file:
+            write_measures(csv.writer(shard_file), kernel, measures)
+        os.replace(path + ".tmp", path)
+
+def run_shard(unit):
+    """ Runs evaluate_shard for one (transcript, timeframe), a failure is returned instead of stopping the other shards,
+    the telemetry of the shard is returned with it (see telemetry.take) """
+    try:
+        evaluate_shard(*unit)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    # Store the annotations that were made for this transcript
+    for transcript, (file_p, splits, _) in opened.items():
+        with stage("annotation store", transcript):
+            close_transcript(file_p, splits, annotator)
+    return unit, error, telemetry.take()
+
+def enable_telemetry():
+    """ Enables the telemetry (see telemetry.py) in a worker, with the statistics of its lemma and profile caches """
+    telemetry.enable()
+    telemetry.register_cache("lemmas", lambda: get_lemmatizer().cache_info()._asdict())
+    telemetry.register_cache("profiles", lambda: {"hits": profiles.hits, "misses": profiles.misses})
+
+def configure(values, report=False):
+    """ Sets the settings of the run (see config.py), in the main process and in every worker,
+    shard_dir and lemma_path follow results_path and directory unless they are set themselves """
+    global shard_dir, lemma_path, profiles, settings_key
+    config.apply(globals(), values)
+    settings_key = None
+    if "shard_dir" not in values:
+        shard_dir = os.path.splitext(results_path)[0] + "_shards"
+    if "lemma_path" not in values:
+        lemma_path = os.path.join(directory, "lemmas.sqlite")
+    profiles = ProfileRepository(directory, profile_folder, maxsize=profile_cache_size, prepare=prepare_profile)
+    if report:
+        enable_telemetry()
+
+def merge_shards(units):
+    """ Merges the shards into the results file (see results_format), in the order of the units """
+    path = os.path.splitext(results_path)[0] + EXTENSIONS[results_format]
+    with ResultsWriter(path, results_format) as writer:
+        for unit in units:
+            with open(shard_path(*unit), mode="r", newline="", encoding="utf-8") as shard_file:
+                writer.writerows(csv.reader(shard_file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the lexical profiles")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    parser.add_argument("--report", default=None, help="write a run report with the time per stage to this file (.json or .csv)")
+    parser.add_argument("--profile", default=None, help="dump the cProfile statistics of the run to this file (use workers = 1)")
+    config.add_arguments(parser, config.defaults(globals()))
+    args = parser.parse_args()
+    values = config.settings(args, globals(), "evaluation")
+    configure(values, bool(args.report))
+
+    folders = sorted(f for f in os.listdir(directory) if f.isdigit())
+    ## The work is split per transcript and the timeframe at which its lexical profile was generated
+    units = [(transcript, timeframe) for transcript in folders for timeframe in timeframes]
+
+    os.makedirs(shard_dir, exist_ok=True)
+    todo = [unit for unit in units if not (resume and os.path.exists(shard_path(*unit)))]
+    with telemetry.profiled(args.profile):
+        if workers and workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(values, bool(args.report))) as pool:
+                # Consecutive shards of the same transcript are sent to the same worker
+                results = list(pool.map(run_shard, todo, chunksize=len(timeframes)))
+        else:
+            results = [run_shard(unit) for unit in todo]
 
-lemmatize_cached.cache_clear()
+    failed = [(unit, error) for unit, error, _ in results if error]
+    for unit, error in failed:
+        print(f"Failed: {unit} ({error})")
+    if failed:
+        print(f"{len(failed)} shards failed, the results are not merged (rerun with resume = True)")
+    else:
+        with stage("results I/O"):
+            merge_shards(units)
 
+    if args.report:
+        for _, _, taken in results:
+            telemetry.merge(taken)
+        telemetry.write_report(args.report)
+        telemetry.print_totals()
\ No newline at end of file
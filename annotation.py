@@ -0,0 +1,312 @@
+import re
+
+from models import get_nlp, use
+
+"""
+Here the incremental annotation of the transcripts is stored.
+Every split of splits.json is cleaned and parsed by spaCy exactly once, after which the text and tokens
+of any timeframe (or evaluation window) are obtained by concatenating the cached splits.
+"""
+
+FILTERED = {"PAUSE", "BREAK"}
+SENTENCE_END = {".", "!", "?"}
+
+TAIL = re.compile(r'\w*\s*$')       # The end of a text that can still change when a split is added
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|(?<=BREAK)\s+|(?<=\.)')
+
+
+def clean_split(text):
+    """
+    This function takes one argument and returns the cleaned text of a single split,
+    with pauses and breaks replaced by the PAUSE and BREAK markers
+
+    Parameters:
+    arg1 (text): the raw text of one split from splits.json
+
+    Returns:
+    string: the cleaned text
+    """
+    t1 = text.replace("\n", "")
+    t2 = re.sub(r'\.{3,}(?=\W)', ' PAUSE', t1)
+    t3 = re.sub(r'…(?=\W)', ' PAUSE', t2)
+    t4 = t3.replace("  ", " ")
+
+    t5 = re.sub(r'-\s+(?=[A-Z0-9])', ' BREAK ', t4)
+    t6 = re.sub(r'-\s+(?=[a-z0-9])', ' BREAK ', t5)
+    return t6
+
+
+def join_splits(cleaned):
+    """
+    This function takes one argument and returns the text of consecutive cleaned splits,
+    joined in the same way as the text was accumulated in the original preprocess loop
+
+    Parameters:
+    arg1 (cleaned): list of cleaned splits
+
+    Returns:
+    string: the joined text
+    """
+    return "".join(stream_text(cleaned))
+
+
+def stream_text(cleaned):
+    """
+    This function takes one argument and yields the text of consecutive cleaned splits in pieces,
+    which joined together are the text of join_splits, without building the whole text at once
+
+    Parameters:
+    arg1 (cleaned): iterable of cleaned splits
+
+    Returns:
+    generator: the pieces of the text
+    """
+    # The original loop strips the accumulated text and replaces a hyphen at its end after every split,
+    # which can only change its last word and the whitespace after it, so only that part is kept back
+    tail = ""
+    started = False
+    for t in cleaned:
+        tail = tail + t
+        tail = tail.rstrip() if started else tail.strip()
+        tail = re.sub(r'(\w+)-$', r'\1 BREAK ', tail)
+        cut = TAIL.search(tail).start()
+        if cut:
+            yield tail[:cut]
+            tail = tail[cut:]
+            started = True
+    yield tail
+
+
+def annotate_doc(doc):
+    """
+    This function takes one argument and returns the token, POS and lemma arrays of a spaCy doc
+
+    Parameters:
+    arg1 (doc): the spaCy doc
+
+    Returns:
+    dictionary: with the columns text, pos, lemma, is_alpha and is_punct
+    """
+    return {
+        "text": [token.text for token in doc],
+        "pos": [token.pos_ for token in doc],
+        "lemma": [token.lemma_ for token in doc],
+        "is_alpha": [token.is_alpha for token in doc],
+        "is_punct": [token.is_punct for token in doc],
+    }
+
+
+def coarse_POS(text, pos_):
+    """
+    This function takes two arguments and returns the POS category used in the lexical profiles
+
+    Parameters:
+    arg1 (text): the text of the token
+    arg2 (pos_): the POS label assigned by spaCy
+
+    Returns:
+    string: the POS category, None for sentence-final punctuation
+    """
+    if text in SENTENCE_END:
+        return None
+    elif text == "PAUSE":
+        return "PAUSE"
+    elif text == "BREAK":
+        return "BREAK"
+    elif pos_ in {"NOUN", "PROPN"}:
+        return "NOUN"
+    elif pos_ in {"CONJ", "SCONJ", "CCONJ"}:
+        return "CONJ"
+    elif pos_ in {"VERB", "AUX"}:
+        return "VERB"
+    elif pos_ == "INTJ" or text.lower() == "eh" or text.lower() == "ehm":
+        return "INTJ"
+    return pos_
+
+
+def annotation_POS(annotation):
+    """ Returns the POS categories of an annotation, equal to get_token_POS on the corresponding doc """
+    pos = (coarse_POS(t, p) for t, p in zip(annotation["text"], annotation["pos"]))
+    return [p for p in pos if p is not None]
+
+
+def profile_tokens(annotation):
+    """
+    This function takes one argument and returns the tokens that are used for the lexical profiles,
+    i.e. the lowercased words and commas without the PAUSE and BREAK markers
+
+    Parameters:
+    arg1 (annotation): the annotation of a split, as returned by annotate_doc
+
+    Returns:
+    list: the tokens
+    """
+    return [t.lower() for t, alpha in zip(annotation["text"], annotation["is_alpha"])
+            if (alpha or t == ',') and t not in FILTERED]
+
+
+def profile_token_POS(annotation):
+    """ Returns the POS categories (see coarse_POS) of the tokens returned by profile_tokens """
+    return [coarse_POS(t, p) for t, p, alpha in zip(annotation["text"], annotation["pos"], annotation["is_alpha"])
+            if (alpha or t == ',') and t not in FILTERED]
+
+
+class SplitCache:
+    """
+    Cache of the annotated splits of one transcript.
+    A split is only parsed when it is first needed, and never more than once.
+    Only the text of a timeframe is streamed (see sentences), the annotations of the parsed splits are kept
+    until the transcript is closed, as they are written to the annotation store (see annotation_store.close_transcript).
+    """
+
+    def __init__(self, model, data):
+        """
+        Parameters:
+        arg1 (model): the spaCy model (or its name), None for the default model, it is only loaded when a split is parsed
+        arg2 (data): the dictionary from splits.json
+        """
+        self.model = model
+        self.keys = list(data.keys())
+        self.cleaned = [clean_split(text) for text in data.values()]
+        self.annotations = {}
+        self.calls = 0
+
+    def __len__(self):
+        return len(self.cleaned)
+
+    @property
+    def nlp(self):
+        return get_nlp(self.model)
+
+    def annotation(self, i):
+        """ Returns the (cached) annotation of split i """
+        if i not in self.annotations:
+            piece = re.sub(r'(\w+)-$', r'\1 BREAK ', self.cleaned[i].strip())
+            nlp = self.nlp
+            with use(nlp, "lemmatizer"):
+                self.annotations[i] = annotate_doc(nlp(piece))
+            self.calls += 1
+        return self.annotations[i]
+
+    def text(self, start_, end_):
+        """ Returns the cleaned text of the splits start_ up to end_ """
+        return join_splits(self.cleaned[start_:end_])
+
+    def sentences(self, start_, end_):
+        """ Yields the sentences of the splits start_ up to end_ (see split_sentences), without building their text """
+        return stream_sentences(stream_text(self.cleaned[start_:end_]))
+
+    def _accumulate(self, start_, end_, column):
+        # As in the original preprocess loop, the tokens of every prefix of the window are added,
+        # so earlier splits keep the same weight in the counts as before.
+        accumulated = []
+        prefix = []
+        for i in range(start_, min(end_, len(self.cleaned))):
+            prefix.extend(column(self.annotation(i)))
+            accumulated.extend(prefix)
+        return accumulated
+
+    def tokens(self, start_, end_):
+        """ Returns the tokens of the splits start_ up to end_ """
+        return self._accumulate(start_, end_, profile_tokens)
+
+    def token_POS(self, start_, end_):
+        """ Returns the POS categories of the tokens of the splits start_ up to end_, aligned with tokens """
+        return self._accumulate(start_, end_, profile_token_POS)
+
+
+class SentenceAnnotator:
+    """
+    Batched annotation of sentences with nlp.pipe.
+    Sentences are annotated in bulk and memoised on their text, so the sentences shared by
+    consecutive timeframes are only annotated once per transcript.
+    The memoised sentences are kept until clear (when the next transcript is opened), they are stored with the splits.
+    """
+
+    def __init__(self, model=None, batch_size=256, n_process=1):
+        """
+        Parameters:
+        arg1 (model): the spaCy model (or its name), None for the default model, it is only loaded when a sentence is new
+        arg2 (batch_size): the number of sentences per batch passed to nlp.pipe
+        arg3 (n_process): the number of processes used by nlp.pipe
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.tagged = {}
+        self.tokenized = {}
+
+    @property
+    def nlp(self):
+        return get_nlp(self.model)
+
+    def clear(self):
+        self.tagged.clear()
+        self.tokenized.clear()
+
+    def annotate(self, sentences):
+        """ Returns the annotations (see annotate_doc) of the sentences, tagging the unseen ones in one nlp.pipe call """
+        new = list(dict.fromkeys(s for s in sentences if s not in self.tagged))
+        if new:
+            nlp = self.nlp
+            with use(nlp, "lemmatizer"):
+                docs = nlp.pipe(new, batch_size=self.batch_size, n_process=self.n_process)
+                for s, doc in zip(new, docs):
+                    self.tagged[s] = annotate_doc(doc)
+        return [self.tagged[s] for s in sentences]
+
+    def tokenize(self, sentences):
+        """ Returns the token texts of the sentences, only the tokenizer is run for the unseen ones """
+        new = list(dict.fromkeys(s for s in sentences if s not in self.tokenized and s not in self.tagged))
+        if new:
+            for s, doc in zip(new, self.nlp.tokenizer.pipe(new, batch_size=self.batch_size)):
+                self.tokenized[s] = [token.text for token in doc]
+        return [self.tokenized[s] if s in self.tokenized else self.tagged[s]["text"] for s in sentences]
+
+
+def split_sentences(text):
+    """ Returns the sentences of a cleaned text, as split for the POS structure """
+    return SENTENCE_SPLIT.split(text)
+
+
+def stream_sentences(pieces):
+    """
+    This function takes one argument and yields the sentences of a text that is given in pieces (see stream_text),
+    the same sentences as split_sentences returns for the joined text
+
+    Parameters:
+    arg1 (pieces): iterable of consecutive pieces of a cleaned text
+
+    Returns:
+    generator: the sentences
+    """
+    # A border that ends at the end of the buffer can still grow (more whitespace) or change with the next piece,
+    # the sentences before the last border that does not are complete
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        last = 0
+        for match in SENTENCE_SPLIT.finditer(buffer):
+            if match.end() >= len(buffer):
+                break
+            yield buffer[last:match.start()]
+            last = match.end()
+        buffer = buffer[last:]
+    yield from SENTENCE_SPLIT.split(buffer)
+
+
+def token_chunks(tokens, size=10_000):
+    """ Yields the tokens joined with spaces in chunks of size tokens, which stay far below the max_length of spaCy """
+    for i in range(0, len(tokens), size):
+        yield " ".join(tokens[i:i + size])
+
+
+def merge_punctuation(tokens, marks):
+    """ Returns the tokens with the given punctuation marks concatenated to the previous token """
+    merged = []
+    for i, t in enumerate(tokens):
+        if t in marks and i > 0:
+            merged[-1] = merged[-1] + t
+        else:
+            merged.append(t)
+    return merged
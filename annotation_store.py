@@ -0,0 +1,175 @@
+import gzip
+import hashlib
+import json
+import os
+import argparse
+
+from annotation import SplitCache, SentenceAnnotator
+from models import model_key, set_default_model
+
+"""
+Here the annotations of a transcript are stored on disk, next to its splits.json.
+The store holds the tokens, POS labels, lemmas and flags of every split, and of every sentence
+that was tagged for the POS structures and ngrams, so that later runs do not need the spaCy model again.
+The store is keyed by the spaCy model (and version) and the hash of splits.json, it is rebuilt when either changes.
+
+Running this script annotates all transcripts in the Data directory once.
+"""
+
+STORE_NAME = "annotations.json.gz"
+STORE_FORMAT = 1
+
+ALPHA = 1
+PUNCT = 2
+
+
+def content_hash(file_path):
+    """ Returns the sha256 hash of a file """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def store_path(file_path):
+    """ Returns the path of the store that belongs to the splits.json in file_path """
+    return os.path.join(os.path.dirname(file_path), STORE_NAME)
+
+
+def encode(annotation, labels):
+    """ Returns the compact form of an annotation, with the POS labels as indices in labels and the flags as bits """
+    pos = []
+    for p in annotation["pos"]:
+        if p not in labels:
+            labels[p] = len(labels)
+        pos.append(labels[p])
+    flags = [ALPHA * a + PUNCT * p for a, p in zip(annotation["is_alpha"], annotation["is_punct"])]
+    return {"text": annotation["text"], "lemma": annotation["lemma"], "pos": pos, "flags": flags}
+
+
+def decode(encoded, labels):
+    """ Returns the annotation (see annotation.annotate_doc) of an encoded annotation """
+    return {
+        "text": encoded["text"],
+        "pos": [labels[p] for p in encoded["pos"]],
+        "lemma": encoded["lemma"],
+        "is_alpha": [bool(f & ALPHA) for f in encoded["flags"]],
+        "is_punct": [bool(f & PUNCT) for f in encoded["flags"]],
+    }
+
+
+def read_store(file_path, model=None):
+    """
+    This function takes two arguments and returns the stored annotations of a transcript
+
+    Parameters:
+    arg1 (file_path): the filepath to splits.json
+    arg2 (model): the spaCy model (or its name) the annotations should have been made with, None for the default model
+
+    Returns:
+    dictionary: the stored annotations, None if there is no store or if it is outdated
+    """
+    path = store_path(file_path)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        store = json.load(f)
+    meta = store.get("meta", {})
+    if (meta.get("format") != STORE_FORMAT or meta.get("key") != model_key(model)
+            or meta.get("hash") != content_hash(file_path)):
+        return None
+    labels = store["pos_labels"]
+    return {
+        "splits": {int(i): decode(a, labels) for i, a in store["splits"].items()},
+        "sentences": {s: decode(a, labels) for s, a in store["sentences"].items()},
+        "tokenized": store["tokenized"],
+    }
+
+
+def write_store(file_path, splits, annotator=None):
+    """
+    This function takes three arguments and writes the annotations of a transcript to its store
+
+    Parameters:
+    arg1 (file_path): the filepath to splits.json
+    arg2 (splits): the SplitCache of the transcript
+    arg3 (annotator): the SentenceAnnotator used for the transcript, if any
+    """
+    labels = {}
+    store = {
+        "meta": {"format": STORE_FORMAT, "key": model_key(splits.model), "hash": content_hash(file_path)},
+        "splits": {str(i): encode(a, labels) for i, a in sorted(splits.annotations.items())},
+        "sentences": {s: encode(a, labels) for s, a in annotator.tagged.items()} if annotator else {},
+        "tokenized": dict(annotator.tokenized) if annotator else {},
+    }
+    store["pos_labels"] = list(labels)
+
+    path = store_path(file_path)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(store, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def open_transcript(file_path, model=None, annotator=None):
+    """
+    This function takes three arguments and returns the SplitCache of a transcript,
+    filled with the stored annotations (the sentence annotations are loaded into the annotator)
+
+    Parameters:
+    arg1 (file_path): the filepath to splits.json
+    arg2 (model): the spaCy model (or its name), None for the default model, only loaded for what is not in the store
+    arg3 (annotator): the SentenceAnnotator used for the transcript, if any
+
+    Returns:
+    SplitCache: the splits of the transcript
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    splits = SplitCache(model, data)
+    if annotator:
+        annotator.clear()
+    store = read_store(file_path, model)
+    if store:
+        splits.annotations.update(store["splits"])
+        if annotator:
+            annotator.tagged.update(store["sentences"])
+            annotator.tokenized.update(store["tokenized"])
+    splits.stored = annotation_size(splits, annotator)
+    return splits
+
+
+def annotation_size(splits, annotator=None):
+    """ Returns the number of annotated splits and sentences """
+    size = len(splits.annotations)
+    if annotator:
+        size += len(annotator.tagged) + len(annotator.tokenized)
+    return size
+
+
+def close_transcript(file_path, splits, annotator=None):
+    """ Writes the store of a transcript if new annotations were made since open_transcript """
+    if annotation_size(splits, annotator) != getattr(splits, "stored", -1):
+        write_store(file_path, splits, annotator)
+        splits.stored = annotation_size(splits, annotator)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate all the splits of every transcript once")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    args = parser.parse_args()
+    if args.model:
+        set_default_model(args.model)
+
+    directory = "Data"
+    for transcript in sorted(f for f in os.listdir(directory) if f.isdigit()):
+        print(f"Annotating: {transcript}")
+        file_path = os.path.join(directory, transcript, "splits" + '.json')
+        if not os.path.exists(file_path):
+            continue
+        annotator = SentenceAnnotator()     # keeps the sentences that are already in the store
+        splits = open_transcript(file_path, None, annotator)
+        for i in range(len(splits)):
+            splits.annotation(i)
+        close_transcript(file_path, splits, annotator)
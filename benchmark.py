@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+from collections import Counter
+
+try:
+    import resource
+except ImportError:     # resource is not available on Windows, the peak memory is not reported there
+    resource = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Evaluation"))
+
+import get_lexical_features as glf
+import evaluation_LA as ev
+import models
+from LA_evaluation import MetricsKernel
+from ngrams import filter_subsumed
+from annotation_store import close_transcript
+from telemetry import CountingModel
+
+"""
+This script was used to measure the speed of the pipeline on synthetic transcripts, as the real transcripts can not be shared.
+A transcript (splits.json) of the given length is generated from a synthetic Dutch vocabulary, with pauses and breaks,
+after which every stage of the pipeline is timed separately on it: the annotation, preprocess, sentence_POS, get_ngram,
+frequency_term_POS, the profile writing, filter_ngrams and the evaluation metrics.
+Per stage the time, the throughput (tokens of the transcript per second), the peak memory so far and the nr of docs
+made by the spaCy model are reported, and all results are written to a JSON file that can be compared between commits.
+The benchmark runs offline with a small model (--model nl_core_news_sm) or a blank pipeline (--model blank:nl).
+"""
+
+## Settings of the synthetic transcripts, can be changed with the arguments of the script
+minutes = 60                # The length of a transcript, a split is 5 minutes
+words_per_minute = 130      # The nr of words per minute
+vocabulary_size = 2000      # The nr of distinct content words
+pause_density = 0.02        # The chance that a word is followed by a pause (...)
+break_density = 0.01        # The chance that a word is broken off (wo- woord)
+seed = 0
+output = os.path.join("Benchmarks", "benchmark.json")
+
+## The function words of the synthetic vocabulary per POS label, the content words are made from the syllables (NOUN)
+FUNCTION_WORDS = {
+    "PRON": ["ik", "je", "het", "we", "wij", "ze", "zij", "hij", "die"],
+    "DET": ["de", "een", "mijn"],
+    "CCONJ": ["en", "maar", "want", "dus"],
+    "SCONJ": ["dat", "omdat"],
+    "ADV": ["niet", "wel", "ook", "nog", "er", "toen", "daar", "hier", "heel", "zo", "altijd", "vroeger"],
+    "AUX": ["was", "is", "ben", "heb", "had"],
+    "VERB": ["ging", "kwam", "zei", "woonde", "werkte"],
+    "INTJ": ["eh", "ehm", "ja", "nee"],
+    "ADJ": ["goed", "mooi", "groot", "klein", "oud"],
+    "ADP": ["met", "van", "naar", "in", "op"],
+}
+SYLLABLES = ["ka", "ber", "ling", "huis", "ste", "ver", "oe", "ij", "en", "mo", "der", "va", "schoo", "tuin",
+             "werk", "kin", "wa", "ter", "boer", "de", "rij", "feest", "kerk", "hond", "pa", "lo", "ge", "zel"]
+
+
+def make_vocabulary(size, rng):
+    """ Returns the synthetic content words, made of two or three syllables """
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.choice([2, 2, 3]))))
+    return sorted(words)
+
+
+def generate_transcript(minutes=minutes, vocabulary_size=vocabulary_size, pause_density=pause_density,
+                        break_density=break_density, seed=seed):
+    """
+    This function takes five arguments and returns a synthetic transcript, in the form of splits.json
+
+    Parameters:
+    arg1 (minutes): the length of the transcript
+    arg2 (vocabulary_size): the nr of distinct content words
+    arg3 (pause_density): the chance that a word is followed by a pause
+    arg4 (break_density): the chance that a word is broken off
+    arg5 (seed): the seed of the random generator, the same seed gives the same transcript
+
+    Returns:
+    dictionary: the text per split, keyed by the minute at which the split starts
+    """
+    rng = random.Random(seed)
+    vocabulary = [w for words in FUNCTION_WORDS.values() for w in words] + make_vocabulary(vocabulary_size, rng)
+    # The words follow a Zipf distribution, the function words are the most frequent
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    splits = {}
+    for start in range(0, minutes, 5):
+        words = []
+        n = 0
+        while n < words_per_minute * 5:
+            sentence = rng.choices(vocabulary, weights, k=rng.randint(3, 15))
+            sentence[0] = sentence[0].capitalize()
+            for i, word in enumerate(sentence):
+                if rng.random() < break_density:
+                    words.append(word[:2] + "-")
+                if rng.random() < 0.08 and i < len(sentence) - 1:
+                    word += ","
+                elif rng.random() < pause_density:
+                    word += "..."
+                words.append(word)
+            words[-1] = words[-1].rstrip(",.") + rng.choice([".", ".", ".", "?", "!"])
+            n += len(sentence)
+        splits[str(start)] = " ".join(words)
+    return splits
+
+
+def lowercase_lemmas(doc):
+    for token in doc:
+        token.lemma_ = token.lower_
+    return doc
+
+
+def tag_blank(nlp):
+    """ Adds an attribute_ruler to a blank pipeline, which assigns the POS labels of the synthetic vocabulary,
+    and a lemmatizer that takes the lowercased words as lemmas """
+    from spacy.language import Language
+    if not Language.has_factory("lowercase_lemmas"):
+        Language.component("lowercase_lemmas", func=lowercase_lemmas)
+    nlp.add_pipe("lowercase_lemmas", name="lemmatizer")
+    ruler = nlp.add_pipe("attribute_ruler")
+    function_words = [w for words in FUNCTION_WORDS.values() for w in words]
+    ruler.add(patterns=[[{"IS_ALPHA": True, "LOWER": {"NOT_IN": function_words}}]], attrs={"POS": "NOUN"})
+    ruler.add(patterns=[[{"IS_PUNCT": True}]], attrs={"POS": "PUNCT"})
+    for pos, words in FUNCTION_WORDS.items():
+        ruler.add(patterns=[[{"LOWER": {"IN": words}}]], attrs={"POS": pos})
+
+
+def peak_rss():
+    """ Returns the peak memory (resident set size) of the process so far in MB, None where it is not available """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class Stages:
+    """ Times the stages of the benchmark, the throughput of every stage is in tokens of the transcript per second """
+
+    def __init__(self, model, tokens=0):
+        self.model = model
+        self.tokens = tokens
+        self.results = []
+
+    def run(self, name, function, *args, **kwargs):
+        """ Runs a stage and records its time, the model calls and docs it made and the peak memory so far """
+        before = Counter(self.model.counts)
+        start, cpu = time.perf_counter(), time.process_time()
+        result = function(*args, **kwargs)
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+        made = self.model.counts - before
+        self.results.append({
+            "stage": name,
+            "seconds": seconds,
+            "cpu_seconds": cpu,
+            "tokens": self.tokens,
+            "tokens_per_s": self.tokens / seconds if seconds else None,
+            "model_calls": made["calls"],
+            "model_docs": made["docs"],
+            "tokenizer_docs": made["tokenizer_docs"],
+            "peak_rss_mb": peak_rss(),
+        })
+        return result
+
+    def totals(self):
+        """ Returns the results per stage name, summed over the timeframes (the peak memory is that after the last run) """
+        totals = {}
+        for r in self.results:
+            total = totals.setdefault(r["stage"], {"stage": r["stage"], "runs": 0, "seconds": 0.0, "cpu_seconds": 0.0,
+                                                   "tokens": 0, "model_calls": 0, "model_docs": 0, "tokenizer_docs": 0})
+            total["runs"] += 1
+            for key in ("seconds", "cpu_seconds", "tokens", "model_calls", "model_docs", "tokenizer_docs"):
+                total[key] += r[key]
+            total["tokens_per_s"] = total["tokens"] / total["seconds"] if total["seconds"] and total["tokens"] else None
+            total["peak_rss_mb"] = r["peak_rss_mb"]
+        return list(totals.values())
+
+
+def commit():
+    """ Returns the git commit of the code that is benchmarked, None outside a git repository """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(directory, settings):
+    """
+    This function takes two arguments and runs all stages of the pipeline on a synthetic transcript
+
+    Parameters:
+    arg1 (directory): the (temporary) directory in which the transcript and its profiles are written
+    arg2 (settings): the settings of the transcript, see generate_transcript
+
+    Returns:
+    Stages: the timed stages
+    """
+    transcript = "1"
+    folder = os.path.join(directory, transcript)
+    os.makedirs(folder)
+    file_path = os.path.join(folder, "splits" + '.json')
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(generate_transcript(**settings), f, ensure_ascii=False, indent=4)
+
+    # The model is loaded once and wrapped, so the docs it makes are counted per stage
+    name = models.model_name()
+    start, cpu = time.perf_counter(), time.process_time()
+    nlp = models.get_nlp(name)
+    if name.startswith("blank:"):
+        tag_blank(nlp)      # A blank pipeline has no tagger, the POS labels of the synthetic words are assigned by rules
+    models.models[name] = CountingModel(nlp)
+    load_seconds, load_cpu = time.perf_counter() - start, time.process_time() - cpu
+
+    glf.annotator.clear()
+    splits = glf.load_splits(file_path)
+    stages = Stages(models.models[name])
+    stages.results.append({"stage": "load model", "seconds": load_seconds, "cpu_seconds": load_cpu, "tokens": 0,
+                           "tokens_per_s": None, "model_calls": 0, "model_docs": 0, "tokenizer_docs": 0,
+                           "peak_rss_mb": peak_rss()})
+    stages.run("annotation", lambda: [splits.annotation(i) for i in range(len(splits))])
+    # The throughput of every stage (the annotation included) is in tokens of the transcript per second
+    stages.tokens = sum(len(a["text"]) for a in splits.annotations.values())
+    annotation = stages.results[-1]
+    annotation["tokens"] = stages.tokens
+    annotation["tokens_per_s"] = stages.tokens / annotation["seconds"] if annotation["seconds"] else None
+
+    profiles = {}
+    for timeframe in glf.timeframes:
+        text, tokens, tokens_POS = stages.run("preprocess", glf.preprocess, splits, timeframe)
+        pos_structure = stages.run("sentence_POS", glf.sentence_POS, text)
+        stages.run("get_ngram", glf.get_ngrams, list(pos_structure), glf.n_values, glf.ngram_top_x)
+        stages.run("frequency_term_POS", glf.frequency_term_POS, tokens, glf.top_x, glf.target_pos)
+        stages.run("frequency_term_POS_tagged", glf.frequency_term_POS_tagged, tokens, tokens_POS, glf.top_x, glf.target_pos)
+        counts = stages.run("count_timeframe", glf.count_timeframe, splits, timeframe, glf.n_values)
+
+        database = {"ID": {"transcript number": transcript}}
+        database.update(glf.make_profile(counts, glf.top_x, glf.threshold, glf.n_values, glf.ngram_top_x, glf.ngram_threshold))
+        stages.run("filter_ngrams", filter_subsumed, counts["ngrams"].common(glf.ngram_top_x, glf.ngram_threshold))
+        # write_database and profile_path follow glf.profile_format, which is set back even when a write fails
+        profile_format = glf.profile_format
+        try:
+            for fmt in ("json", "binary"):
+                glf.profile_format = fmt
+                stages.run(f"write profile ({fmt})", glf.write_database, glf.profile_path(folder, timeframe), database)
+        finally:
+            glf.profile_format = profile_format
+        profiles[timeframe] = database
+
+    # The evaluation of the profiles against the windows after their timeframe, as in evaluation_LA.evaluate_shard
+    ev.directory = directory
+    ev.lemma_path = os.path.join(directory, "lemmas.sqlite")
+    ev.get_transcript(transcript, splits)
+    for timeframe in glf.timeframes:
+        kernel = MetricsKernel()
+        measures = []
+        stages.run("evaluation windows", ev.evaluate_profile, kernel, measures, transcript, timeframe,
+                   lambda: ev.prepare_profile(profiles[timeframe]), ev.split_increase)
+        stages.run("evaluation metrics", kernel.compute)
+
+    stages.run("annotation store", close_transcript, file_path, splits, glf.annotator)
+    ev.get_lemmatizer().close()
+    ev.lemmatizers.clear()
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the stages of the pipeline on a synthetic transcript")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm or blank:nl")
+    parser.add_argument("--minutes", type=int, default=minutes)
+    parser.add_argument("--vocabulary", type=int, default=vocabulary_size)
+    parser.add_argument("--pauses", type=float, default=pause_density)
+    parser.add_argument("--breaks", type=float, default=break_density)
+    parser.add_argument("--seed", type=int, default=seed)
+    parser.add_argument("--output", default=output, help="the JSON file with the results")
+    args = parser.parse_args()
+    if args.model:
+        models.set_default_model(args.model)
+
+    settings = {"minutes": args.minutes, "vocabulary_size": args.vocabulary, "pause_density": args.pauses,
+                "break_density": args.breaks, "seed": args.seed}
+    directory = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        stages = benchmark(directory, settings)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    import spacy
+    report = {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spacy": spacy.__version__,
+        "model": models.model_key(),
+        "settings": dict(settings, words_per_minute=words_per_minute, timeframes=glf.timeframes,
+                         split_increase=ev.split_increase),
+        "tokens": stages.tokens,
+        "stages": stages.totals(),
+        "runs": stages.results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"{'Stage':<28}{'Seconds':>10}{'Tokens/s':>14}{'Docs':>8}{'Peak MB':>10}")
+    for total in report["stages"]:
+        tokens_per_s = f"{total['tokens_per_s']:.0f}" if total["tokens_per_s"] else "-"
+        rss = f"{total['peak_rss_mb']:.0f}" if total["peak_rss_mb"] is not None else "-"
+        print(f"{total['stage']:<28}{total['seconds']:>10.3f}{tokens_per_s:>14}{total['model_docs'] + total['tokenizer_docs']:>8}{rss:>10}")
+    print(f"Written: {args.output}")
@@ -0,0 +1,100 @@
+import os
+import json
+
+"""
+Here the settings of the scripts are read from a config file and from the command line.
+Every script lists its settings (module constants, e.g. timeframes, top_x, workers) in SETTINGS,
+these are the defaults, a config file (--config) and the command line (e.g. --timeframes "[10]") replace them.
+The settings are read from and set in the globals of the script (globals(), or vars(module) of an imported script):
+a script that is started in a spawned worker runs in a namespace that is not its module object in sys.modules.
+The config file is a JSON file with a section per script, e.g.
+    {"model": "nl_core_news_sm", "profiles": {"timeframes": [10], "top_x": 10}, "evaluation": {"workers": 4}}
+The relative paths in a config file are relative to the folder of the config file (see PATHS), see config.json for all settings.
+"""
+
+# The settings that are paths
+PATHS = {"directory", "data_directory", "metadata_path", "results_path", "results_dir", "shard_dir", "lemma_path", "grid"}
+
+
+def parse_value(value):
+    """ Returns the value of a setting given on the command line, read as JSON (e.g. 20, [5, 10], {"NOUN": 10}, true) or as a string """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def add_arguments(parser, settings):
+    """
+    This function takes two arguments and adds the config file and a command line option per setting to the parser
+
+    Parameters:
+    arg1 (parser): the ArgumentParser of the script
+    arg2 (settings): the names and defaults of the settings, as returned by defaults
+    """
+    parser.add_argument("--config", default=None, help="JSON file with the settings (see config.json)")
+    for name, value in settings.items():
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=parse_value, default=None,
+                            help=f"default: {json.dumps(value)}")
+
+
+def defaults(namespace):
+    """ Returns the names and current values of the settings of a script (its SETTINGS), namespace is the globals of the script """
+    return {name: namespace[name] for name in namespace["SETTINGS"]}
+
+
+def read_config(path, section):
+    """
+    This function takes two arguments and returns the settings of one script in a config file
+
+    Parameters:
+    arg1 (path): the path of the config file
+    arg2 (section): the section of the script, e.g. profiles
+
+    Returns:
+    dictionary: the settings of the section (with its relative paths made relative to the config file),
+                and the model if the config file sets one
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    values = dict(config.get(section, {}))
+    folder = os.path.dirname(os.path.abspath(path))
+    for name in PATHS & set(values):
+        if isinstance(values[name], str) and not os.path.isabs(values[name]):
+            values[name] = os.path.join(folder, values[name])
+    if "model" in config:
+        values.setdefault("model", config["model"])
+    return values
+
+
+def settings(args, namespace, section):
+    """
+    This function takes three arguments and returns the settings of a run: the settings of the config file (if given),
+    replaced by those given on the command line. A setting that is null keeps its default.
+
+    Parameters:
+    arg1 (args): the parsed arguments (see add_arguments), --model replaces the model of the config file
+    arg2 (namespace): the globals of the script
+    arg3 (section): the section of the script in the config file
+
+    Returns:
+    dictionary: the settings that differ from the defaults
+    """
+    values = read_config(args.config, section) if args.config else {}
+    values.update({name: getattr(args, name) for name in namespace["SETTINGS"] if getattr(args, name, None) is not None})
+    if getattr(args, "model", None):
+        values["model"] = args.model
+    unknown = set(values) - set(namespace["SETTINGS"]) - {"model"}
+    if unknown:
+        raise ValueError(f"Unknown settings for {section}: {', '.join(sorted(unknown))}")
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def apply(namespace, values):
+    """ Sets the settings of a script in its globals (the model is set with models.set_default_model) """
+    from models import set_default_model
+    for name, value in values.items():
+        if name == "model":
+            set_default_model(value)
+        else:
+            namespace[name] = value
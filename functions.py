@@ -1,49 +1,36 @@
 from collections import Counter
-import re
-import spacy
 
-nlp = spacy.load("nl_core_news_lg", disable=["ner", "parser"])
-nlp.max_length = 4_000_000  # Or however large the input is
+from ngrams import NgramCounter
+from annotation import SplitCache, SentenceAnnotator, coarse_POS, merge_punctuation, token_chunks, profile_tokens, profile_token_POS
+from models import get_nlp
+
+# Sentences are tagged in batches with nlp.pipe, the spaCy model is only loaded when it is first needed (see models.py)
+annotator = SentenceAnnotator(None, batch_size=256, n_process=1)
 
 """ 
 Here various functions from the get_lexical_features file are stored (slightly adjusted if necessary) to be reused in different scripts 
 """
 
-""" Preprocess the data to get a list of all the words from the interviewee """
+""" Preprocess the data to get a list of all the words from the interviewee, data is the dictionary from splits.json or a SplitCache.
+Next to the text and tokens, the POS category per token is returned """
 def preprocess(data, start, end, Full = False):
+    if not isinstance(data, SplitCache):
+        data = SplitCache(None, data)
     start_ = int(start/5)    
     end_ = int(end/5)
-    texts = list(data.values())[start_:end_]
     if Full:
-        texts = list(data.values())
-    text_ = ""
-    tokens_ = []
-
-    for text in texts:    
-        t1 = text.replace("\n", "")          
-        t2 = re.sub(r'\.{3,}(?=\W)', ' PAUSE', t1)
-        t3 = re.sub(r'…(?=\W)', ' PAUSE', t2)
-        t4 = t3.replace("  ", " ")
-                
-        t5 = re.sub(r'-\s+(?=[A-Z0-9])', ' BREAK ', t4) 
-        t6 = re.sub(r'-\s+(?=[a-z0-9])', ' BREAK ', t5)    
-        text_ += t6
-        text_ = re.sub(r'(\w+)-$', r'\1 BREAK ', text_.strip())
-
-        doc = nlp(text_)
-        tokens = [token.text.lower() for token in doc 
-                  if (token.is_alpha or token.text == ',') 
-                  and token.text not in {"PAUSE", "BREAK"}]
-        tokens_.extend(tokens)
-        
-    return text_, tokens_
+        start_, end_ = 0, len(data)
+    text_ = data.text(start_, end_)
+    tokens_ = data.tokens(start_, end_)
+    pos_ = data.token_POS(start_, end_)
+    return text_, tokens_, pos_
 
 """ Function to obtain sentence length and the counts per sentence length """
 def get_sentence_length(sentences):
     s_length = []
-    for s in sentences:
-        doc = nlp(s)
-        count = sum(1 for token in doc if not token.is_punct and token.text not in ["PAUSE", "BREAK"])
+    for annotation in annotator.annotate(list(sentences)):
+        count = sum(1 for t, punct in zip(annotation["text"], annotation["is_punct"]) 
+                    if not punct and t not in ["PAUSE", "BREAK"])
         if count == 0:
             continue
         s_length.append(count)
@@ -53,24 +40,17 @@ def get_sentence_length(sentences):
 
     return mean, length_counts
 
+""" Obtain the ngrams for all n in n_values, the sentences are tokenised only once (the comma is concatenated with the previous token) """
+def count_ngrams(data, n_values):
+    tokenized = (merge_punctuation(tokens, {','}) for tokens in annotator.tokenize(list(data)))
+    return NgramCounter(n_values).update(tokenized)
+
+def get_ngrams(data, n_values):
+    return count_ngrams(data, n_values).all()
+
 """ Obtain the ngrams """
 def get_ngram(data, n):
-    patterns = []
-    for d in data: 
-        doc = nlp(d) 
-        tokens = []
-        for i, token in enumerate(doc):
-            if token.text == ',' and i > 0:
-                # Concatenate the comma with the previous token
-                tokens[-1] = tokens[-1] + token.text
-            else:
-                tokens.append(token.text)
-        ngrams = zip(*[tokens[i:] for i in range(n)])  
-        patterns.extend([' '.join(ngram) for ngram in ngrams])
-
-    pattern_counter = Counter(patterns)  
-    all_patterns = [pattern for pattern in pattern_counter]
-    return all_patterns
+    return get_ngrams(data, [n])
 
 def get_token_POS(doc):
     """
@@ -82,26 +62,8 @@ def get_token_POS(doc):
     Returns:
     list: A list of POS values for the input tokens
     """
-    pos = []
-    for token in doc:
-        if token.text in {".", "!", "?"}: 
-            continue
-        elif token.text == "PAUSE":
-            pos.append("PAUSE")
-        elif token.text == "BREAK":
-            pos.append("BREAK")
-        elif token.pos_ in {"NOUN", "PROPN"}:
-            pos.append("NOUN")
-        elif token.pos_ in {"CONJ", "SCONJ", "CCONJ"}:
-            pos.append("CONJ")
-        elif token.pos_ in {"VERB", "AUX"}:
-            pos.append("VERB")
-        elif token.pos_ == "INTJ" or token.text.lower() == "eh" or token.text.lower() == "ehm":            
-            pos.append("INTJ")
-        else:
-            pos.append(token.pos_)
-    
-    return pos
+    pos = (coarse_POS(token.text, token.pos_) for token in doc)
+    return [p for p in pos if p is not None]
 
 def frequency_term_POS(tokens, x, target_pos = None):
     """
@@ -121,8 +83,8 @@ def frequency_term_POS(tokens, x, target_pos = None):
     """
     pos_dict = {}
 
-    doc = nlp(" ".join(tokens))  
-    pos_ = get_token_POS(list(doc))  
+    # The tokens are tagged in chunks, so long timeframes never exceed the max_length of the model
+    pos_ = [p for doc in get_nlp().pipe(token_chunks(tokens)) for p in get_token_POS(list(doc))]
 
     for i, t in enumerate(tokens):
         tag = pos_[i]
@@ -140,3 +102,103 @@ def frequency_term_POS(tokens, x, target_pos = None):
         for pos, terms in pos_dict.items()
 }    
     return pos_dict, sorted_counts, common_terms
+
+def frequency_term_POS_tagged(tokens, pos_, x, target_pos = None):
+    """
+    This function returns the same information as frequency_term_POS, 
+    but uses the POS categories that were already assigned to the tokens during preprocessing
+    instead of tagging the tokens again
+    
+    Parameters:
+    arg1 (tokens): the tokens of which we want to know this information
+    arg2 (pos_): the POS category per token, aligned with the tokens (see preprocess)
+    arg3 (x): the variable indicating how much values we want to return
+    arg4 (target_pos): List of POS categories to include in the result
+
+    Returns:
+    dictionary: with the POS category and corresponding tokens
+    list[tuple(pos category, count)]: the pos categories and their counts (ordered descending)
+    dict[pos category, x most common terms]
+    """
+    pos_dict = {}
+    for t, tag in zip(tokens, pos_):
+        if tag in {"PAUSE", "BREAK"}:
+            continue
+        if target_pos and tag not in target_pos:
+            continue
+        pos_dict.setdefault(tag, []).append(t)
+    total_counts = {pos: len(terms) for pos, terms in pos_dict.items()}
+    sorted_counts = sorted(total_counts.items(), key=lambda x: x[1], reverse=True)
+    threshold = 5   # threshold measure 
+    common_terms = {
+        pos: [term for term, count in Counter(terms).most_common(x) if count > threshold]
+        for pos, terms in pos_dict.items()
+}    
+    return pos_dict, sorted_counts, common_terms
+
+
+class ObservedWindows:
+    """
+    The observed statistics of the evaluation windows of one transcript.
+    The terms per POS of a window are merged from the counts per split (weighted as in preprocess, where the
+    tokens of every prefix of the window are added), and the statistics of every window are computed only once.
+    """
+
+    def __init__(self, splits, n_values=(2, 3, 4, 5)):
+        """
+        Parameters:
+        arg1 (splits): the SplitCache of the transcript
+        arg2 (n_values): the n's for the ngrams
+        """
+        self.splits = splits
+        self.n_values = list(n_values)
+        self.split_counts = {}
+        self.term_windows = {}
+        self.ngram_windows = {}
+
+    def counts(self, i):
+        """ Returns the (cached) counts of the (POS category, token) pairs of split i """
+        if i not in self.split_counts:
+            annotation = self.splits.annotation(i)
+            self.split_counts[i] = Counter(zip(profile_token_POS(annotation), profile_tokens(annotation)))
+        return self.split_counts[i]
+
+    def terms(self, start, end, target_pos=None):
+        """
+        This function takes three arguments and returns the terms per POS category of a window with their counts,
+        the same terms (and counts) as frequency_term_POS_tagged returns for preprocess(splits, start, end)
+
+        Parameters:
+        arg1 (start): the start of the window (in minutes)
+        arg2 (end): the end of the window (in minutes)
+        arg3 (target_pos): List of POS categories to include in the result
+
+        Returns:
+        dictionary: with the POS category and a Counter of the corresponding terms
+        """
+        start_, end_ = int(start/5), min(int(end/5), len(self.splits))
+        if (start_, end_) not in self.term_windows:
+            window = Counter()
+            for i in range(start_, end_):
+                weight = end_ - i       # split i is part of end_ - i prefixes of the window
+                for key, count in self.counts(i).items():
+                    window[key] += weight * count
+            self.term_windows[(start_, end_)] = window
+        pos_dict = {}
+        for (tag, t), count in self.term_windows[(start_, end_)].items():
+            if tag in {"PAUSE", "BREAK"}:
+                continue
+            if target_pos and tag not in target_pos:
+                continue
+            pos_dict.setdefault(tag, Counter())[t] = count
+        return pos_dict
+
+    def ngrams(self, start, end, n_values=None):
+        """ Returns all distinct ngrams of a window, as get_ngrams returns for the sentences of preprocess(splits, start, end),
+        for the n's in n_values (a part of the n's of the windows, all of them if None).
+        Sentences can continue over the border of a split, so the ngrams are counted per window (once) instead of per split """
+        start_, end_ = int(start/5), int(end/5)
+        if (start_, end_) not in self.ngram_windows:
+            sentences = self.splits.sentences(start_, end_)
+            self.ngram_windows[(start_, end_)] = count_ngrams(sentences, self.n_values)
+        return self.ngram_windows[(start_, end_)].all(n_values)
@@ -1,60 +1,63 @@
-import spacy
 from collections import Counter
-import re
 import json
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from ngrams import NgramCounter, filter_subsumed
+from annotation_store import open_transcript, close_transcript
+from annotation import SentenceAnnotator, coarse_POS, annotation_POS, split_sentences, token_chunks, merge_punctuation
+from models import get_nlp
+from functions import ObservedWindows
+from profiles import write_profile, EXTENSION
+import config
+import telemetry
+from telemetry import stage
 
 """
 This script was used to extract the lexical profiles per transcript
 """
 
-# Load Dutch spaCy model used for POS tagging and tokenization
-nlp = spacy.load("nl_core_news_lg", disable=["ner", "parser"])
-nlp.max_length = 4_000_000  # Or however large the input is
+# The Dutch spaCy model used for POS tagging and tokenization is only loaded when it is first needed (see models.py),
+# so transcripts with an up-to-date annotation store never load it
+# Sentences are tagged in batches with nlp.pipe, adjust the batch size and nr of processes where necessary
+batch_size = 256
+n_process = 1
+annotator = SentenceAnnotator(None, batch_size=batch_size, n_process=n_process)
+
+
+def load_splits(file_path):
+    """
+    This function takes one argument and returns the annotated splits of the interview,
+    the annotations made in earlier runs are loaded from the annotation store next to splits.json
+    
+    Parameters:
+    arg1 (file_path): the filepath to the splits of the interview
+    
+    Returns:
+    SplitCache: the splits of the interview, each split is parsed only once
+    """
+    return open_transcript(file_path, None, annotator)
 
 
-def preprocess(file_path, timeframe):
+def preprocess(splits, timeframe):
     """
-    This function takes two arguments, one for the file and one for the amount of timeframes, 
+    This function takes two arguments, one for the splits and one for the amount of timeframes, 
     and returns the corresponding text and tokens.
     
     Parameters:
-    arg1 (file_path): the filepath to the interview
+    arg1 (splits): the SplitCache of the interview, see load_splits
     arg2 (timeframe: the integerer corresponding to the nr of timeframes used in the simulation
     
     Returns:
-    string: the cleaned text, list: the tokens from the text
+    string: the cleaned text, list: the tokens from the text, list: the POS category per token
     """
-    with open(file_path, "r", encoding = "utf-8") as file:
-          data = json.load(file)
-    
     # Get the first integer items from the dictionary list
     integer = int(timeframe/5 )
-    texts = list(data.values())[:integer]
-
-    text_ = ""
-    tokens_ = []
-
-    for text in texts:    
-        t1 = text.replace("\n", "")          
-        t2 = re.sub(r'\.{3,}(?=\W)', ' PAUSE', t1)
-        t3 = re.sub(r'…(?=\W)', ' PAUSE', t2)
-        t4 = t3.replace("  ", " ") #.replace(" .", ".")
-                
-        t5 = re.sub(r'-\s+(?=[A-Z0-9])', ' BREAK ', t4) 
-        t6 = re.sub(r'-\s+(?=[a-z0-9])', ' BREAK ', t5)    
-        text_ += t6
-        text_ = re.sub(r'(\w+)-$', r'\1 BREAK ', text_.strip())
-
-
-        doc = nlp(text_)
-        tokens = [token.text.lower() for token in doc 
-                  if (token.is_alpha or token.text == ',') 
-                  and token.text not in {"PAUSE", "BREAK"}]
-        tokens_.extend(tokens)
-
-        
-    return text_, tokens_
+    text_ = splits.text(0, integer)
+    tokens_ = splits.tokens(0, integer)
+    pos_ = splits.token_POS(0, integer)
+    return text_, tokens_, pos_
 
 def get_token_POS(doc):
     """
@@ -66,26 +69,8 @@ def get_token_POS(doc):
     Returns:
     list: A list of POS values for the input tokens
     """
-    pos = []
-    for token in doc:
-        if token.text in {".", "!", "?"}: 
-            continue
-        elif token.text == "PAUSE":
-            pos.append("PAUSE")
-        elif token.text == "BREAK":
-            pos.append("BREAK")
-        elif token.pos_ in {"NOUN", "PROPN"}:
-            pos.append("NOUN")
-        elif token.pos_ in {"CONJ", "SCONJ", "CCONJ"}:
-            pos.append("CONJ")
-        elif token.pos_ in {"VERB", "AUX"}:
-            pos.append("VERB")
-        elif token.pos_ == "INTJ" or token.text.lower() == "eh" or token.text.lower() == "ehm":            
-            pos.append("INTJ")
-        else:
-            pos.append(token.pos_)
-    
-    return pos
+    pos = (coarse_POS(token.text, token.pos_) for token in doc)
+    return [p for p in pos if p is not None]
 
 def sentence_POS(text):
     """
@@ -97,13 +82,10 @@ def sentence_POS(text):
     Returns:
     dictionary: sentence and their corresponding POS structure
     """
-    sentences = re.split(r'(?<=[.!?])\s+|(?<=BREAK)\s+|(?<=\.)', text)
+    sentences = [s for s in split_sentences(text) if s != ""]
     pos_dict = {}
-    for s in sentences:
-        if s == "":
-            continue
-        doc = nlp(s)
-        pos = get_token_POS(doc)
+    for s, annotation in zip(sentences, annotator.annotate(sentences)):
+        pos = annotation_POS(annotation)
         s = s.strip(".!?")
         pos_dict[s] = pos
     return pos_dict
@@ -119,14 +101,39 @@ def get_sentence_length(sentences):
     float: avg sentence length, Any: std
     """
     s_length = []  
-    for s in sentences:
-        doc = nlp(s)
-        count = sum(1 for token in doc if not token.is_punct and token.text != "PAUSE" and token.text != "BREAK")
+    for annotation in annotator.annotate(list(sentences)):
+        count = sum(1 for t, punct in zip(annotation["text"], annotation["is_punct"]) 
+                    if not punct and t != "PAUSE" and t != "BREAK")
         s_length.append(count)
     mean = sum(s_length) / len(s_length)
     return mean
 
 
+def get_ngrams(data, n_values, x):
+    """
+    This function returns the common and all ngrams in the provided data (sentences) for every n in n_values,
+    the sentences are tokenised and counted only once for all the values of n
+    Parameters:
+    arg1 (data): the data, sentences
+    arg2 (n_values): the n's for the ngrams
+    arg3 (x): the parameter indicating how many of the top common we want to return per n
+    
+    Returns:
+    list: the common ngrams, list: all ngrams (both ordered by n)
+    """
+    counter = count_ngrams(data, n_values)
+    threshold = 3   # Threshold measure
+    ngrams_common = counter.common(x, threshold)
+    ngrams_all = counter.all()
+    return ngrams_common, ngrams_all
+
+
+def count_ngrams(data, n_values):
+    """ Returns the NgramCounter of the sentences in data, the sentences are tokenised only once (see get_ngrams) """
+    tokenized = (merge_punctuation(tokens, {',', '.'}) for tokens in annotator.tokenize(list(data)))
+    return NgramCounter(n_values).update(tokenized)
+
+
 def get_ngram(data, n, x):
     """
     This function returns the amount of identical ngrams in the provided data (sentences) where n is specified as argument    
@@ -138,24 +145,7 @@ def get_ngram(data, n, x):
     Returns:
     list[tuple(pattern, int)]
     """
-    patterns = []
-    for d in data: 
-        doc = nlp(d) 
-        tokens = []
-        for i, token in enumerate(doc):
-            if (token.text == ',' or token.text == '.') and i > 0:
-                tokens[-1] = tokens[-1] + token.text
-            else:
-                tokens.append(token.text)
-        # tokens = [token.text for token in doc]  
-        ngrams = zip(*[tokens[i:] for i in range(n)])  
-        patterns.extend([' '.join(ngram) for ngram in ngrams])
-
-    pattern_counter = Counter(patterns)  
-    all_patterns = [pattern for pattern in pattern_counter]
-    threshold = 3   # Threshold measure
-    top_patterns = [pattern for pattern, count in pattern_counter.most_common(x) if count > threshold]  
-    return top_patterns, all_patterns
+    return get_ngrams(data, [n], x)
 
 
 def frequency_term_POS(tokens, x, target_pos = None):
@@ -175,8 +165,8 @@ def frequency_term_POS(tokens, x, target_pos = None):
     dict[pos category, x most common terms]
     """
     pos_dict = {}
-    doc = nlp(" ".join(tokens))  
-    pos_ = get_token_POS(list(doc))  
+    # The tokens are tagged in chunks, so long timeframes never exceed the max_length of the model
+    pos_ = [p for doc in get_nlp().pipe(token_chunks(tokens)) for p in get_token_POS(list(doc))]
 
     for i, t in enumerate(tokens):
         tag = pos_[i]
@@ -195,17 +185,182 @@ def frequency_term_POS(tokens, x, target_pos = None):
     return pos_dict, sorted_counts, common_terms
 
 
+def frequency_term_POS_tagged(tokens, pos_, x, target_pos = None):
+    """
+    This function returns the same information as frequency_term_POS, 
+    but uses the POS categories that were already assigned to the tokens during preprocessing
+    instead of tagging the tokens again
+    
+    Parameters:
+    arg1 (tokens): the tokens of which we want to know this information
+    arg2 (pos_): the POS category per token, aligned with the tokens (see preprocess)
+    arg3 (x): the variable indicating how much values we want to return
+    arg4 (target_pos): List of POS categories to include in the result
+
+    Returns:
+    dictionary: with the POS category and corresponding tokens
+    list[tuple(pos category, count)]: the pos categories and their counts (ordered descending)
+    dict[pos category, x most common terms]
+    """
+    pos_dict = {}
+    for t, tag in zip(tokens, pos_):
+        if tag in {"PAUSE", "BREAK"}:
+            continue
+        if target_pos and tag not in target_pos:
+            continue
+        pos_dict.setdefault(tag, []).append(t)
+    total_counts = {pos: len(terms) for pos, terms in pos_dict.items()}
+    sorted_counts = sorted(total_counts.items(), key=lambda x: x[1], reverse=True)
+    threshold = 5   # threshold measure 
+    common_terms = {
+        pos: [term for term, count in Counter(terms).most_common(x) if count > threshold]
+        for pos, terms in pos_dict.items()
+}    
+    return pos_dict, sorted_counts, common_terms
+
+
 ### Here, the database for the features used in lexical alignment will be created. 
 ### The top x amount of ngrams / words are stored in a separate part of this database.
-### Loop through all the interview transcriptions
+### The interview transcriptions are processed in parallel, one transcript per worker
 
 # A set list of timeframes is chosen for which the lexical profiles are obtained. Adjust where necessary
 timeframes = [5,10,15,20,25,30]     ## Training data
 # timeframes = [10]                   ## Holdout data
 
-directory = "Data"
-for transcript in os.listdir(directory):
-    # transcript = "1413"
+directory = "Data"      # Switch to holdout folder if necessary
+workers = min(4, os.cpu_count() or 1)      # The nr of transcripts that are processed at the same time (every worker loads its own spaCy model)
+skip_up_to_date = False     # Skip the transcripts of which the profiles are newer than their splits.json
+profile_format = "json"     # "json", or "binary" for the compact format of profiles.py (read with profiles.read_profile)
+## The size of the profiles
+target_pos = ["NOUN", "PRON", "CONJ", "ADJ", "VERB", "ADV"]     # The POS categories in the profile
+top_x = 20          # The nr of terms included per POS category, this was used for the training data
+# top_x = {"CONJ": 5, "ADJ": 5, "PRON": 10, "NOUN": 10, "VERB": 10, "ADV": 10}    ## This was used for the holdout data
+threshold = 5       # A term is only included when it occurs more often than this
+n_values = [2,3,4,5]    # The n's for the ngrams
+ngram_top_x = 3     # The nr of ngrams included per n
+ngram_threshold = 3     # An ngram is only included when it occurs more often than this
+filter_ngrams = True        # Remove the common ngrams that are contained in another common ngram (previously done by postprocessing_profiles.py)
+profile_folder = "Lexical_profiles"     # The folder of the transcript in which the profiles are written
+
+## The settings that can be changed with a config file (section "profiles") or on the command line, see config.py
+SETTINGS = ["directory", "timeframes", "workers", "skip_up_to_date", "profile_format", "profile_folder", "target_pos",
+            "top_x", "threshold", "n_values", "ngram_top_x", "ngram_threshold", "filter_ngrams", "batch_size", "n_process"]
+
+
+def configure(values, report=False):
+    """ Sets the settings of the run (see config.py), in the main process and in every worker,
+    with the report the telemetry of the process is enabled with the statistics of its sentence caches """
+    config.apply(globals(), values)
+    annotator.batch_size, annotator.n_process = batch_size, n_process
+    if report:
+        telemetry.enable()
+        telemetry.register_cache("sentences", lambda: {"tagged": len(annotator.tagged), "tokenized": len(annotator.tokenized)})
+
+
+def profile_path(dir, timeframe):
+    extension = EXTENSION if profile_format == "binary" else '.json'
+    return os.path.join(dir, profile_folder, str(timeframe) + "_database" + extension)
+
+
+def up_to_date(dir):
+    """ Returns whether all profiles of the transcript exist and are newer than its splits.json """
+    try:
+        splits_time = os.path.getmtime(os.path.join(dir, "splits" + '.json'))
+    except OSError:
+        # A folder without splits.json is not skipped, its failure is reported by run_transcript
+        return False
+    paths = [profile_path(dir, timeframe) for timeframe in timeframes]
+    return all(os.path.exists(p) and os.path.getmtime(p) >= splits_time for p in paths)
+
+
+def write_database(p, database):
+    """ Writes a profile (JSON or the compact format, see profile_format),
+    it is first written to a temporary file so an interrupted run never leaves a partial profile """
+    os.makedirs(os.path.dirname(p), exist_ok=True) 
+    if profile_format == "binary":
+        write_profile(p, database)
+    else:
+        with open(p + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(database, f, ensure_ascii=False, indent=4)
+        os.replace(p + ".tmp", p)
+
+
+def count_timeframe(splits, timeframe, n_values=(2, 3, 4, 5)):
+    """
+    This function takes three arguments and returns the counts of a timeframe,
+    from which the profiles of every size (top x, thresholds, n's) are made with make_profile
+
+    Parameters:
+    arg1 (splits): the SplitCache of the interview, see load_splits
+    arg2 (timeframe): the integer corresponding to the nr of timeframes used in the simulation
+    arg3 (n_values): the n's for the ngrams
+
+    Returns:
+    dictionary: the terms per POS category, the terms per POS category with their counts (ordered descending),
+                and the NgramCounter of the sentences
+    """
+    # The splits are streamed instead of preprocessed into one text and token list (see preprocess), the terms are counted
+    # per split and the sentences are split from the text as it is joined, so the timeframe is never held as a whole
+    integer = int(timeframe/5)
+
+    # The sentences are used for the ngrams, each sentence is only counted once (as the keys of sentence_POS)
+    with stage("ngram extraction"):
+        sentences = dict.fromkeys(s.strip(".!?") for s in splits.sentences(0, integer) if s != "")
+        ngrams = count_ngrams(sentences, n_values)
+
+    # These target_pos is determined by the affected properties in dementia speech
+    with stage("counting"):
+        POS_terms = ObservedWindows(splits).terms(0, timeframe, target_pos)
+    return {
+        "terms": {pos: list(terms) for pos, terms in POS_terms.items()},
+        # Counter.most_common keeps the order of first occurrence for equal counts, so the most common x terms
+        # are the first x of this table for every x
+        "tables": {pos: terms.most_common() for pos, terms in POS_terms.items()},
+        "ngrams": ngrams,
+    }
+
+
+def make_profile(counts, x, threshold=5, n_values=(2, 3, 4, 5), ngram_x=3, ngram_threshold=3):
+    """
+    This function takes six arguments and returns the profile (POS categories and ngrams) of a timeframe
+
+    Parameters:
+    arg1 (counts): the counts of the timeframe, see count_timeframe
+    arg2 (x): the nr of terms included per POS category, or a dictionary with the nr per POS category
+    arg3 (threshold): the frequency threshold of the terms
+    arg4 (n_values): the n's for the ngrams, a part of the n's that were counted
+    arg5 (ngram_x): the nr of ngrams included per n
+    arg6 (ngram_threshold): the frequency threshold of the ngrams
+
+    Returns:
+    dictionary: the profile, without the ID
+    """
+    database = {}
+    for pos, terms in counts["terms"].items():
+        x_pos = x.get(pos, 0) if isinstance(x, dict) else x
+        database[pos] = {
+            "terms": list(dict.fromkeys(terms)),  # only save each term once, in order of occurrence
+            "common": [term for term, count in counts["tables"][pos][:x_pos] if count > threshold]
+        }
+
+    # Here, the ngrams are retrieved, and stored in the database
+    ngrams_common = counts["ngrams"].common(ngram_x, ngram_threshold, n_values)
+    if filter_ngrams:
+        ngrams_common = filter_subsumed(ngrams_common)
+    database["ngrams"] = {
+        "ngrams_all": counts["ngrams"].all(n_values),
+        "common": ngrams_common
+    }
+    return database
+
+
+def build_profiles(transcript):
+    """
+    This function takes one argument and creates the lexical profiles of the transcript for all timeframes
+    
+    Parameters:
+    arg1 (transcript): the transcript number (name of the folder in directory)
+    """
     print(f"Processing: {transcript}")
     ID = transcript.strip()  
     database = {}
@@ -214,59 +369,71 @@ for transcript in os.listdir(directory):
     }
 
     # Get the file of transcripts splits for this ID
-    dir = os.path.join("Data", ID)      # Switch to holdout folder if necessary
+    dir = os.path.join(directory, ID)
     file_path = os.path.join(dir, "splits" + '.json')
+    with stage("annotation store"):
+        splits = load_splits(file_path)     # Every split is parsed once and reused for all timeframes
+    with stage("annotation"):
+        for i in range(min(int(max(timeframes)/5), len(splits))):
+            splits.annotation(i)
 
     for timeframe in timeframes:
         print(f"Timeframe: {timeframe}")
-        # Preprocess the transcribed data, note that the integer here represents the used timeframes
-        text, tokens = preprocess(file_path, timeframe)    
-
-        # Here, the lexical features are extracted and stored in the database. 
-        # Note that there is a frequency threshold specified within the function itself. 
-        pos_structure = sentence_POS(text)
-        sentences = list(pos_structure.keys())  # Text per sentences
-        POS = list(pos_structure.values())      # POS categories per sentence
-                                                    
-        # These target_pos is determined by the affected properties in dementia speech
-        # The integer represents the nr of terms included per POS category
-
-        ## This line was used for the training data
-        POS_terms, _, POS_common = frequency_term_POS(tokens, 20, target_pos=["NOUN", "PRON", "CONJ", "ADJ", "VERB", "ADV"]) 
-        
-        ## These lines were used for the holdout data
-        # POS_terms_1, _, POS_common_1 = frequency_term_POS(tokens,5, target_pos=["CONJ", "ADJ"])  
-        # POS_terms_2, _, POS_common_2 = frequency_term_POS(tokens, 10, target_pos=["PRON","NOUN", "VERB", "ADV"])   
-        # POS_terms = {**POS_terms_1, **POS_terms_2}
-        # POS_common = {**POS_common_1, **POS_common_2}                                                                     
-        
-        for pos in POS_terms:
-            database[pos] = {
-                "terms": list(set(POS_terms[pos])),  # only save each term once
-                "common": POS_common.get(pos, [])
-            }
-
-
-        # Here, the ngrams are retrieved, and stored in the database 
-        # Note that there is a frequency threshold specified within the function itself.
-        n_values = [2,3,4,5]
-        ngrams_common = []
-        ngrams_all = []
-        for n in n_values:
-            ngrams, all_ngrams = get_ngram(sentences, int(n), 3)    # The integer represent the amount of ngrams to be returned
-            ngrams_common.extend(ngrams)
-            ngrams_all.extend(all_ngrams)
-        database["ngrams"] = {
-            "ngrams_all": ngrams_all,
-            "common": ngrams_common
-        }
-
-        # Get the interview excerpt
-        file_path_ov = os.path.join(dir, "transcript_overview.json")
+        # The tokens, sentences and ngrams of the timeframe are counted once, the profile takes the most common of them
+        counts = count_timeframe(splits, timeframe, n_values)
+        with stage("profile"):
+            database.update(make_profile(counts, top_x, threshold, n_values, ngram_top_x, ngram_threshold))
 
         # Finally the database is created as a JSON file
-        q = os.path.join(dir, "Lexical_profiles")
-        os.makedirs(q, exist_ok=True) 
-        p = os.path.join(q, str(timeframe) + "_database" + '.json')
-        with open(p, "w", encoding="utf-8") as f:
-            json.dump(database, f, ensure_ascii=False, indent=4)
+        with stage("profile I/O"):
+            write_database(profile_path(dir, timeframe), database)
+
+    # Store the annotations that were made for this interview
+    with stage("annotation store"):
+        close_transcript(file_path, splits, annotator)
+
+
+def run_transcript(transcript):
+    """ Runs build_profiles for one transcript, a failure is returned instead of stopping the other transcripts,
+    the telemetry of the transcript is returned with it (see telemetry.take) """
+    try:
+        with telemetry.processing(transcript.strip()):
+            build_profiles(transcript)
+        return transcript, None, telemetry.take()
+    except Exception as e:
+        return transcript, f"{type(e).__name__}: {e}", telemetry.take()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the lexical profiles per transcript")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    parser.add_argument("--report", default=None, help="write a run report with the time per stage to this file (.json or .csv)")
+    parser.add_argument("--profile", default=None, help="dump the cProfile statistics of the run to this file (use workers = 1)")
+    config.add_arguments(parser, config.defaults(globals()))
+    args = parser.parse_args()
+    values = config.settings(args, globals(), "profiles")
+    configure(values, bool(args.report))
+
+    # Only the transcript folders, the data directory also holds metadata.csv and lemmas.sqlite
+    transcripts = sorted(f for f in os.listdir(directory) if f.isdigit())
+    if skip_up_to_date:
+        transcripts = [t for t in transcripts if not up_to_date(os.path.join(directory, t.strip()))]
+
+    # Every worker loads the spaCy model at most once, and only if it has to annotate something
+    with telemetry.profiled(args.profile):
+        if workers and workers > 1 and len(transcripts) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(values, bool(args.report))) as pool:
+                results = list(pool.map(run_transcript, transcripts))
+        else:
+            results = [run_transcript(transcript) for transcript in transcripts]
+
+    failed = [(transcript, error) for transcript, error, _ in results if error]
+    for transcript, error in failed:
+        print(f"Failed: {transcript} ({error})")
+    print(f"Processed {len(results) - len(failed)} of {len(results)} transcripts")
+
+    if args.report:
+        for _, _, taken in results:
+            telemetry.merge(taken)
+        telemetry.write_report(args.report)
+        telemetry.print_totals()
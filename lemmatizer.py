@@ -0,0 +1,137 @@
+import json
+import sqlite3
+from collections import OrderedDict
+from functools import lru_cache
+
+from models import get_nlp, model_key, use
+
+"""
+Here the lemmatisation used in the evaluation is stored.
+Words and ngrams are lemmatised word by word from a word -> lemma table, which is kept on disk between runs,
+so the ngram strings never need to be parsed again.
+The table only holds the lemmas of the words on their own, which are lemmatised in batches with only the components
+needed for the lemmas, so it is the same whatever the order of the transcripts and workers.
+The lemmas that were produced during the annotation of a transcript are used next to it (see set_context),
+they are kept in memory for that transcript only.
+"""
+
+# The version of the table, the tables of earlier versions (which also held lemmas in context) are emptied
+TABLE_FORMAT = 2
+
+def words(item):
+    """ Returns the lowercased words of a word or ngram (the ngrams are joined with spaces, see get_ngram) """
+    return item.lower().split(" ")
+
+
+class Lemmatizer:
+    """
+    Lemmatisation with a persistent word -> lemma table and a bounded in-memory LRU cache in front of it.
+    """
+
+    def __init__(self, model, path, maxsize=100_000, batch_size=256):
+        """
+        Parameters:
+        arg1 (model): the spaCy model (or its name), None for the default model, it is only loaded for new words
+        arg2 (path): the path of the table on disk (sqlite)
+        arg3 (maxsize): the maximum number of words and ngrams kept in memory
+        arg4 (batch_size): the number of words per batch passed to nlp.pipe
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS lemmas (word TEXT PRIMARY KEY, lemma TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        key = json.dumps(dict(model_key(model), format=TABLE_FORMAT), sort_keys=True)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row is None or row[0] != key:
+            # The lemmas of another model (or an earlier version of the table) are not reused
+            self.db.execute("DELETE FROM lemmas")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('model', ?)", (key,))
+        self.db.commit()
+        self.context_key = None
+        self.context = {}       # word -> lemma in the annotations of the current transcript
+        self.maxsize = maxsize
+        self.cache = OrderedDict()      # LRU cache of the words
+        self.lemmatize = lru_cache(maxsize=maxsize)(self._lemmatize)
+
+    def word(self, word):
+        """ Returns the lemma of a single word """
+        if word in self.context:
+            return self.context[word]
+        if word in self.cache:
+            self.cache.move_to_end(word)
+            return self.cache[word]
+        row = self.db.execute("SELECT lemma FROM lemmas WHERE word = ?", (word,)).fetchone()
+        if row is None:
+            self.prepare([word])
+            row = self.db.execute("SELECT lemma FROM lemmas WHERE word = ?", (word,)).fetchone()
+        self.cache[word] = row[0]
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return row[0]
+
+    def _lemmatize(self, item):
+        return " ".join(self.word(w) for w in words(item))
+
+    def missing(self, words):
+        """ Returns the words that are not in the table yet """
+        missing = []
+        for i in range(0, len(words), 500):
+            chunk = words[i:i + 500]
+            found = self.db.execute(
+                f"SELECT word FROM lemmas WHERE word IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            found = {w for (w,) in found}
+            missing.extend(w for w in chunk if w not in found)
+        return missing
+
+    def set_context(self, key, annotations):
+        """
+        This function takes two arguments and sets the transcript of which the lemmas are used before those of the table,
+        the first lemma of a word in the annotations is used. The lemmas of the previous transcript are no longer used.
+
+        Parameters:
+        arg1 (key): the identification of the transcript (e.g. the path of its splits.json), nothing changes if it is the current one
+        arg2 (annotations): the annotations of the transcript (see annotation.annotate_doc), in the order of the splits
+        """
+        if key == self.context_key:
+            return
+        self.context_key = key
+        self.context = {}
+        for annotation in annotations:
+            for t, lemma in zip(annotation["text"], annotation["lemma"]):
+                self.context.setdefault(t.lower(), lemma)
+        # The lemmatised items depend on the context
+        self.lemmatize.cache_clear()
+
+    def prepare(self, words):
+        """ Lemmatises the words that are not in the table yet, in one batch """
+        missing = self.missing([w for w in dict.fromkeys(words) if w not in self.cache and w not in self.context])
+        if not missing:
+            return
+        nlp = get_nlp(self.model)
+        with use(nlp, "lemmatizer"):
+            docs = nlp.pipe(missing, batch_size=self.batch_size)
+            pairs = [(w, " ".join(token.lemma_ for token in doc)) for w, doc in zip(missing, docs)]
+        self.db.executemany("INSERT OR IGNORE INTO lemmas VALUES (?, ?)", pairs)
+        self.db.commit()
+
+    def lemmatize_all(self, items):
+        """
+        This function takes one argument and returns the lemmatised words or ngrams,
+        all words that are not in the table yet are lemmatised in one batch first
+
+        Parameters:
+        arg1 (items): the words or ngrams
+
+        Returns:
+        list: the lemmatised items
+        """
+        self.prepare([w for item in dict.fromkeys(items) for w in words(item)])
+        return [self.lemmatize(item) for item in items]
+
+    def cache_info(self):
+        """ Returns the hits and misses of the in-memory cache of the items """
+        return self.lemmatize.cache_info()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,202 @@
+import re
+import heapq
+from bisect import bisect_left, insort
+from operator import itemgetter
+
+from annotation import clean_split, annotate_doc, split_sentences, merge_punctuation, profile_tokens, profile_token_POS
+from ngrams import NgramCounter, filter_subsumed
+from models import get_nlp, use
+
+"""
+Here the online lexical profile is stored, for a profile that follows a speaker during a conversation.
+Utterances are added as they arrive, the counts of the terms per POS category and of the ngrams are updated
+with the new utterance only, so the history is never processed again.
+The terms and ngrams that occur more often than the threshold are also kept in order of their count,
+so the most common ones are read from the front of that order instead of being sorted for every query.
+"""
+
+
+class Ranking:
+    """
+    Counts of items, of which the items counted more than floor times are kept in order of their count (descending)
+    and first occurrence, the same order as Counter.most_common.
+    """
+
+    def __init__(self, floor=0):
+        """
+        Parameters:
+        arg1 (floor): only the items counted more than floor times are kept in order
+        """
+        self.floor = floor
+        self.counts = {}        # item -> count, in order of first occurrence
+        self.first = {}         # item -> nr of its first occurrence
+        self.items = []         # nr of the first occurrence -> item
+        self.ranked = []        # (-count, first) of the items counted more than floor times, sorted
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, k=1):
+        """ Adds k to the count of an item """
+        count = self.counts.get(item, 0)
+        if count == 0:
+            self.first[item] = len(self.items)
+            self.items.append(item)
+        first = self.first[item]
+        if count > self.floor:
+            del self.ranked[bisect_left(self.ranked, (-count, first))]
+        self.counts[item] = count + k
+        if count + k > self.floor:
+            insort(self.ranked, (-count - k, first))
+
+    def most_common(self, x=None):
+        """ Returns the x most common items with their counts (all items if x is None), as Counter.most_common """
+        if x is None:
+            return sorted(self.counts.items(), key=itemgetter(1), reverse=True)
+        return heapq.nlargest(x, self.counts.items(), key=itemgetter(1))
+
+    def common(self, x, threshold):
+        """
+        This function takes two arguments and returns the items of the x most common items that occur
+        more often than the threshold, without sorting the counts when the threshold is not below floor
+
+        Parameters:
+        arg1 (x): the nr of most common items
+        arg2 (threshold): the frequency threshold
+
+        Returns:
+        list: the items (ordered by count)
+        """
+        if threshold < self.floor:
+            return [item for item, count in self.most_common(x) if count > threshold]
+        return [self.items[first] for count, first in self.ranked[:x] if -count > threshold]
+
+
+class LexicalProfile:
+    """
+    Lexical profile of one speaker that is updated per utterance.
+    The snapshots are the same as those of the offline functions for the utterances added so far:
+    the common terms as frequency_term_POS_tagged returns for their tokens and POS categories,
+    and the common ngrams as get_ngram returns for their (distinct) sentences.
+    """
+
+    def __init__(self, model=None, target_pos=None, n_values=(2, 3, 4, 5), threshold=5, ngram_threshold=3):
+        """
+        Parameters:
+        arg1 (model): the spaCy model (or its name), None for the default model, it is only loaded for the first utterance
+        arg2 (target_pos): List of POS categories to include in the profile, all if None
+        arg3 (n_values): the n's for the ngrams
+        arg4 (threshold): the frequency threshold of the terms, the common terms above it are kept in order
+        arg5 (ngram_threshold): the frequency threshold of the ngrams, the common ngrams above it are kept in order
+        """
+        self.model = model
+        self.target_pos = target_pos
+        self.n_values = list(n_values)
+        self.threshold = threshold
+        self.ngram_threshold = ngram_threshold
+        self.terms = {}             # POS category -> Ranking of the terms
+        self.ngrams = NgramCounter(self.n_values)       # Only used for the token IDs, the counts are in ngram_counts
+        self.ngram_counts = {n: Ranking(ngram_threshold) for n in self.n_values}
+        self.sentences = set()      # Every sentence is counted once, as in the offline profiles (see count_timeframe)
+        self.utterances = 0
+
+    @property
+    def nlp(self):
+        return get_nlp(self.model)
+
+    def update(self, utterance):
+        """
+        This function takes one argument and adds an utterance to the profile,
+        the utterance is annotated once and the sentences in it are tokenised for the ngrams
+
+        Parameters:
+        arg1 (utterance): the text of the utterance, cleaned as a split of splits.json (see annotation.clean_split)
+        """
+        piece = re.sub(r'(\w+)-$', r'\1 BREAK ', clean_split(utterance).strip())
+        nlp = self.nlp
+        with use(nlp, "lemmatizer"):
+            annotation = annotate_doc(nlp(piece))
+        sentences = [s.strip(".!?") for s in split_sentences(piece) if s != ""]
+        new = list(dict.fromkeys(s for s in sentences if s not in self.sentences))
+        tokenized = [[token.text for token in doc] for doc in nlp.tokenizer.pipe(new)]
+        self.add(annotation, zip(new, tokenized))
+
+    def add(self, annotation, sentences):
+        """
+        This function takes two arguments and adds an annotated utterance to the profile
+
+        Parameters:
+        arg1 (annotation): the annotation of the utterance, as returned by annotation.annotate_doc
+        arg2 (sentences): the (sentence, tokens) pairs of the sentences of the utterance, stripped of .!?
+        """
+        for tag, t in zip(profile_token_POS(annotation), profile_tokens(annotation)):
+            if tag in {"PAUSE", "BREAK"}:
+                continue
+            if self.target_pos and tag not in self.target_pos:
+                continue
+            if tag not in self.terms:
+                self.terms[tag] = Ranking(self.threshold)
+            self.terms[tag].add(t)
+
+        for s, tokens in sentences:
+            if s in self.sentences:
+                continue
+            self.sentences.add(s)
+            ids = [self.ngrams.intern(t) for t in merge_punctuation(tokens, {',', '.'})]
+            length = len(ids)
+            for i in range(length):
+                for n in self.n_values:
+                    if i + n <= length:
+                        self.ngram_counts[n].add(tuple(ids[i:i + n]))
+        self.utterances += 1
+
+    def common_terms(self, x, threshold=None):
+        """ Returns the x most common terms per POS category that occur more often than the threshold """
+        threshold = self.threshold if threshold is None else threshold
+        return {pos: ranking.common(x, threshold) for pos, ranking in self.terms.items()}
+
+    def counts(self):
+        """ Returns the POS categories and their nr of terms (ordered descending), as frequency_term_POS """
+        totals = {pos: sum(ranking.counts.values()) for pos, ranking in self.terms.items()}
+        return sorted(totals.items(), key=lambda x: x[1], reverse=True)
+
+    def common_ngrams(self, x, threshold=None, n_values=None):
+        """ Returns the x most common ngrams per n that occur more often than the threshold (ordered by n) """
+        threshold = self.ngram_threshold if threshold is None else threshold
+        common = []
+        for n in n_values or self.n_values:
+            common.extend(self.ngrams.string(key) for key in self.ngram_counts[n].common(x, threshold))
+        return common
+
+    def ngrams_all(self, n_values=None):
+        """ Returns all distinct ngrams (ordered by n and first occurrence) """
+        return [self.ngrams.string(key) for n in n_values or self.n_values for key in self.ngram_counts[n].counts]
+
+    def snapshot(self, x, ngram_x=3, filter_ngrams=True):
+        """
+        This function takes three arguments and returns the profile of the utterances so far,
+        in the same form as the offline profiles (see get_lexical_features.make_profile)
+
+        Parameters:
+        arg1 (x): the nr of terms included per POS category, or a dictionary with the nr per POS category
+        arg2 (ngram_x): the nr of ngrams included per n
+        arg3 (filter_ngrams): remove the common ngrams that are contained in another common ngram
+
+        Returns:
+        dictionary: the profile, without the ID
+        """
+        database = {}
+        for pos, ranking in self.terms.items():
+            x_pos = x.get(pos, 0) if isinstance(x, dict) else x
+            database[pos] = {
+                "terms": list(ranking.counts),
+                "common": ranking.common(x_pos, self.threshold)
+            }
+        ngrams_common = self.common_ngrams(ngram_x)
+        if filter_ngrams:
+            ngrams_common = filter_subsumed(ngrams_common)
+        database["ngrams"] = {
+            "ngrams_all": self.ngrams_all(),
+            "common": ngrams_common
+        }
+        return database
@@ -0,0 +1,79 @@
+import contextlib
+
+"""
+Here the spaCy models are loaded, only when they are first needed and only once per process.
+All scripts share the models from this registry, spaCy itself is only imported when a model is needed,
+so importing the scripts is fast and runs that only use stored annotations never load a model.
+"""
+
+# The Dutch spaCy model used for POS tagging, lemmatisation and tokenization, can be changed with --model
+# (blank:nl is a blank Dutch pipeline, which only tokenizes)
+default_model = "nl_core_news_lg"
+
+# The components that are needed per task, the other components are disabled while they are used
+COMPONENTS = {
+    "tokenizer": [],
+    "tagger": ["tok2vec", "morphologizer", "tagger", "attribute_ruler"],
+    "lemmatizer": ["tok2vec", "morphologizer", "tagger", "attribute_ruler", "lemmatizer"],
+}
+
+models = {}
+wrap = None     # Function that is applied to every model when it is loaded (see telemetry.py)
+
+
+def set_default_model(name):
+    """ Sets the model that is used when no model is specified, e.g. nl_core_news_sm """
+    global default_model
+    default_model = name
+
+
+def model_name(model=None):
+    """ Returns the name of a model, model is a name, a loaded spaCy model or None for the default model """
+    if model is None:
+        return default_model
+    if isinstance(model, str):
+        return model
+    return f"{model.meta.get('lang', '')}_{model.meta.get('name', '')}"
+
+
+def get_nlp(model=None):
+    """
+    This function takes one argument and returns the loaded spaCy model, the model is loaded on first use
+
+    Parameters:
+    arg1 (model): the name of the model, a loaded spaCy model (returned as is) or None for the default model
+
+    Returns:
+    Language: the spaCy model
+    """
+    if model is not None and not isinstance(model, str):
+        return model
+    name = model_name(model)
+    if name not in models:
+        import spacy
+        if name.startswith("blank:"):
+            # A blank pipeline (e.g. blank:nl) only has the tokenizer, it needs no download (see benchmark.py)
+            nlp = spacy.blank(name.split(":", 1)[1])
+        else:
+            nlp = spacy.load(name, disable=["ner", "parser"])
+        if wrap is not None:
+            nlp = wrap(nlp)
+        models[name] = nlp
+    return models[name]
+
+
+def model_key(model=None):
+    """ Returns the identification of a model (name and versions), without loading the model """
+    import spacy
+    if model is not None and not isinstance(model, str):
+        version = model.meta.get("version", "")
+    else:
+        version = spacy.util.get_package_version(model_name(model)) or ""
+    return {"model": model_name(model), "version": version, "spacy": spacy.__version__}
+
+
+def use(nlp, components):
+    """ Returns a context in which only the components needed for the task (see COMPONENTS) are enabled """
+    if components not in COMPONENTS:
+        return contextlib.nullcontext()
+    return nlp.select_pipes(enable=[p for p in COMPONENTS[components] if p in nlp.pipe_names])
@@ -0,0 +1,112 @@
+import heapq
+from operator import itemgetter
+
+"""
+Here the ngrams of all orders are counted in one pass over the tokenised sentences.
+Tokens are interned to integer IDs and the ngrams are stored as tuples of IDs,
+the ngram strings are only created for the ngrams that are returned.
+"""
+
+
+class NgramCounter:
+    """
+    Counts of the ngrams for every n in n_values.
+    The counts keep the order in which the ngrams were first seen, as a Counter over the ngram strings would.
+    """
+
+    def __init__(self, n_values=(2, 3, 4, 5)):
+        """
+        Parameters:
+        arg1 (n_values): the n's for the ngrams
+        """
+        self.n_values = list(n_values)
+        self.ids = {}
+        self.words = []
+        self.counts = {n: {} for n in self.n_values}
+
+    def intern(self, token):
+        """ Returns the integer ID of a token """
+        i = self.ids.get(token)
+        if i is None:
+            i = self.ids[token] = len(self.words)
+            self.words.append(token)
+        return i
+
+    def add(self, tokens):
+        """ Adds the ngrams of one tokenised sentence to the counts, using one sliding window for all n """
+        ids = [self.intern(t) for t in tokens]
+        length = len(ids)
+        for i in range(length):
+            for n in self.n_values:
+                if i + n > length:
+                    continue
+                key = tuple(ids[i:i + n])
+                counts = self.counts[n]
+                counts[key] = counts.get(key, 0) + 1
+
+    def update(self, sentences):
+        """ Adds the ngrams of all the tokenised sentences """
+        for tokens in sentences:
+            self.add(tokens)
+        return self
+
+    def string(self, key):
+        """ Returns the ngram string of an ngram key """
+        return ' '.join(self.words[i] for i in key)
+
+    def most_common(self, n, x):
+        """ Returns the x most common ngrams of order n with their counts, ties in order of first occurrence """
+        top = heapq.nlargest(x, self.counts[n].items(), key=itemgetter(1))
+        return [(self.string(key), count) for key, count in top]
+
+    def common(self, x, threshold, n_values=None):
+        """
+        This function takes three arguments and returns the x most common ngrams per n,
+        that occur more often than the threshold
+
+        Parameters:
+        arg1 (x): the parameter indicating how many of the top common we want to return per n
+        arg2 (threshold): the frequency threshold
+        arg3 (n_values): the n's to return, a part of the counted n's (all counted n's if None)
+
+        Returns:
+        list: the common ngrams (ordered by n)
+        """
+        common = []
+        for n in n_values or self.n_values:
+            common.extend([pattern for pattern, count in self.most_common(n, x) if count > threshold])
+        return common
+
+    def iter_all(self, n_values=None):
+        """ Yields all distinct ngram strings (ordered by n), for the n's in n_values (all counted n's if None) """
+        for n in n_values or self.n_values:
+            for key in self.counts[n]:
+                yield self.string(key)
+
+    def all(self, n_values=None):
+        """ Returns all distinct ngram strings (ordered by n), for the n's in n_values (all counted n's if None) """
+        return list(self.iter_all(n_values))
+
+
+def filter_subsumed(ngrams):
+    """
+    This function takes one argument and returns the ngrams that are not contained in another ngram of the list,
+    where an ngram is contained if its tokens are a consecutive part of the tokens of the other ngram.
+    The contained parts of every ngram are collected in one index (of token-ID sequences), so each ngram is
+    only compared with the index instead of with every other ngram.
+
+    Parameters:
+    arg1 (ngrams): list of ngram strings (tokens joined with spaces)
+
+    Returns:
+    list: the ngrams that are not contained in another ngram (in the same order)
+    """
+    ids = {}
+    keys = [tuple(ids.setdefault(t, len(ids)) for t in n.split(" ")) for n in ngrams]
+    contained = set()
+    for key in set(keys):
+        length = len(key)
+        for size in range(1, length):
+            for i in range(length - size + 1):
+                contained.add(key[i:i + size])
+    return [n for n, key in zip(ngrams, keys) if key not in contained]
@@ -0,0 +1,357 @@
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Evaluation"))
+
+import preprocessing_data as pre
+import get_lexical_features as glf
+import evaluation_LA as ev
+import config
+import telemetry
+from telemetry import stage
+from annotation_store import content_hash, store_path, write_store, close_transcript, annotation_size
+from models import model_key
+
+"""
+This script runs the whole pipeline (preprocessing_data.py, annotation_store.py, get_lexical_features.py and evaluation_LA.py)
+and only rebuilds what is out of date, like make.
+The stages form a chain per transcript:  ingest (DOCX -> splits.json) -> annotate (annotations.json.gz)
+-> profile (<timeframe>_database.json, the ngrams are filtered while the profile is made) -> evaluate (result shard per timeframe),
+after which the shards are merged into the results file.
+Every artifact has an entry in a manifest (manifest.json in the folder of the transcript, ingest_manifest.json for the DOCX files)
+with the content hash of its inputs, the hash of the parameters it was made with and its own content hash.
+An artifact is rebuilt when it is missing or changed, or when its inputs or parameters changed. A rebuilt artifact with the same
+content as before (e.g. a profile of which only the unused terms changed) does not make the artifacts after it out of date.
+The settings are those of the scripts, from the sections of a config file (--config, see config.py), the profiles that are made
+are the profiles that are evaluated.
+"""
+
+MANIFEST_NAME = "manifest.json"
+INGEST_MANIFEST_NAME = "ingest_manifest.json"
+
+
+def params_hash(params):
+    """ Returns the hash of the parameters of an artifact """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def file_entry(path, hash_=None):
+    """ Returns the content hash of a file with its size and modification time """
+    st = os.stat(path)
+    return {"hash": hash_ or content_hash(path), "stat": [st.st_size, st.st_mtime_ns]}
+
+
+def file_hash(path, entry=None):
+    """ Returns the content hash of a file, the hash of its entry is reused when the file has the same size and modification time """
+    st = os.stat(path)
+    if entry and entry.get("stat") == [st.st_size, st.st_mtime_ns]:
+        return entry["hash"]
+    return content_hash(path)
+
+
+def unchanged(path, entry):
+    """ Returns whether a file exists with the content hash of its entry """
+    return os.path.exists(path) and file_hash(path, entry) == entry["hash"]
+
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    # The manifest is first written to a temporary file so an interrupted run never leaves a partial manifest
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def artifact_entry(stage_, folder, path, inputs, params):
+    """ Returns the manifest entry of an artifact that was just built, its path is relative to the folder of the manifest """
+    return dict(stage=stage_, path=os.path.relpath(path, folder), inputs=inputs, params=params_hash(params), **file_entry(path))
+
+
+def fresh(entry, folder, path, inputs, params, check_output=True):
+    """
+    This function takes six arguments and returns whether an artifact is up to date
+
+    Parameters:
+    arg1 (entry): the manifest entry of the artifact, None if it was never built
+    arg2 (folder): the folder of the manifest
+    arg3 (path): the path of the artifact
+    arg4 (inputs): the content hashes of the inputs of the artifact
+    arg5 (params): the parameters of the artifact
+    arg6 (check_output): also check that the artifact was not changed since it was built
+
+    Returns:
+    bool: True if the artifact exists and was built from the same inputs and parameters
+    """
+    if not entry or entry["path"] != os.path.relpath(path, folder) or not os.path.exists(path):
+        return False
+    if entry["inputs"] != inputs or entry["params"] != params_hash(params):
+        return False
+    return not check_output or unchanged(path, entry)
+
+
+## The parameters of the artifacts, an artifact is rebuilt when they change
+def ingest_params():
+    return {"speakers": pre.SPEAKERS}
+
+def annotate_params(key):
+    return {"model": key}
+
+def profile_params(key, timeframe):
+    return {
+        "model": key, "timeframe": timeframe, "target_pos": glf.target_pos, "top_x": glf.top_x, "threshold": glf.threshold,
+        "n_values": glf.n_values, "ngram_top_x": glf.ngram_top_x, "ngram_threshold": glf.ngram_threshold,
+        "filter_ngrams": glf.filter_ngrams, "profile_format": glf.profile_format,
+    }
+
+def evaluate_params(key, timeframe):
+    return {"model": key, "timeframe": timeframe, "split_increase": ev.split_increase, "n_values": ev.n_values, "POS": ev.POS_list}
+
+
+def ingest(force=False, dry_run=False):
+    """
+    This function takes two arguments and preprocesses the DOCX files that are new or changed (see preprocessing_data.py),
+    the metadata csv file is written again from the manifest when a file was preprocessed
+
+    Parameters:
+    arg1 (force): preprocess all files
+    arg2 (dry_run): only return the files that are out of date
+
+    Returns:
+    list: the files that were (or would be) preprocessed, list: the files that failed with their error, list: the telemetry of the workers
+    """
+    if not os.path.isdir(pre.directory):
+        # There are no DOCX files, the transcripts in the data directory are used as they are
+        return [], [], []
+    manifest_path = os.path.join(pre.data_directory, INGEST_MANIFEST_NAME)
+    manifest = {} if force else read_manifest(manifest_path)
+    params = params_hash(ingest_params())
+
+    stale = []
+    for filename in sorted(os.listdir(pre.directory)):
+        path = os.path.join(pre.directory, filename)
+        entry = manifest.get(filename)
+        source = file_hash(path, entry and entry["source"])
+        if not (entry and entry["source"]["hash"] == source and entry["params"] == params and all(
+                unchanged(os.path.join(pre.data_directory, entry["ID"], name), e) for name, e in entry["outputs"].items())):
+            stale.append((filename, source))
+    if dry_run or not stale:
+        return [filename for filename, _ in stale], [], []
+
+    files = [os.path.join(pre.directory, filename) for filename, _ in stale]
+    if pre.workers and pre.workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=pre.workers, initializer=configure, initargs=(settings, telemetry.enabled)) as pool:
+            results = list(pool.map(pre.run_file, files))
+    else:
+        results = [pre.run_file(file_path) for file_path in files]
+
+    failed = []
+    for (filename, source), (file_path, meta, error, _) in zip(stale, results):
+        if error:
+            failed.append((filename, error))
+            continue
+        ID, time = meta
+        folder = os.path.join(pre.data_directory, ID)
+        manifest[filename] = {
+            "source": file_entry(file_path, source),
+            "params": params,
+            "ID": ID,
+            "time": time,
+            "outputs": {name: file_entry(os.path.join(folder, name)) for name in ["splits.json", "transcript_overview.json"]},
+        }
+    os.makedirs(pre.data_directory, exist_ok=True)
+    write_manifest(manifest_path, manifest)
+
+    # Store the metadata of all interviews, in the order of the files as preprocessing_data.py does
+    os.makedirs(os.path.dirname(pre.metadata_path) or ".", exist_ok=True)
+    with open(pre.metadata_path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Transcript Number", "Time in min"])
+        writer.writerows([entry["ID"], entry["time"]] for _, entry in sorted(manifest.items()))
+    os.replace(pre.metadata_path + ".tmp", pre.metadata_path)
+    return [filename for filename, _ in stale], failed, [taken for _, _, _, taken in results]
+
+
+def build_transcript(transcript, force=False, dry_run=False):
+    """
+    This function takes three arguments and rebuilds the artifacts of one transcript that are out of date:
+    the annotations, the profile and the result shard per timeframe
+
+    Parameters:
+    arg1 (transcript): the transcript number (name of the folder in the data directory)
+    arg2 (force): rebuild all artifacts
+    arg3 (dry_run): only return the artifacts that are out of date, a profile that is out of date makes its shard out of date
+
+    Returns:
+    list: the artifacts that were (or would be) rebuilt, e.g. profile 10
+    """
+    folder = os.path.join(glf.directory, transcript)
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    manifest = {} if force else read_manifest(manifest_path)
+    file_path = os.path.join(folder, "splits" + '.json')
+    key = model_key()
+    rebuilt = []
+    splits = None
+
+    def get_splits():
+        # The transcript is only opened when something has to be built, and only once for all stages
+        nonlocal splits
+        if splits is None:
+            with stage("annotation store"):
+                splits = glf.load_splits(file_path)
+        return splits
+
+    try:
+        manifest["splits"] = dict(path="splits.json", **file_entry(file_path, file_hash(file_path, manifest.get("splits"))))
+        inputs = {"splits": manifest["splits"]["hash"]}
+
+        # The annotation store is also extended by the other scripts, so only its inputs and parameters are checked
+        path = store_path(file_path)
+        if not fresh(manifest.get("annotate"), folder, path, inputs, annotate_params(key), check_output=False):
+            rebuilt.append("annotate")
+            if not dry_run:
+                with stage("annotation"):
+                    for i in range(len(get_splits())):
+                        splits.annotation(i)
+                with stage("annotation store"):
+                    write_store(file_path, splits, glf.annotator)
+                splits.stored = annotation_size(splits, glf.annotator)
+                manifest["annotate"] = artifact_entry("annotate", folder, path, inputs, annotate_params(key))
+
+        for timeframe in glf.timeframes:
+            path = glf.profile_path(folder, timeframe)
+            params = profile_params(key, timeframe)
+            entry = manifest.get(f"profile/{timeframe}")
+            if fresh(entry, folder, path, inputs, params):
+                continue
+            rebuilt.append(f"profile {timeframe}")
+            if dry_run:
+                manifest[f"profile/{timeframe}"] = None
+                continue
+            counts = glf.count_timeframe(get_splits(), timeframe, glf.n_values)
+            database = {"ID": {"transcript number": transcript}}
+            with stage("profile"):
+                database.update(glf.make_profile(counts, glf.top_x, glf.threshold, glf.n_values, glf.ngram_top_x, glf.ngram_threshold))
+            with stage("profile I/O"):
+                glf.write_database(path, database)
+            manifest[f"profile/{timeframe}"] = artifact_entry("profile", folder, path, inputs, params)
+
+        for timeframe in glf.timeframes:
+            path = ev.shard_path(transcript, timeframe)
+            params = evaluate_params(key, timeframe)
+            profile = manifest.get(f"profile/{timeframe}")
+            shard_inputs = dict(inputs, profile=profile and profile["hash"])
+            if profile and fresh(manifest.get(f"evaluate/{timeframe}"), folder, path, shard_inputs, params):
+                continue
+            rebuilt.append(f"evaluate {timeframe}")
+            if dry_run:
+                continue
+            # The evaluation uses the same annotated splits, and the sentences that were already tokenised
+            if transcript not in ev.opened:
+                ev.get_transcript(transcript, get_splits())
+                ev.annotator.clear()
+                ev.annotator.tokenized.update(glf.annotator.tokenized)
+            ev.profiles.cache.pop((transcript, timeframe), None)
+            ev.evaluate_shard(transcript, timeframe)
+            manifest[f"evaluate/{timeframe}"] = artifact_entry("evaluate", folder, path, shard_inputs, params)
+    finally:
+        if splits is not None:
+            # Store the annotations that were made for this transcript, including the sentences tokenised for the evaluation
+            glf.annotator.tokenized.update(ev.annotator.tokenized)
+            with stage("annotation store"):
+                close_transcript(file_path, splits, glf.annotator)
+            ev.opened.clear()
+        if not dry_run:
+            # The artifacts that were built before a failure are kept in the manifest, so a rerun continues after them
+            write_manifest(manifest_path, manifest)
+    return rebuilt
+
+
+def run_transcript(transcript, force=False, dry_run=False):
+    """ Runs build_transcript for one transcript, a failure is returned instead of stopping the other transcripts,
+    the telemetry of the transcript is returned with it (see telemetry.take) """
+    try:
+        with telemetry.processing(transcript):
+            rebuilt = build_transcript(transcript, force, dry_run)
+        return transcript, rebuilt, None, telemetry.take()
+    except Exception as e:
+        return transcript, None, f"{type(e).__name__}: {e}", telemetry.take()
+
+
+## The settings of the scripts, per section of the config file
+settings = {"preprocessing": {}, "profiles": {}, "evaluation": {}}
+
+def configure(values, report=False):
+    """ Sets the settings of the scripts (see config.py), in the main process and in every worker,
+    the profiles that are evaluated are the profiles that are made """
+    global settings
+    settings = values
+    pre.configure(values["preprocessing"], report)
+    glf.configure(values["profiles"], report)
+    ev.configure(dict(values["evaluation"], directory=glf.directory, profile_folder=glf.profile_folder), report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline, only the artifacts that are out of date are rebuilt")
+    parser.add_argument("--config", default=None, help="JSON file with the settings of the scripts (see config.json)")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    parser.add_argument("--force", action="store_true", help="rebuild all artifacts")
+    parser.add_argument("--dry-run", action="store_true", help="only list the artifacts that are out of date")
+    parser.add_argument("--report", default=None, help="write a run report with the time per stage to this file (.json or .csv)")
+    args = parser.parse_args()
+    values = {
+        "preprocessing": config.settings(args, vars(pre), "preprocessing"),
+        "profiles": config.settings(args, vars(glf), "profiles"),
+        "evaluation": config.settings(args, vars(ev), "evaluation"),
+    }
+    configure(values, bool(args.report))
+
+    ingested, failed, taken = ingest(args.force, args.dry_run)
+    for filename in ingested:
+        print(f"{'Out of date' if args.dry_run else 'Ingested'}: {filename}")
+
+    transcripts = sorted(f for f in os.listdir(glf.directory)
+                         if f.isdigit() and os.path.exists(os.path.join(glf.directory, f, "splits" + '.json')))
+    os.makedirs(ev.shard_dir, exist_ok=True)
+    if glf.workers and glf.workers > 1 and len(transcripts) > 1:
+        with ProcessPoolExecutor(max_workers=glf.workers, initializer=configure, initargs=(values, bool(args.report))) as pool:
+            results = list(pool.map(run_transcript, transcripts, [args.force] * len(transcripts), [args.dry_run] * len(transcripts)))
+    else:
+        results = [run_transcript(transcript, args.force, args.dry_run) for transcript in transcripts]
+
+    for transcript, rebuilt, error, _ in results:
+        if error:
+            failed.append((transcript, error))
+        elif rebuilt:
+            print(f"{'Out of date' if args.dry_run else 'Rebuilt'}: {transcript} ({', '.join(rebuilt)})")
+    for name, error in failed:
+        print(f"Failed: {name} ({error})")
+    print(f"{sum(1 for _, rebuilt, _, _ in results if rebuilt == [])} of {len(results)} transcripts were up to date")
+
+    ## The shards are merged again when one of them was rebuilt
+    units = [(transcript, timeframe) for transcript in transcripts for timeframe in glf.timeframes]
+    results_file = os.path.splitext(ev.results_path)[0] + ev.EXTENSIONS[ev.results_format]
+    if args.dry_run:
+        pass
+    elif failed:
+        print(f"{len(failed)} transcripts failed, the results are not merged")
+    elif any(r.startswith("evaluate") for _, rebuilt, _, _ in results for r in rebuilt) or not os.path.exists(results_file):
+        with stage("results I/O"):
+            ev.merge_shards(units)
+        print(f"Written: {results_file}")
+
+    if args.report:
+        for t in taken + [taken for _, _, _, taken in results]:
+            telemetry.merge(t)
+        telemetry.write_report(args.report)
+        telemetry.print_totals()
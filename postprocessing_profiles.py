@@ -1,38 +1,41 @@
 import os
 import json
+import argparse
+
+import config
+
+from ngrams import filter_subsumed
 
 """ 
 This script was used as a postprocessng step of the created profiles per transcript.
+get_lexical_features.py now filters the ngrams while creating the profiles (filter_ngrams),
+so this script is only needed for profiles that were created without it.
 """
 
-## Filter out subsets of ngrams
+## Filter out subsets of ngrams, an ngram is removed when its tokens are part of another ngram (see ngrams.filter_subsumed)
 def filter_ngrams(ngrams):
-    result = []
-    for n in ngrams:
-        sub = False
-        for other in ngrams:
-            if n != other and n in other:
-                sub = True
-                break  
-        if not sub:
-            result.append(n)
-    return result
-
-## Obtain the database per transcript
-directory = "Data"      # switch to Holdout folder when necessary                  
-folders = [f for f in os.listdir(directory) if f.isdigit()]
+    return filter_subsumed(ngrams)
 
+
+## Settings, switch to the Holdout folder and timeframes when necessary
+directory = "Data"
 timeframes = [5,10,15,20,25,30]     ## Training data
 # timeframes = [10]                 ## Holdout data
+profile_folder = "Lexical_profiles"     # The folder of the transcript with the profiles that are filtered
+
+## The settings that can be changed with a config file (section "postprocessing") or on the command line, see config.py
+SETTINGS = ["directory", "timeframes", "profile_folder"]
 
-## Loop over all the transcripts
-for transcript in folders:
-    print(transcript)
-    path = os.path.join(directory, transcript)
 
+def postprocess_transcript(transcript):
+    """
+    This function takes one argument and filters the common ngrams of the profiles of the transcript for all timeframes
+    
+    Parameters:
+    arg1 (transcript): the transcript number (name of the folder in directory)
+    """
     # Get the file of the database for the current transcript and timeframe
-    dir = os.path.join(directory, transcript)
-    folder_d = os.path.join(dir, "Lexical_profiles")
+    folder_d = os.path.join(directory, transcript, profile_folder)
     for timeframe in timeframes:
         file_d = os.path.join(folder_d, str(timeframe) + "_database.json")
         with open(file_d, "r", encoding = "utf-8") as file:
@@ -42,3 +45,18 @@ for transcript in folders:
         database['ngrams']["common"] = ngrams_new
         with open(file_d, "w", encoding="utf-8") as file:
             json.dump(database, file, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter the common ngrams of existing profiles")
+    config.add_arguments(parser, config.defaults(globals()))
+    args = parser.parse_args()
+    config.apply(globals(), config.settings(args, globals(), "postprocessing"))
+
+    ## Obtain the database per transcript
+    folders = [f for f in os.listdir(directory) if f.isdigit()]
+
+    ## Loop over all the transcripts
+    for transcript in folders:
+        print(transcript)
+        postprocess_transcript(transcript)
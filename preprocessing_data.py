@@ -2,6 +2,12 @@ from docx import Document
 import json
 import re
 import os
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+import telemetry
 
 """ 
 This script was used for data preprocessing.
@@ -9,61 +15,92 @@ This script is based on the transcripts as provided to us in a docx format,
 some parts might need to be adjusted when running on transcripts in slightly different formats.
 """
 
+## The speakers of which only the timecodes are kept, next to the interviewer of the transcript
+SPEAKERS = ["Z", "Y2", "Y3"]
+
+TIMECODE = re.compile(r'\[\d+\s*min\.?\]')
+TIME_MARKER = re.compile(r"\(\d{1,2}:\d{2}:\d{2}\)|\d{1,2}:\d{2} - \d{1,2}:\d{2}")
+
+def write_json(path, data):
+    # The file is first written to a temporary file so an interrupted run never leaves a partial file
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(path + ".tmp", path)
+
 def extract_text(path):
     doc = Document(path)   
-    text = []
 
-    # Extract metadata from the interview and save this in csv file
+    # Extract metadata from the interview, this is stored in the metadata csv file
     ID, name, time, respondent, interviewer = get_meta(doc)
 
-    # Get the text from the document
-    for para in doc.paragraphs:
-        if para.text.strip():  
-            text.append(para.text)
-    full_text = "\n".join(text)
-
-    # Obtain the transcripts of text from the respondent per timeframe
-    full_text = strip(full_text, speaker_label='Z')
-    full_text = strip(full_text, speaker_label='Y2')
-    full_text = strip(full_text, speaker_label='Y3')
-    full_text = strip(full_text, speaker_label=interviewer)
-
-    # Remove time markers like (0:02:35) (0:02:35). and 0:20 - 0:30
-    full_text = re.sub(r"\(\d{1,2}:\d{2}:\d{2}\)|\d{1,2}:\d{2} - \d{1,2}:\d{2}", "", full_text)
-    full_text = re.sub("\n", " ", full_text)   
-    full_text = re.sub("  ", " ", full_text)    
-    text_overview = re.sub(rf"({respondent}|Y1):", "ANSWER_", full_text)
-    full_text = re.sub(rf"({respondent}|Y1):", "", full_text)
+    # Obtain the transcripts of text from the respondent per timeframe,
+    # the other speakers and the time markers are removed in one pass over the lines of the paragraphs
+    full_text = strip_speakers(paragraph_lines(doc), SPEAKERS + [interviewer], [respondent, "Y1"])
+    full_text = full_text.replace("\n", " ")
+    full_text = full_text.replace("  ", " ")
+    label = re.compile(rf"({respondent}|Y1):")
+    text_overview = label.sub("ANSWER_", full_text)
+    full_text = label.sub("", full_text)
 
     # Create the directory
-    directory = os.path.join("Data", ID)
+    directory = os.path.join(data_directory, ID)
     os.makedirs(directory, exist_ok=True)  
     
     # Store the overview of transcript
     json_path = os.path.join(directory, "transcript_overview" + '.json')
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(text_overview, f, ensure_ascii=False, indent = 4)
+    write_json(json_path, text_overview)
 
     transcript_by_splits = parse_interview(full_text)
 
     # Store the transcript per split
     json_path_split = os.path.join(directory, "splits" + '.json')
-    with open(json_path_split, "w", encoding="utf-8") as f:
-        json.dump(transcript_by_splits, f, ensure_ascii=False, indent=4)
-
-
-def strip(text, speaker_label):
-    # This extracts the speaker's content, their responses and time markers
-    pattern = rf'\n?{speaker_label}:\s*.*?(?=\n\w+:|\Z)' 
-    def clean_match(match):
-        lines = match.group().splitlines()
-        cleaned = []
-        for line in lines:
-            timecodes = re.findall(r'\[\d+\s*min\.?\]', line)
-            if timecodes:
-                cleaned.extend(timecodes)
-        return '\n'.join(cleaned) + '\n' if cleaned else ''
-    return re.sub(pattern, clean_match, text, flags=re.DOTALL)
+    write_json(json_path_split, transcript_by_splits)
+    return ID, time
+
+
+def paragraph_lines(doc):
+    """ Yields the lines of the non-empty paragraphs of the document, one paragraph at a time """
+    for para in doc.paragraphs:
+        if para.text.strip():
+            yield from para.text.split("\n")
+
+def strip_speakers(lines, speakers, others=()):
+    """
+    This function takes three arguments and returns the text without the turns of the given speakers,
+    of which only the timecodes (e.g. [5 min]) are kept, and without time markers like (0:02:35) and 0:20 - 0:30.
+    A turn starts at a line that starts with a label (e.g. Z:) and continues up to the next line that starts with a label,
+    the labels may contain spaces and hyphens (e.g. Jan-Willem de Vries:).
+    A turn without text (e.g. "I: ") ends at the next line, where the former regex of strip also removed the turn after it.
+    
+    Parameters:
+    arg1 (lines): the lines of the transcript
+    arg2 (speakers): the labels of the speakers that are removed
+    arg3 (others): the labels of the speakers that are kept (e.g. the respondent and Y1)
+    
+    Returns:
+    string: the text
+    """
+    speakers = set(speakers)
+    # A line that starts with one of the labels starts a new turn
+    label = re.compile("(%s):" % "|".join(map(re.escape, list(speakers) + list(others))))
+    pieces = []
+    timecodes = None        # The timecodes of the turn that is removed, None while the turn is kept
+    for i, line in enumerate(lines):
+        match = label.match(line)
+        if match:
+            if timecodes is not None:
+                pieces.append("\n".join(timecodes) + "\n" if timecodes else "")
+            timecodes = [] if match.group(1) in speakers else None
+        if timecodes is not None:
+            # The line break before a removed turn is removed with it
+            timecodes.extend(TIMECODE.findall(line))
+            continue
+        if i > 0:
+            pieces.append("\n")
+        pieces.append(TIME_MARKER.sub("", line))
+    if timecodes is not None:
+        pieces.append("\n".join(timecodes) + "\n" if timecodes else "")
+    return "".join(pieces)
 
 def parse_interview(text):
     text = text.replace("\n", " ")
@@ -102,15 +139,71 @@ def get_meta(doc):
     
 
 
+def run_file(file_path):
+    """ Runs extract_text for one transcript, a failure is returned instead of stopping the other transcripts,
+    the telemetry of the transcript is returned with it (see telemetry.take) """
+    try:
+        with telemetry.stage("ingestion", os.path.basename(file_path)):
+            meta = extract_text(file_path)
+        return file_path, meta, None, telemetry.take()
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}", telemetry.take()
+
+
 # Here, we loop through the different interview transcripts and call the function
 # This will create a data directory with a separate directory for each interview, containing its
 # splits.json                       per timeframe
 # transcript_overview.json          per answer
-
-directory = "Transcripties"                   
-for filename in os.listdir(directory):
-    print(filename)
-    file_path = os.path.join(directory, filename)
-    extract_text(file_path)
-
-
+# and the metadata csv file (transcript number and time in minutes per interview)
+
+directory = "Transcripties"
+data_directory = "Data"     # The directory in which a directory per interview is created
+metadata_path = os.path.join(data_directory, "metadata.csv")
+workers = os.cpu_count()    # The nr of transcripts that are processed at the same time
+
+## The settings that can be changed with a config file (section "preprocessing") or on the command line, see config.py
+SETTINGS = ["directory", "data_directory", "metadata_path", "workers"]
+
+def configure(values, report=False):
+    """ Sets the settings of the run (see config.py), in the main process and in every worker,
+    metadata_path follows data_directory unless it is set itself """
+    global metadata_path
+    config.apply(globals(), values)
+    if "metadata_path" not in values:
+        metadata_path = os.path.join(data_directory, "metadata.csv")
+    if report:
+        telemetry.enable()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess the transcripts")
+    parser.add_argument("--report", default=None, help="write a run report with the time per stage to this file (.json or .csv)")
+    parser.add_argument("--profile", default=None, help="dump the cProfile statistics of the run to this file (use workers = 1)")
+    config.add_arguments(parser, config.defaults(globals()))
+    args = parser.parse_args()
+    values = config.settings(args, globals(), "preprocessing")
+    configure(values, bool(args.report))
+
+    files = [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))]
+    with telemetry.profiled(args.profile):
+        if workers and workers > 1 and len(files) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(values, bool(args.report))) as pool:
+                results = list(pool.map(run_file, files))
+        else:
+            results = [run_file(file_path) for file_path in files]
+
+    for file_path, meta, error, _ in results:
+        print(file_path if not error else f"Failed: {file_path} ({error})")
+
+    # Store the metadata of all interviews
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    with open(metadata_path + ".tmp", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["Transcript Number", "Time in min"])
+        writer.writerows(meta for _, meta, error, _ in results if not error)
+    os.replace(metadata_path + ".tmp", metadata_path)
+
+    if args.report:
+        for _, _, _, taken in results:
+            telemetry.merge(taken)
+        telemetry.write_report(args.report)
+        telemetry.print_totals()
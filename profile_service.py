@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import math
+import time
+import socket
+import asyncio
+import argparse
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Evaluation"))
+
+import evaluation_LA as ev
+from LA_evaluation import CandidateScorer
+from lexical_profile import LexicalProfile
+from profiles import ProfileRepository
+from models import set_default_model
+
+"""
+Here the local profile service is stored, for a dialogue agent that aligns to a speaker during the conversation.
+The service keeps the lexical profiles and the lemma table in memory and answers the requests of local clients
+over a Unix socket (or a localhost TCP port where Unix sockets are not available).
+Every request and response is one line of JSON, e.g. {"op": "score", "speaker": "1", "candidates": ["..."]}.
+The requests of all clients are answered in batches by one worker thread, so the event loop keeps reading requests
+while a batch is scored, and the candidates of the pending score requests of the same profile are scored at once.
+
+Requests (the profile is a live profile of a speaker, or a stored profile of a transcript at a timeframe):
+    {"op": "profile", "speaker": ...} or {"op": "profile", "transcript": ..., "timeframe": ...}
+    {"op": "update", "speaker": ..., "utterance": ...}
+    {"op": "score", "speaker": ... (or transcript and timeframe), "candidates": [...], "pos": [...] (optional)}
+    {"op": "stats"}
+"""
+
+## Settings of the service
+socket_path = os.path.join(ev.directory, "profile_service.sock")     # Used when no port is given
+host = "127.0.0.1"
+top_x = 20              # The nr of terms per POS category in the live profiles
+ngram_top_x = 3         # The nr of ngrams per n in the live profiles
+latency_window = 10_000     # The nr of latest requests per op of which the latency is reported
+scorer_cache_size = 64      # The nr of profiles of which the scorer (see LA_evaluation.CandidateScorer) is kept in memory
+
+
+def percentile(values, q):
+    """ Returns the q-th percentile (nearest rank) of the values """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class ProfileService:
+    """
+    The state of the service: the live profiles per speaker, the stored profiles (their common lists, see evaluation_LA.common_lists)
+    and the latencies of the latest requests. It is only used by the worker thread of the service (see serve).
+    """
+
+    def __init__(self, model=None):
+        """
+        Parameters:
+        arg1 (model): the spaCy model (or its name), None for the default model, it is only loaded when it is needed
+        """
+        self.model = model
+        self.live = {}
+        self.latencies = {}
+        self.scorers = OrderedDict()
+        # The lemmas of a profile are only needed by its scorer, which lemmatises the profile itself
+        self.profiles = ProfileRepository(ev.directory, ev.profile_folder, maxsize=ev.profile_cache_size, prepare=ev.common_lists)
+
+    def handle(self, request):
+        """ Returns the response to a request """
+        op = request.get("op")
+        if op == "profile":
+            return {"profile": self.get_profile(request)}
+        if op == "update":
+            speaker = str(request["speaker"])
+            if speaker not in self.live:
+                self.live[speaker] = LexicalProfile(self.model, target_pos=ev.POS_list)
+            self.live[speaker].update(request["utterance"])
+            return {"utterances": self.live[speaker].utterances}
+        if op == "score":
+            return self.score(request)
+        if op == "stats":
+            return self.stats()
+        raise ValueError(f"Unknown op: {op}")
+
+    def handle_batch(self, batch):
+        """
+        This function takes one argument and returns the responses to a batch of pending requests, in the order of the batch.
+        The candidates of the score requests with the same scorer are scored at once, the scorer of a live profile is
+        taken when its request is reached, so a score request is answered with the profile of its place in the batch.
+
+        Parameters:
+        arg1 (batch): list of (line, start), the request as it was read and the time (time.perf_counter) it was read
+
+        Returns:
+        list: the responses
+        """
+        responses = [None] * len(batch)
+        ops = [None] * len(batch)
+        pending = {}    # scorer -> the requests (index, request) of which the candidates are not scored yet
+        for i, (line, _) in enumerate(batch):
+            try:
+                request = json.loads(line)
+                ops[i] = request.get("op")
+                if ops[i] == "score":
+                    pending.setdefault(self.scorer(request), []).append((i, request))
+                else:
+                    responses[i] = self.handle(request)
+            except Exception as e:
+                responses[i] = {"error": f"{type(e).__name__}: {e}"}
+        for scorer, requests in pending.items():
+            try:
+                scores = self.score_all(scorer, [request["candidates"] for _, request in requests])
+            except Exception:
+                # The requests are scored one by one, so that only the failing requests get an error
+                scores = []
+                for _, request in requests:
+                    try:
+                        scores.append(self.score_all(scorer, [request["candidates"]])[0])
+                    except Exception as e:
+                        scores.append({"error": f"{type(e).__name__}: {e}"})
+            for (i, _), response in zip(requests, scores):
+                responses[i] = response
+        for (_, start), op in zip(batch, ops):
+            self.record(op, time.perf_counter() - start)
+        return responses
+
+    def get_profile(self, request):
+        """ Returns the common lists of the requested profile (the common terms per POS category and the common ngrams) """
+        if "speaker" in request:
+            profile = self.live.get(str(request["speaker"]))
+            if profile is None:
+                raise KeyError(f"No utterances of speaker {request['speaker']}")
+            common = profile.common_terms(top_x)
+            common = {pos: common.get(pos, []) for pos in ev.POS_list}
+            common["ngram"] = profile.common_ngrams(ngram_top_x)
+            return common
+        return self.profiles.get(request["transcript"], int(request["timeframe"]))
+
+    def scorer(self, request):
+        """ Returns the (cached) CandidateScorer of the requested profile and POS categories """
+        keys = tuple(request.get("pos") or ev.POS_list)
+        if "speaker" in request:
+            speaker = str(request["speaker"])
+            # The scorer of a live profile is made again after every update
+            key = ("speaker", speaker, self.live[speaker].utterances if speaker in self.live else 0, keys)
+        else:
+            key = ("transcript", str(request["transcript"]), int(request["timeframe"]), keys)
+        if key in self.scorers:
+            self.scorers.move_to_end(key)
+            return self.scorers[key]
+        common = self.get_profile(request)
+        words = list(dict.fromkeys(w for pos in keys for w in common[pos]))
+        self.scorers[key] = CandidateScorer(words, common["ngram"], ev.get_lemmatizer().lemmatize_all, model=self.model)
+        if len(self.scorers) > scorer_cache_size:
+            self.scorers.popitem(last=False)
+        return self.scorers[key]
+
+    def score(self, request):
+        """
+        This function takes one argument and returns the metrics of candidate responses, compared with a profile,
+        all candidates of the request are scored in one batch (see LA_evaluation.CandidateScorer)
+
+        Parameters:
+        arg1 (request): the request, with the profile, the candidates and optionally the POS categories that are compared
+
+        Returns:
+        dictionary: per match type (Exact, Lemma) the recall, coverage, cosine similarity and ngram overlap of every candidate
+        """
+        return self.score_all(self.scorer(request), [request["candidates"]])[0]
+
+    def score_all(self, scorer, requests):
+        """ Returns the responses to score requests with the same scorer (given their candidates), scored in one batch """
+        scores = scorer.score([c for candidates in requests for c in candidates])
+        responses, start = [], 0
+        for candidates in requests:
+            end = start + len(candidates)
+            responses.append({matchtype: {metric: values[start:end].tolist() for metric, values in metrics.items()}
+                              for matchtype, metrics in scores.items()})
+            start = end
+        return responses
+
+    def record(self, op, seconds):
+        if op not in self.latencies:
+            self.latencies[op] = deque(maxlen=latency_window)
+        self.latencies[op].append(seconds * 1000)
+
+    def stats(self):
+        """ Returns the nr of requests and the mean, p50 and p99 latency (ms) per op, over the latest requests """
+        return {op: {"requests": len(ms), "mean": sum(ms) / len(ms), "p50": percentile(ms, 50), "p99": percentile(ms, 99)}
+                for op, ms in self.latencies.items() if ms}
+
+
+async def serve(service, path=None, port=None):
+    """
+    This function takes three arguments and answers the requests of the clients until it is stopped
+
+    Parameters:
+    arg1 (service): the ProfileService
+    arg2 (path): the path of the Unix socket, used when no port is given
+    arg3 (port): the localhost TCP port
+    """
+    # The requests wait in the queue with the future of their response, the service (with the sqlite connection
+    # of its lemma table) is only used by the one thread of the executor
+    queue = asyncio.Queue()
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    async def worker():
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                responses = await loop.run_in_executor(executor, service.handle_batch, [(line, start) for line, start, _ in batch])
+            except Exception as e:
+                responses = [{"error": f"{type(e).__name__}: {e}"}] * len(batch)
+            for (_, _, future), response in zip(batch, responses):
+                if not future.done():
+                    future.set_result(response)
+
+    async def connection(reader, writer):
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            future = loop.create_future()
+            await queue.put((line, time.perf_counter(), future))
+            response = await future
+            writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+        writer.close()
+
+    if port is None:
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(connection, path)
+    else:
+        server = await asyncio.start_server(connection, host, port)
+    print(f"Serving on {path if port is None else f'{host}:{port}'}")
+    task = asyncio.create_task(worker())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        task.cancel()
+        executor.shutdown(wait=False)
+
+
+class ProfileClient:
+    """ Client of the profile service, every method sends one request and returns the response """
+
+    def __init__(self, path=socket_path, port=None, timeout=60):
+        """
+        Parameters:
+        arg1 (path): the path of the Unix socket of the service, used when no port is given
+        arg2 (port): the localhost TCP port of the service
+        arg3 (timeout): the timeout of a request in seconds
+        """
+        if port is None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.socket.makefile("rb")
+
+    def request(self, request):
+        """ Sends a request and returns the response, a failed request raises a RuntimeError """
+        self.socket.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def profile(self, **profile):
+        return self.request({"op": "profile", **profile})["profile"]
+
+    def update(self, speaker, utterance):
+        return self.request({"op": "update", "speaker": speaker, "utterance": utterance})
+
+    def score(self, candidates, pos=None, **profile):
+        return self.request({"op": "score", "candidates": candidates, "pos": pos, **profile})
+
+    def stats(self):
+        return self.request({"op": "stats"})
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the lexical profiles to local clients")
+    parser.add_argument("--socket", default=socket_path, help="the path of the Unix socket")
+    parser.add_argument("--port", type=int, default=None, help="serve on this localhost TCP port instead of a Unix socket")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    args = parser.parse_args()
+    if args.model:
+        set_default_model(args.model)
+
+    service = ProfileService()
+    try:
+        asyncio.run(serve(service, args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # The latencies of the requests are reported when the service stops
+        for op, stats in service.stats().items():
+            print(f"{op}: {stats['requests']} requests, mean {stats['mean']:.2f} ms, p50 {stats['p50']:.2f} ms, p99 {stats['p99']:.2f} ms")
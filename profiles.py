@@ -0,0 +1,223 @@
+import os
+import json
+import argparse
+import zlib
+import struct
+from collections import OrderedDict
+from collections.abc import Mapping
+
+"""
+Here the compact (binary) format of the lexical profiles is stored.
+A profile file starts with a small header holding everything except the bulky vocabularies (the terms per POS
+and ngrams_all), i.e. the common lists that are used by the evaluation. The bulky vocabularies follow as separate
+compressed sections, which are only read and parsed when they are accessed.
+
+Layout: MAGIC, format version (1 byte), header length (4 bytes), header (JSON), sections.
+The header holds the offset and length of every section, relative to the end of the header.
+
+Running this script converts the existing JSON profiles (*_database.json) to the compact format.
+"""
+
+MAGIC = b"LXPF"
+FORMAT = 1
+EXTENSION = ".lxp"
+
+# The lists that are stored in separate sections
+BULKY = {"terms", "ngrams_all"}
+
+_PREFIX = struct.Struct("<4sBI")
+
+
+def write_profile(path, database):
+    """
+    This function takes two arguments and writes a profile (database) in the compact format,
+    it is first written to a temporary file so an interrupted run never leaves a partial profile
+
+    Parameters:
+    arg1 (path): the path of the profile file
+    arg2 (database): the profile, as created in get_lexical_features.build_profiles
+    """
+    header = {}
+    sections = {}
+    blobs = []
+    offset = 0
+    for key, value in database.items():
+        header[key] = {}
+        for name, items in value.items():
+            if name in BULKY:
+                blob = zlib.compress(json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                sections[f"{key}/{name}"] = [offset, len(blob)]
+                blobs.append(blob)
+                offset += len(blob)
+            else:
+                header[key][name] = items
+    encoded = json.dumps({"profile": header, "sections": sections}, ensure_ascii=False,
+                         separators=(",", ":")).encode("utf-8")
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT, len(encoded)))
+        f.write(encoded)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(path + ".tmp", path)
+
+
+class Profile(Mapping):
+    """
+    A lexical profile in the compact format, used like the dictionary of the JSON profile.
+    Only the header is read when the profile is opened, a bulky section is read the first time it is accessed.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters:
+        arg1 (path): the path of the profile file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT:
+                raise ValueError(f"{path} is not a lexical profile (format {FORMAT})")
+            header = json.loads(f.read(length).decode("utf-8"))
+        self.start = _PREFIX.size + length
+        self.header = header["profile"]
+        self.sections = header["sections"]
+        self.loaded = {}
+
+    def section(self, name):
+        """ Returns the list of a section, e.g. NOUN/terms or ngrams/ngrams_all """
+        if name not in self.loaded:
+            offset, length = self.sections[name]
+            with open(self.path, "rb") as f:
+                f.seek(self.start + offset)
+                self.loaded[name] = json.loads(zlib.decompress(f.read(length)).decode("utf-8"))
+        return self.loaded[name]
+
+    def __getitem__(self, key):
+        if key not in self.header:
+            raise KeyError(key)
+        return ProfileEntry(self, key)
+
+    def __iter__(self):
+        return iter(self.header)
+
+    def __len__(self):
+        return len(self.header)
+
+    def common(self, key):
+        """ Returns the common list of a POS category or of the ngrams, without reading any section """
+        return self.header[key].get("common", [])
+
+    def to_dict(self):
+        """ Returns the full profile as a dictionary, in the same form as the JSON profile """
+        return {key: dict(entry) for key, entry in self.items()}
+
+
+class ProfileEntry(Mapping):
+    """ One POS category (or the ngrams) of a Profile, the bulky lists are read when they are accessed """
+
+    def __init__(self, profile, key):
+        self.profile = profile
+        self.key = key
+        self.names = list(profile.header[key]) + [s.split("/", 1)[1] for s in profile.sections
+                                                  if s.split("/", 1)[0] == key]
+
+    def __getitem__(self, name):
+        small = self.profile.header[self.key]
+        if name in small:
+            return small[name]
+        if f"{self.key}/{name}" in self.profile.sections:
+            return self.profile.section(f"{self.key}/{name}")
+        raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def read_profile(path):
+    """
+    This function takes one argument and returns a profile, from the compact format or from JSON
+
+    Parameters:
+    arg1 (path): the path of the profile, with or without extension, the compact file is used when it exists
+                 and is not older than the JSON file
+
+    Returns:
+    Profile or dictionary: the profile
+    """
+    base, extension = os.path.splitext(path)
+    if extension not in {EXTENSION, ".json"}:
+        base = path
+    compact, json_path = base + EXTENSION, base + ".json"
+    if os.path.exists(compact) and (not os.path.exists(json_path)
+                                    or os.path.getmtime(compact) >= os.path.getmtime(json_path)):
+        return Profile(compact)
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ProfileRepository:
+    """
+    The profiles of the transcripts, kept in memory in a bounded LRU cache keyed by (transcript, timeframe).
+    What is derived from a profile (by prepare) is computed once, when the profile is read.
+    """
+
+    def __init__(self, directory, folder="Lexical_profiles", maxsize=16, prepare=None):
+        """
+        Parameters:
+        arg1 (directory): the directory with a folder per transcript
+        arg2 (folder): the folder of the transcript in which the profiles are stored
+        arg3 (maxsize): the maximum number of profiles kept in memory
+        arg4 (prepare): function that takes a profile and returns what is kept in the cache, the profile itself if None
+        """
+        self.directory = directory
+        self.folder = folder
+        self.maxsize = maxsize
+        self.prepare = prepare
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, transcript, timeframe):
+        return os.path.join(self.directory, str(transcript), self.folder, str(timeframe) + "_database.json")
+
+    def get(self, transcript, timeframe):
+        """ Returns the (prepared) profile of a transcript at a timeframe """
+        key = (str(transcript), timeframe)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        profile = read_profile(self.path(transcript, timeframe))
+        self.cache[key] = self.prepare(profile) if self.prepare else profile
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return self.cache[key]
+
+    def clear(self):
+        self.cache.clear()
+
+
+def convert(json_path):
+    """ Writes the compact form of a JSON profile next to it, and returns its path """
+    with open(json_path, "r", encoding="utf-8") as f:
+        database = json.load(f)
+    path = os.path.splitext(json_path)[0] + EXTENSION
+    write_profile(path, database)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the JSON profiles of all transcripts to the compact format")
+    parser.add_argument("directory", nargs="?", default="Data")
+    args = parser.parse_args()
+
+    for root, _, files in os.walk(args.directory):
+        for file in sorted(files):
+            if file.endswith("_database.json"):
+                print(f"Converting: {os.path.join(root, file)}")
+                convert(os.path.join(root, file))
@@ -0,0 +1,180 @@
+import os
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+except ImportError:     # pyarrow is only needed for the parquet and arrow formats
+    pa = None
+
+"""
+Here the results of the evaluation are written.
+The rows are buffered and written in batches, to CSV or to a columnar format (parquet or arrow),
+in which the repeated text columns are dictionary encoded and a single column can be read without reading the others.
+"""
+
+## The columns of the results and their types, the text columns are dictionary encoded in the columnar formats
+COLUMNS = [
+    ("Model", "category"), ("Transcript_nr", "category"), ("Timeframe_LP", "int"), ("Timeframe_EVAL", "category"),
+    ("Split", "int"), ("Amount", "int"), ("Metric", "category"), ("Value", "float"), ("POS", "category"),
+    ("Matchtype", "category"),
+]
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+
+def schema(columns=COLUMNS):
+    types = {"category": pa.dictionary(pa.int32(), pa.string()), "int": pa.int64(), "float": pa.float64()}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def convert(value, kind):
+    """ Returns a value of a row as the type of its column (the rows read from csv files are text) """
+    if value is None or value == "":
+        return None
+    if kind == "int":
+        return int(value)
+    if kind == "float":
+        return float(value)
+    return str(value)
+
+
+def results_path(directory, name, format="csv"):
+    """ Returns the path of the results of one setting, every setting is a separate file (name=<setting>/results) """
+    return os.path.join(directory, f"setting={name}", "results" + EXTENSIONS[format])
+
+
+class ResultsWriter:
+    """
+    Buffered writer of the result rows, used like a csv writer (writerow, writerows) and closed when done.
+    The file is written to a temporary file first, and only replaces path when it is closed without an error.
+    """
+
+    def __init__(self, path, format="csv", columns=COLUMNS, batch_size=10_000):
+        """
+        Parameters:
+        arg1 (path): the path of the results file
+        arg2 (format): csv, parquet or arrow
+        arg3 (columns): the names and types of the columns
+        arg4 (batch_size): the nr of rows that are buffered before they are written
+        """
+        if format not in EXTENSIONS:
+            raise ValueError(f"Unknown results format: {format}")
+        if format != "csv" and pa is None:
+            raise ImportError(f"pyarrow is needed to write the results as {format}")
+        self.path = path
+        self.format = format
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = []
+        self.closed = False
+        # The dictionary of every text column only grows, the arrow file format only allows dictionary deltas between batches
+        self.dictionaries = {name: {} for name, kind in columns if kind == "category"}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.tmp = path + ".tmp"
+        if format == "csv":
+            self.file = open(self.tmp, mode="w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow([name for name, _ in columns])
+        elif format == "parquet":
+            self.schema = schema(columns)
+            self.writer = pq.ParquetWriter(self.tmp, self.schema)
+        else:
+            self.schema = schema(columns)
+            self.file = pa.OSFile(self.tmp, "wb")
+            self.writer = ipc.new_file(self.file, self.schema, options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """ Writes the buffered rows """
+        if not self.rows:
+            return
+        if self.format == "csv":
+            self.writer.writerows(self.rows)
+        else:
+            arrays = []
+            for i, (name, kind) in enumerate(self.columns):
+                values = [convert(row[i], kind) for row in self.rows]
+                if kind == "category":
+                    dictionary = self.dictionaries[name]
+                    indices = [None if value is None else dictionary.setdefault(value, len(dictionary)) for value in values]
+                    arrays.append(pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(list(dictionary), pa.string())))
+                else:
+                    arrays.append(pa.array(values, self.schema.field(name).type))
+            self.writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self, error=False):
+        """ Writes the remaining rows and closes the file, the results only replace path when there was no error """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not error:
+                self.flush()
+        finally:
+            if self.format != "csv":
+                self.writer.close()
+            if self.format != "parquet":
+                self.file.close()
+        if error:
+            os.remove(self.tmp)
+        else:
+            os.replace(self.tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(error=exc_type is not None)
+
+
+def results_format(path):
+    """ Returns the format (csv, parquet or arrow) of a results file, or of the files in a directory with the results of several settings """
+    if os.path.isdir(path):
+        for _, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                for format, extension in EXTENSIONS.items():
+                    if name.endswith(extension):
+                        return format
+        raise FileNotFoundError(f"No results in {path}")
+    for format, extension in EXTENSIONS.items():
+        if path.endswith(extension):
+            return format
+    raise ValueError(f"Unknown format of the results: {path}")
+
+
+def read_results(path, columns=None, metric=None, pos=None, format=None):
+    """
+    This function takes five arguments and returns the results as a pyarrow Table,
+    only the requested columns are read from the columnar formats
+
+    Parameters:
+    arg1 (path): the path of the results file (csv, parquet or arrow), or a directory with the results of several settings
+    arg2 (columns): the columns to read, all if None
+    arg3 (metric): only the rows of this metric (e.g. Recall), all if None
+    arg4 (pos): only the rows of this POS category (e.g. NOUN or ngram), all if None
+    arg5 (format): csv, parquet or arrow, taken from the extension of the file (or of the files in the directory) if None
+
+    Returns:
+    Table: the results
+    """
+    import pyarrow.dataset as ds
+    format = format or results_format(path)
+    dataset = ds.dataset(path, format="ipc" if format == "arrow" else format, partitioning="hive")
+    condition = None
+    for name, value in (("Metric", metric), ("POS", pos)):
+        if value is not None:
+            expression = ds.field(name) == value
+            condition = expression if condition is None else condition & expression
+    return dataset.to_table(columns=columns, filter=condition)
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import argparse
+import itertools
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Evaluation"))
+
+import get_lexical_features as glf
+import evaluation_LA as ev
+import config
+from LA_evaluation import MetricsKernel
+from annotation_store import close_transcript
+from results import ResultsWriter, results_path
+
+"""
+This script was used to create and evaluate the lexical profiles for a grid of settings at once.
+Every transcript is annotated and counted once per timeframe, after which the profiles of all settings are taken
+from the same counts (the most common x terms are the first x terms of the same frequency table) and evaluated
+against the same observed windows.
+The results of every setting are written to a separate file in results_dir (results_dir/setting=<setting>/results.csv).
+"""
+
+## The grid of settings, every combination is one setting
+grid = {
+    "top_x": [3, 5, 10, 15, 20],        # The nr of terms per POS category (a number or a dictionary per POS category)
+    "threshold": [5],                   # A term is only included when it occurs more often than this
+    "ngram_top_x": [3],                 # The nr of ngrams per n
+    "ngram_threshold": [3],             # An ngram is only included when it occurs more often than this
+    "n_values": [[2, 3, 4, 5]],         # The n's for the ngrams
+    "split_increase": [30],             # The nr of splits in an evaluated window
+}
+timeframes = [5, 10, 15, 20, 25, 30]    # The timeframes at which a lexical profile is created
+
+directory = ev.directory
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Evaluation", "Results", "sweep")
+results_format = "csv"      # csv, or parquet / arrow (columnar, needs pyarrow)
+write_profiles = False      # Also write the profiles of every setting (to Lexical_profiles_<setting> per transcript)
+workers = min(4, os.cpu_count() or 1)      # The nr of transcripts that are processed at the same time (every worker loads its own spaCy model)
+
+# The settings that determine the profile, the other settings only change the evaluation
+PROFILE_SETTINGS = ["top_x", "threshold", "ngram_top_x", "ngram_threshold", "n_values"]
+
+## The settings that can be changed with a config file (section "sweep") or on the command line, see config.py
+## (grid is a part of the grid, or a JSON file with a part of the grid, e.g. {"top_x": [3, 5]})
+SETTINGS = ["grid", "timeframes", "directory", "results_dir", "results_format", "write_profiles", "workers"]
+
+
+def configure(values):
+    """ Sets the settings of the run (see config.py), in the main process and in every worker """
+    values = dict(values)
+    part = values.pop("grid", {})
+    if isinstance(part, str):
+        with open(part, "r", encoding="utf-8") as f:
+            part = json.load(f)
+    grid.update(part)
+    config.apply(globals(), values)
+    # The evaluation reads the transcripts (and keeps its lemma table) in the same directory,
+    # the ngrams of its windows are counted once for all n's in the grid (see sweep_transcript)
+    ev.configure({"directory": directory, "n_values": counted_n()})
+
+
+def counted_n():
+    """ Returns all n's that occur in the grid, the ngrams are counted once for all of them """
+    return sorted({n for n_values in grid["n_values"] for n in n_values})
+
+
+def settings(grid):
+    """ Returns all combinations of the grid, as a list of dictionaries """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def setting_name(setting, names=None):
+    """ Returns the name of a setting (or of the part of it in names), used for the file names """
+    parts = []
+    for name in names or setting:
+        value = setting[name]
+        if isinstance(value, dict):
+            value = "-".join(f"{pos}{x}" for pos, x in value.items())
+        elif isinstance(value, (list, tuple)):
+            value = "".join(map(str, value))
+        parts.append(f"{name}{value}")
+    return "_".join(parts)
+
+
+def sweep_transcript(transcript):
+    """
+    This function takes one argument and returns the results of all settings for one transcript
+
+    Parameters:
+    arg1 (transcript): the transcript number (name of the folder in directory)
+
+    Returns:
+    dictionary: the result rows per setting name
+    """
+    print(f"Processing: {transcript}")
+    file_path = os.path.join(directory, transcript, "splits" + '.json')
+    splits = glf.load_splits(file_path)
+    ev.get_transcript(transcript, splits)      # The evaluation uses the same annotated splits
+    # and starts with the sentences of the annotation store, which were loaded into the annotator of get_lexical_features
+    ev.annotator.tokenized.update(glf.annotator.tokenized)
+
+    try:
+        # Count once per timeframe, for all n's that occur in the grid
+        counts = {t: glf.count_timeframe(splits, t, counted_n()) for t in timeframes}
+
+        prepared = {}
+        def get_profile(setting, t):
+            # The profile of a setting (and its lemmas) is only made once, for all window sizes
+            key = (setting_name(setting, PROFILE_SETTINGS), t)
+            if key not in prepared:
+                database = {"ID": {"transcript number": transcript}}
+                database.update(glf.make_profile(counts[t], setting["top_x"], setting["threshold"], setting["n_values"],
+                                                 setting["ngram_top_x"], setting["ngram_threshold"]))
+                if write_profiles:
+                    extension = glf.EXTENSION if glf.profile_format == "binary" else '.json'
+                    folder = "Lexical_profiles_" + key[0]
+                    glf.write_database(os.path.join(directory, transcript, folder, f"{t}_database{extension}"), database)
+                prepared[key] = ev.prepare_profile(database)
+            return prepared[key]
+
+        results = {}
+        for setting in settings(grid):
+            kernel = MetricsKernel()
+            measures = []
+            for t in timeframes:
+                # The ngrams of the windows are those of the n's of the setting, as the ngrams of its profiles
+                ev.evaluate_profile(kernel, measures, transcript, t, lambda setting=setting, t=t: get_profile(setting, t),
+                                    setting["split_increase"], setting["n_values"])
+            rows = []
+            ev.write_measures(SimpleNamespace(writerow=rows.append), kernel, measures)
+            results[setting_name(setting)] = rows
+        return results
+    finally:
+        # Store the annotations that were made for this transcript, including the sentences tokenised for the evaluation
+        glf.annotator.tokenized.update(ev.annotator.tokenized)
+        close_transcript(file_path, splits, glf.annotator)
+        # The sentences of this transcript are not kept for the next one
+        ev.annotator.clear()
+
+
+def run_transcript(transcript):
+    """ Runs sweep_transcript for one transcript, a failure is returned instead of stopping the other transcripts """
+    try:
+        return transcript, sweep_transcript(transcript), None
+    except Exception as e:
+        return transcript, None, f"{type(e).__name__}: {e}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and evaluate the lexical profiles for a grid of settings")
+    parser.add_argument("--model", default=None, help="the spaCy model, e.g. nl_core_news_sm")
+    config.add_arguments(parser, config.defaults(globals()))
+    args = parser.parse_args()
+    values = config.settings(args, globals(), "sweep")
+    configure(values)
+
+    folders = sorted(f for f in os.listdir(directory) if f.isdigit())
+    if workers and workers > 1 and len(folders) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure, initargs=(values,)) as pool:
+            results = list(pool.map(run_transcript, folders))
+    else:
+        results = [run_transcript(transcript) for transcript in folders]
+
+    failed = [(transcript, error) for transcript, _, error in results if error]
+    for transcript, error in failed:
+        print(f"Failed: {transcript} ({error})")
+    results = [result for _, result, error in results if not error]
+
+    # The results are written per setting, in the order of the transcripts
+    for setting in settings(grid):
+        name = setting_name(setting)
+        path = results_path(results_dir, name, results_format)
+        with ResultsWriter(path, results_format) as writer:
+            for result in results:
+                writer.writerows(result[name])
+        print(f"Written: {path}")
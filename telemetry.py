@@ -0,0 +1,222 @@
+import os
+import csv
+import json
+import time
+import cProfile
+import contextlib
+from collections import Counter
+
+"""
+Here the instrumentation of the pipeline scripts is stored.
+Every stage of a script (ingestion, annotation, counting, ngram extraction, profile I/O, metrics, ...) is wrapped in
+stage(), which records its wall and CPU time, the docs and tokens made by spaCy, and the bytes read and written,
+per transcript. Nothing is recorded unless the telemetry is enabled (--report of the scripts).
+The records are written to a run report (JSON or CSV), with the totals per stage and per transcript and the
+hits of the caches, and the run can be profiled with cProfile (--profile).
+"""
+
+enabled = False
+records = []        # The records of the stages that ran in this process
+caches = {}         # name -> function that returns the statistics of a cache (e.g. hits and misses)
+merged_caches = {}  # The statistics of the caches of the workers, per process
+model_counts = Counter()    # The calls, docs and tokens of all spaCy models (see CountingModel)
+current = None      # The transcript that is processed, recorded for the stages that do not name one
+
+
+class CountingModel:
+    """ Wraps a loaded spaCy model and counts the calls and the docs and tokens it makes, including those of the tokenizer """
+
+    def __init__(self, nlp, counts=None):
+        """
+        Parameters:
+        arg1 (nlp): the spaCy model
+        arg2 (counts): the Counter in which the calls, docs and tokens are counted, a new one if None
+        """
+        self.nlp = nlp
+        self.counts = Counter() if counts is None else counts
+        self.tokenizer = CountingTokenizer(nlp.tokenizer, self.counts)
+
+    def __getattr__(self, name):
+        return getattr(self.nlp, name)
+
+    def __call__(self, text, **kwargs):
+        self.counts["calls"] += 1
+        return next(count_docs([self.nlp(text, **kwargs)], self.counts, "docs"))
+
+    def pipe(self, texts, **kwargs):
+        self.counts["calls"] += 1
+        return count_docs(self.nlp.pipe(texts, **kwargs), self.counts, "docs")
+
+
+class CountingTokenizer:
+    """ Wraps the tokenizer of a spaCy model, see CountingModel """
+
+    def __init__(self, tokenizer, counts):
+        self.tokenizer = tokenizer
+        self.counts = counts
+
+    def __call__(self, text):
+        self.counts["tokenizer_calls"] += 1
+        return next(count_docs([self.tokenizer(text)], self.counts, "tokenizer_docs"))
+
+    def pipe(self, texts, **kwargs):
+        self.counts["tokenizer_calls"] += 1
+        return count_docs(self.tokenizer.pipe(texts, **kwargs), self.counts, "tokenizer_docs")
+
+
+def count_docs(docs, counts, kind):
+    for doc in docs:
+        counts[kind] += 1
+        counts["tokens"] += len(doc)
+        yield doc
+
+
+def count_models(nlp):
+    return CountingModel(nlp, model_counts)
+
+
+def enable():
+    """ Enables the telemetry in this process, the spaCy models that are loaded from now on are counted """
+    global enabled
+    import models
+    enabled = True
+    models.wrap = count_models
+    for name, nlp in models.models.items():
+        if not isinstance(nlp, CountingModel):
+            models.models[name] = count_models(nlp)
+
+
+def io_counters():
+    """ Returns the bytes read and written by this process so far, None where this is not available (only on Linux) """
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+@contextlib.contextmanager
+def stage(name, transcript=None):
+    """
+    This function takes two arguments and returns a context in which a stage is recorded
+
+    Parameters:
+    arg1 (name): the name of the stage, e.g. annotation
+    arg2 (transcript): the transcript (number) that is processed, the one set by processing() if None
+    """
+    if not enabled:
+        yield
+        return
+    counts = Counter(model_counts)
+    read, written = io_counters()
+    start, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+        made = model_counts - counts
+        read_after, written_after = io_counters()
+        records.append({
+            "stage": name,
+            "transcript": transcript if transcript is not None else current,
+            "pid": os.getpid(),
+            "seconds": seconds,
+            "cpu_seconds": cpu,
+            "docs": made["docs"] + made["tokenizer_docs"],
+            "tokens": made["tokens"],
+            "bytes_read": read_after - read if read is not None else None,
+            "bytes_written": written_after - written if written is not None else None,
+        })
+
+
+@contextlib.contextmanager
+def processing(transcript):
+    """ Returns a context in which the stages are recorded for the given transcript """
+    global current
+    previous, current = current, transcript
+    try:
+        yield
+    finally:
+        current = previous
+
+
+def register_cache(name, statistics):
+    """ Registers a cache, statistics is a function that returns its statistics (e.g. hits and misses) as a dictionary """
+    caches[name] = statistics
+
+
+def take():
+    """ Returns (and removes) the records of this process and the statistics of its caches, to be merged in the main process """
+    taken = {"records": list(records), "caches": {str(os.getpid()): cache_statistics()}}
+    records.clear()
+    return taken
+
+
+def merge(taken):
+    """ Adds the records and cache statistics returned by take() in a worker """
+    if taken:
+        records.extend(taken["records"])
+        merged_caches.update(taken["caches"])
+
+
+def cache_statistics():
+    return {name: statistics() for name, statistics in caches.items()}
+
+
+def totals(key):
+    """ Returns the records summed per value of key (stage or transcript) """
+    summed = {}
+    for record in records:
+        total = summed.setdefault(str(record[key]), Counter())
+        total["runs"] += 1
+        for name in ("seconds", "cpu_seconds", "docs", "tokens", "bytes_read", "bytes_written"):
+            total[name] += record[name] or 0
+    return {k: dict(v) for k, v in summed.items()}
+
+
+def write_report(path):
+    """
+    This function takes one argument and writes the run report, as JSON (the records, the totals per stage and per
+    transcript and the cache statistics) or, when path ends with .csv, as CSV (one row per record)
+
+    Parameters:
+    arg1 (path): the path of the report
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=["stage", "transcript", "pid", "seconds", "cpu_seconds", "docs",
+                                                   "tokens", "bytes_read", "bytes_written"])
+            writer.writeheader()
+            writer.writerows(records)
+        return
+    report = {
+        "stages": totals("stage"),
+        "transcripts": totals("transcript"),
+        "caches": dict(merged_caches, **{str(os.getpid()): cache_statistics()}),
+        "records": records,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+
+def print_totals():
+    """ Prints the time per stage, the stages that took the longest first """
+    for name, total in sorted(totals("stage").items(), key=lambda x: x[1]["seconds"], reverse=True):
+        print(f"{name:<24}{total['seconds']:>10.2f} s{total['cpu_seconds']:>10.2f} s CPU{total['docs']:>10} docs")
+
+
+@contextlib.contextmanager
+def profiled(path=None):
+    """ Returns a context that is profiled with cProfile when path is given, the statistics are dumped to path """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
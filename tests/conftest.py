@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts are flat modules in the root and in the Evaluation folder, as when they are run from there
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path[:0] = [root, os.path.join(root, "Evaluation")]
@@ -0,0 +1,45 @@
+import re
+import random
+
+from annotation import clean_split, join_splits, stream_text, stream_sentences, split_sentences
+
+PIECES = ["Ik ga naar huis", " en ", "dan-", " - ", "...", " …", "BREAK", ". ", "Ja. Nee!", " ?", "mooi", "\n", "  ", "eh-",
+          "Het is 5-", "a-b", "zo.", "Wat? ", "- Daar", "."]
+
+
+def legacy_text(splits):
+    # The text of the splits as it was accumulated in preprocess
+    text_ = ""
+    for text in splits:
+        t1 = text.replace("\n", "")
+        t2 = re.sub(r'\.{3,}(?=\W)', ' PAUSE', t1)
+        t3 = re.sub(r'…(?=\W)', ' PAUSE', t2)
+        t4 = t3.replace("  ", " ")
+        t5 = re.sub(r'-\s+(?=[A-Z0-9])', ' BREAK ', t4)
+        t6 = re.sub(r'-\s+(?=[a-z0-9])', ' BREAK ', t5)
+        text_ += t6
+        text_ = re.sub(r'(\w+)-$', r'\1 BREAK ', text_.strip())
+    return text_
+
+
+def random_splits(rng):
+    return ["".join(rng.choices(PIECES, k=rng.randint(0, 6))) for _ in range(rng.randint(0, 8))]
+
+
+def test_stream_text_matches_legacy_text():
+    rng = random.Random(0)
+    for _ in range(3000):
+        splits = random_splits(rng)
+        cleaned = [clean_split(s) for s in splits]
+        assert "".join(stream_text(cleaned)) == legacy_text(splits)
+        assert join_splits(cleaned) == legacy_text(splits)
+
+
+def test_stream_sentences_matches_split_sentences():
+    rng = random.Random(1)
+    for _ in range(3000):
+        cleaned = [clean_split(s) for s in random_splits(rng)]
+        text = join_splits(cleaned)
+        legacy = re.split(r'(?<=[.!?])\s+|(?<=BREAK)\s+|(?<=\.)', text)
+        assert split_sentences(text) == legacy
+        assert list(stream_sentences(stream_text(cleaned))) == legacy
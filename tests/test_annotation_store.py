@@ -0,0 +1,101 @@
+import os
+import json
+import random
+
+import pytest
+
+pytest.importorskip("spacy")
+
+import annotation_store
+from annotation import SplitCache, SentenceAnnotator
+from annotation_store import encode, decode, read_store, write_store, open_transcript, close_transcript, store_path
+
+TOKENS = ["ik", "ga", "naar", "huis", ",", ".", "café", "één", "PAUSE", "BREAK"]
+LABELS = ["PRON", "VERB", "ADP", "NOUN", "PUNCT", "X"]
+
+
+def random_annotation(rng):
+    # An annotation in the form of annotation.annotate_doc
+    text = rng.choices(TOKENS, k=rng.randint(0, 12))
+    return {"text": text, "pos": [rng.choice(LABELS) for _ in text], "lemma": [t.lower() for t in text],
+            "is_alpha": [t.isalpha() for t in text], "is_punct": [rng.random() < 0.2 for _ in text]}
+
+
+def transcript(tmp_path, rng, n=20):
+    # A splits.json with n splits, the annotations of some splits and sentences as if they were parsed
+    file_path = str(tmp_path / "splits.json")
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump({str(i * 30): " ".join(rng.choices(TOKENS, k=8)) for i in range(n)}, f)
+    with open(file_path, "r", encoding="utf-8") as f:
+        splits = SplitCache("blank:nl", json.load(f))
+    splits.annotations.update({i: random_annotation(rng) for i in rng.sample(range(n), n // 2)})
+    annotator = SentenceAnnotator("blank:nl")
+    for i in range(10):
+        annotator.tagged[f"zin {i}"] = random_annotation(rng)
+        annotator.tokenized[f"korte zin {i}"] = rng.choices(TOKENS, k=4)
+    return file_path, splits, annotator
+
+
+def test_encode_decode_round_trip():
+    rng = random.Random(0)
+    labels = {}
+    annotations = [random_annotation(rng) for _ in range(500)]
+    encoded = [encode(a, labels) for a in annotations]
+    assert [decode(e, list(labels)) for e in encoded] == annotations
+
+
+def test_store_round_trip(tmp_path):
+    file_path, splits, annotator = transcript(tmp_path, random.Random(1))
+    write_store(file_path, splits, annotator)
+    assert read_store(file_path, "blank:nl") == \
+        {"splits": splits.annotations, "sentences": annotator.tagged, "tokenized": annotator.tokenized}
+
+    # The annotations are loaded when the transcript is opened, the model is not needed for them
+    other = SentenceAnnotator("blank:nl")
+    opened = open_transcript(file_path, "blank:nl", other)
+    assert opened.annotations == splits.annotations
+    assert other.tagged == annotator.tagged and other.tokenized == annotator.tokenized
+    assert [opened.annotation(i) for i in sorted(splits.annotations)] == [a for _, a in sorted(splits.annotations.items())]
+    assert opened.calls == 0
+
+
+def test_store_is_invalidated(tmp_path):
+    file_path, splits, annotator = transcript(tmp_path, random.Random(2))
+    write_store(file_path, splits, annotator)
+    # Another model
+    assert read_store(file_path, "blank:en") is None
+    # The same splits.json, written again, keeps its store
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert read_store(file_path, "blank:nl") is not None
+    # A changed splits.json
+    data["0"] += " en"
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert read_store(file_path, "blank:nl") is None
+    opened = open_transcript(file_path, "blank:nl", SentenceAnnotator("blank:nl"))
+    assert opened.annotations == {}
+
+
+def test_close_transcript_writes_new_annotations_only(tmp_path, monkeypatch):
+    file_path, splits, annotator = transcript(tmp_path, random.Random(3))
+    close_transcript(file_path, splits, annotator)
+    assert os.path.exists(store_path(file_path))
+
+    writes = []
+    write = annotation_store.write_store
+    monkeypatch.setattr(annotation_store, "write_store", lambda *args: writes.append(args) or write(*args))
+    annotator = SentenceAnnotator("blank:nl")
+    splits = open_transcript(file_path, "blank:nl", annotator)
+    close_transcript(file_path, splits, annotator)
+    assert writes == []
+
+    # A new annotation is written, after that the store is unchanged again
+    new = min(set(range(len(splits))) - set(splits.annotations))
+    splits.annotations[new] = random_annotation(random.Random(4))
+    close_transcript(file_path, splits, annotator)
+    close_transcript(file_path, splits, annotator)
+    assert len(writes) == 1
+    assert read_store(file_path, "blank:nl")["splits"][new] == splits.annotations[new]
@@ -0,0 +1,19 @@
+import random
+from collections import Counter
+
+from lexical_profile import Ranking
+
+
+def test_ranking_matches_counter():
+    rng = random.Random(0)
+    for floor in (0, 2, 5):
+        ranking, counter = Ranking(floor), Counter()
+        for _ in range(3000):
+            item, k = rng.choice("abcdefghijklmnop"), rng.choice([1, 1, 1, 2, 3])
+            ranking.add(item, k)
+            counter[item] += k
+            x, threshold = rng.randint(1, 20), rng.randint(0, 8)
+            assert ranking.common(x, threshold) == [item for item, count in counter.most_common(x) if count > threshold]
+        assert ranking.most_common() == counter.most_common()
+        assert ranking.most_common(5) == counter.most_common(5)
+        assert len(ranking) == len(counter)
@@ -0,0 +1,90 @@
+import random
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("sklearn")
+
+from LA_evaluation import MetricsKernel, CandidateScorer, candidate_words, compute_recall_coverage, compute_cosine_similarity
+
+WORDS = ["ik", "je", "de", "het", "huis", "fiets", "moeder", "werk", "school", "mooi", "groot", "en", "maar",
+         "naar huis", "de fiets", "op het werk", "ja ja", "a", "zo'n", "café", "één"]
+
+
+def comparisons(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        observed = rng.choices(WORDS, k=rng.randint(0, 40))
+        generated = rng.sample(WORDS, rng.randint(1, 10))
+        yield observed, generated
+
+
+def test_metrics_kernel_matches_legacy_functions():
+    kernel = MetricsKernel()
+    expected = []
+    for observed, generated in comparisons(5000):
+        if not observed:
+            # compute_cosine_similarity needs terms on both sides of an empty list as well, skipped as in the evaluation
+            observed = ["huis"]
+        kernel.add(observed, generated)
+        expected.append((*compute_recall_coverage(observed, generated, list_of_words=True),
+                         compute_cosine_similarity(observed, generated)))
+    recall, coverage, cosine = kernel.compute()
+    assert list(zip(recall, coverage)) == [e[:2] for e in expected]
+    assert cosine == pytest.approx([e[2] for e in expected], abs=1e-12)
+
+
+def test_metrics_kernel_bags_and_ngrams():
+    # The observed windows are passed as bags of words (word -> count), the ngrams without cosine similarity
+    kernel = MetricsKernel()
+    expected = []
+    for observed, generated in comparisons(500, seed=1):
+        observed = observed or ["ja"]
+        kernel.add(Counter(observed), generated)
+        expected.append((*compute_recall_coverage(observed, generated, list_of_words=True),
+                         compute_cosine_similarity(observed, generated)))
+        kernel.add(observed, generated, cosine=False)
+        expected.append((*compute_recall_coverage(observed, generated, list_of_words=True), None))
+    recall, coverage, cosine = kernel.compute()
+    assert list(zip(recall, coverage)) == [e[:2] for e in expected]
+    assert [c is None for c in cosine] == [e[2] is None for e in expected]
+    assert [c for c in cosine if c is not None] == pytest.approx([e[2] for e in expected if e[2] is not None], abs=1e-12)
+
+
+def test_metrics_kernel_empty_vocabulary():
+    kernel = MetricsKernel()
+    kernel.add(["a"], ["a"])
+    with pytest.raises(ValueError):
+        kernel.compute()
+
+
+def test_candidate_scorer_matches_legacy_functions():
+    # The candidates are only tokenised (for their ngrams), a blank pipeline needs no model download
+    pytest.importorskip("spacy")
+    rng = random.Random(2)
+    profile = rng.sample(WORDS, 8)
+    candidates = [" ".join(rng.choices(WORDS, k=rng.randint(1, 12))) + rng.choice([".", "!", ""]) for _ in range(300)]
+    scorer = CandidateScorer(profile, model="blank:nl")
+    terms = dict(scorer.terms)
+    scores = scorer.score(candidates)["Exact"]
+
+    recall, coverage = zip(*(compute_recall_coverage(profile, [c]) for c in candidates))
+    cosine = [compute_cosine_similarity(profile, candidate_words(c)) for c in candidates]
+    assert list(scores["Recall"]) == list(recall)
+    assert list(scores["Coverage"]) == list(coverage)
+    assert list(scores["Cosine"]) == pytest.approx(cosine, abs=1e-12)
+    # The candidates are ranked in the same order as by compute_cosine_similarity
+    def ranking(values):
+        return sorted(range(len(values)), key=lambda i: (-round(values[i], 12), i))
+    assert ranking(scores["Cosine"]) == ranking(cosine)
+    # The terms of the candidates are not added to the vocabulary of the scorer
+    scorer.score(["een heel ander antwoord met nieuwe woorden"])
+    assert scorer.terms == terms
+
+
+def test_candidate_scorer_without_terms():
+    pytest.importorskip("spacy")
+    # A profile without words (e.g. a new live profile) and candidates without words are scored as no match
+    scores = CandidateScorer([], [], model="blank:nl").score(["...", ""])
+    assert {metric: values.tolist() for metric, values in scores["Exact"].items()} == \
+        {metric: [0.0, 0.0] for metric in ["Recall", "Coverage", "Cosine", "Ngram_recall", "Ngram_coverage"]}
@@ -0,0 +1,45 @@
+import random
+
+from ngrams import NgramCounter, filter_subsumed
+
+
+def legacy_filter_ngrams(ngrams):
+    # filter_ngrams as it was in postprocessing_profiles
+    result = []
+    for n in ngrams:
+        sub = False
+        for other in ngrams:
+            if n != other and n in other:
+                sub = True
+                break
+        if not sub:
+            result.append(n)
+    return result
+
+
+def test_filter_subsumed_matches_legacy_filter():
+    # With tokens of one letter every substring that starts and ends with a letter is a part of the tokens,
+    # so the substrings of the former filter are the contained ngrams of filter_subsumed
+    rng = random.Random(0)
+    for _ in range(2000):
+        ngrams = [" ".join(rng.choices("abcd", k=rng.randint(2, 5))) for _ in range(rng.randint(0, 30))]
+        assert filter_subsumed(ngrams) == legacy_filter_ngrams(ngrams)
+
+
+def test_filter_subsumed_compares_tokens():
+    # The former filter also removed an ngram that is a part of a token of another ngram
+    assert filter_subsumed(["de kat", "de katten zijn", "ik ben", "ik ben er"]) == ["de kat", "de katten zijn", "ik ben er"]
+
+
+def test_ngram_counter_matches_counter_per_n():
+    rng = random.Random(1)
+    sentences = [rng.choices(["ik", "ben", "er", "ja", ","], k=rng.randint(0, 12)) for _ in range(200)]
+    counter = NgramCounter().update(sentences)
+    for n in (2, 3, 4, 5):
+        counts = {}
+        for tokens in sentences:
+            for ngram in zip(*[tokens[i:] for i in range(n)]):
+                key = " ".join(ngram)
+                counts[key] = counts.get(key, 0) + 1
+        assert counter.most_common(n, 10) == sorted(counts.items(), key=lambda item: item[1], reverse=True)[:10]
+        assert list(counter.iter_all([n])) == list(counts)
@@ -0,0 +1,138 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("docx")
+
+import pipeline
+import get_lexical_features as glf
+import evaluation_LA as ev
+from annotation_store import store_path
+
+EVERYTHING = ["annotate", "profile 5", "profile 10", "evaluate 5", "evaluate 10"]
+
+
+class FakeSplits:
+    # The splits of a transcript, the annotation of a split is its text
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def annotation(self, i):
+        return list(self.data.values())[i]
+
+
+@pytest.fixture
+def calls(tmp_path, monkeypatch):
+    # The stages are replaced by small fakes that record their calls: a profile holds the splits of its timeframe,
+    # a shard holds its profile
+    calls = []
+
+    def load_splits(file_path):
+        calls.append("load")
+        with open(file_path, "r", encoding="utf-8") as f:
+            return FakeSplits(json.load(f))
+
+    def write_store(file_path, splits, annotator=None):
+        with open(store_path(file_path), "w", encoding="utf-8") as f:
+            json.dump([splits.annotation(i) for i in range(len(splits))], f)
+
+    def count_timeframe(splits, timeframe, n_values):
+        calls.append(f"profile {timeframe}")
+        return [text for start, text in splits.data.items() if int(start) < timeframe * 60]
+
+    def get_transcript(transcript, splits=None):
+        calls.append("open")
+        ev.opened[transcript] = None
+
+    def evaluate_shard(transcript, timeframe):
+        calls.append(f"evaluate {timeframe}")
+        with open(glf.profile_path(os.path.join(glf.directory, transcript), timeframe), "r", encoding="utf-8") as f:
+            profile = f.read()
+        with open(ev.shard_path(transcript, timeframe), "w", encoding="utf-8") as f:
+            f.write(profile)
+
+    monkeypatch.setattr(glf, "load_splits", load_splits)
+    monkeypatch.setattr(pipeline, "write_store", write_store)
+    monkeypatch.setattr(pipeline, "close_transcript", lambda file_path, splits, annotator=None: None)
+    monkeypatch.setattr(pipeline, "annotation_size", lambda splits, annotator=None: len(splits))
+    monkeypatch.setattr(pipeline, "model_key", lambda: {"model": "fake"})
+    monkeypatch.setattr(glf, "count_timeframe", count_timeframe)
+    monkeypatch.setattr(glf, "make_profile", lambda counts, x, *args: {"splits": counts, "top_x": x})
+    monkeypatch.setattr(ev, "get_transcript", get_transcript)
+    monkeypatch.setattr(ev, "evaluate_shard", evaluate_shard)
+    monkeypatch.setattr(ev, "opened", {})
+    monkeypatch.setattr(glf, "directory", str(tmp_path))
+    monkeypatch.setattr(glf, "timeframes", [5, 10])
+    monkeypatch.setattr(glf, "profile_format", "json")
+    monkeypatch.setattr(ev, "shard_dir", str(tmp_path / "shards"))
+    os.makedirs(tmp_path / "shards")
+    write_splits(tmp_path, {"0": "ja", "240": "nee", "420": "misschien"})
+    return calls
+
+
+def write_splits(directory, data):
+    os.makedirs(directory / "1", exist_ok=True)
+    with open(directory / "1" / "splits.json", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def build(calls, **kwargs):
+    calls.clear()
+    return pipeline.build_transcript("1", **kwargs)
+
+
+def test_second_run_skips_everything(tmp_path, calls):
+    assert build(calls) == EVERYTHING
+    assert calls == ["load", "profile 5", "profile 10", "open", "evaluate 5", "evaluate 10"]
+    assert build(calls) == []
+    assert calls == []
+    # A splits.json that is written again with the same content is not a change
+    write_splits(tmp_path, {"0": "ja", "240": "nee", "420": "misschien"})
+    assert build(calls) == []
+
+
+def test_changed_inputs_rebuild_what_depends_on_them(tmp_path, calls, monkeypatch):
+    build(calls)
+    # A changed profile is made again, its shard is not rebuilt when the profile is the same as before
+    profile = glf.profile_path(str(tmp_path / "1"), 10)
+    with open(profile, "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert build(calls) == ["profile 10"]
+    os.remove(ev.shard_path("1", 5))
+    assert build(calls) == ["evaluate 5"]
+    assert calls == ["load", "open", "evaluate 5"]
+
+    # Another parameter of the profiles changes the profiles, and so their shards
+    monkeypatch.setattr(glf, "top_x", glf.top_x + 1)
+    assert build(calls) == ["profile 5", "profile 10", "evaluate 5", "evaluate 10"]
+
+    # A change of splits.json makes everything out of date, also the shards of the profiles that are the same
+    write_splits(tmp_path, {"0": "ja", "240": "nee", "420": "misschien wel"})
+    assert build(calls) == EVERYTHING
+    with open(profile, "r", encoding="utf-8") as f:
+        assert json.load(f)["splits"] == ["ja", "nee", "misschien wel"]
+
+
+def test_dry_run_and_force(tmp_path, calls):
+    # A dry run only lists the artifacts that are out of date, the shard of a stale profile is out of date with it
+    assert build(calls, dry_run=True) == EVERYTHING
+    assert calls == []
+    assert not os.path.exists(tmp_path / "1" / pipeline.MANIFEST_NAME)
+    build(calls)
+    os.remove(glf.profile_path(str(tmp_path / "1"), 5))
+    assert build(calls, dry_run=True) == ["profile 5", "evaluate 5"]
+    assert calls == []
+    assert build(calls) == ["profile 5"]
+
+    with open(tmp_path / "1" / pipeline.MANIFEST_NAME, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert build(calls, force=True, dry_run=True) == EVERYTHING
+    with open(tmp_path / "1" / pipeline.MANIFEST_NAME, "r", encoding="utf-8") as f:
+        assert json.load(f) == manifest
+    assert build(calls, force=True) == EVERYTHING
+    assert calls == ["load", "profile 5", "profile 10", "open", "evaluate 5", "evaluate 10"]
+    assert build(calls) == []
@@ -0,0 +1,58 @@
+import re
+import random
+
+import pytest
+
+pytest.importorskip("docx")
+
+from preprocessing_data import strip_speakers
+
+
+def legacy_strip(text, speaker_label):
+    # strip as it was before strip_speakers
+    pattern = rf'\n?{speaker_label}:\s*.*?(?=\n\w+:|\Z)'
+    def clean_match(match):
+        lines = match.group().splitlines()
+        cleaned = []
+        for line in lines:
+            timecodes = re.findall(r'\[\d+\s*min\.?\]', line)
+            if timecodes:
+                cleaned.extend(timecodes)
+        return '\n'.join(cleaned) + '\n' if cleaned else ''
+    return re.sub(pattern, clean_match, text, flags=re.DOTALL)
+
+
+def legacy_text(lines, interviewer):
+    text = "\n".join(lines)
+    for label in ["Z", "Y2", "Y3", interviewer]:
+        text = legacy_strip(text, label)
+    return re.sub(r"\(\d{1,2}:\d{2}:\d{2}\)|\d{1,2}:\d{2} - \d{1,2}:\d{2}", "", text)
+
+
+def random_lines(rng):
+    words = ["ja", "nee", "het", "huis", "school", "[5 min]", "[10 min.]", "(0:02:35)", "0:20 - 0:30"]
+    lines = []
+    for _ in range(rng.randint(1, 12)):
+        label = rng.choice(["Z", "Y1", "Y2", "Y3", "I", "R"])
+        for j in range(rng.randint(1, 3)):
+            # The time markers are not at the start of a line, the former regex took a line like 0:20 - 0:30 for a label
+            text = "ja " + " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+            lines.append(f"{label}: {text}" if j == 0 else text)
+    return lines
+
+
+def test_strip_speakers_matches_legacy_strip():
+    rng = random.Random(0)
+    for _ in range(2000):
+        lines = random_lines(rng)
+        assert strip_speakers(lines, ["Z", "Y2", "Y3", "I"], ["R", "Y1"]) == legacy_text(lines, "I")
+
+
+def test_strip_speakers_labels_with_spaces_and_hyphens():
+    lines = ["Jan-Willem de Vries: hoe gaat het [5 min]", "goed?", "Anne Bakker: goed", "Jan-Willem de Vries: mooi"]
+    assert strip_speakers(lines, ["Z", "Jan-Willem de Vries"], ["Anne Bakker", "Y1"]) == "[5 min]\n\nAnne Bakker: goed"
+
+
+def test_strip_speakers_empty_turn():
+    # An empty turn ends at the next line, the turn of the respondent after it is kept
+    assert strip_speakers(["I: ", "R: ja", "I: en?", "R: nee"], ["I"], ["R"]) == "\nR: ja\nR: nee"
@@ -0,0 +1,128 @@
+import json
+import socket
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("sklearn")
+pytest.importorskip("spacy")
+
+import models
+import evaluation_LA as ev
+import profile_service as ps
+from LA_evaluation import CandidateScorer
+from lemmatizer import Lemmatizer
+
+COMMON = {"NOUN": ["huis", "fiets", "school"], "PRON": ["ik", "je"], "ADJ": ["mooi"], "CONJ": ["en", "maar"],
+          "VERB": ["gaan"], "ADV": ["ook"]}
+NGRAMS = ["naar huis", "op het werk"]
+CANDIDATES = ["ik ga naar huis", "je fiets is mooi", "en op het werk ook", "nee"]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A stored profile of transcript 1 at timeframe 10, only its common lists are read by the service
+    folder = tmp_path / "1" / "Lexical_profiles"
+    folder.mkdir(parents=True)
+    database = {pos: {"terms": {}, "common": COMMON[pos]} for pos in ev.POS_list}
+    database["ngrams"] = {"ngrams_all": {}, "common": NGRAMS}
+    (folder / "10_database.json").write_text(json.dumps(database), encoding="utf-8")
+    monkeypatch.setattr(models, "default_model", "blank:nl")
+    monkeypatch.setattr(ev, "directory", str(tmp_path))
+    monkeypatch.setattr(ev, "profile_folder", "Lexical_profiles")
+    monkeypatch.setattr(ev, "lemma_path", str(tmp_path / "lemmas.sqlite"))
+    monkeypatch.setattr(ev, "lemmatizers", {})
+
+    path = str(tmp_path / "service.sock")
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(ps.serve(ps.ProfileService(), path))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for _ in range(500):
+        try:
+            client = ps.ProfileClient(path, timeout=30)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            thread.join(0.01)
+    yield client
+    client.close()
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(10)
+    loop.close()
+
+
+def expected_scores(tmp_path, words, ngrams, candidates):
+    # The scores of a scorer that is made here, with its own lemma table
+    lemmatizer = Lemmatizer("blank:nl", str(tmp_path / "expected.sqlite"))
+    scores = CandidateScorer(words, ngrams, lemmatizer.lemmatize_all, model="blank:nl").score(candidates)
+    return {matchtype: {metric: values.tolist() for metric, values in metrics.items()} for matchtype, metrics in scores.items()}
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="the service is tested on a Unix socket")
+def test_stored_profile_round_trip(client, tmp_path):
+    profile = client.profile(transcript="1", timeframe=10)
+    assert profile == dict(COMMON, ngram=NGRAMS)
+
+    words = list(dict.fromkeys(w for pos in ev.POS_list for w in COMMON[pos]))
+    assert client.score(CANDIDATES, transcript="1", timeframe=10) == expected_scores(tmp_path, words, NGRAMS, CANDIDATES)
+    # Only the requested POS categories are compared
+    assert client.score(CANDIDATES, pos=["NOUN"], transcript="1", timeframe=10) == \
+        expected_scores(tmp_path, COMMON["NOUN"], NGRAMS, CANDIDATES)
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="the service is tested on a Unix socket")
+def test_requests_of_concurrent_clients(client, tmp_path):
+    # The requests of several clients are answered in batches, every client gets the response to its own request
+    expected = {}
+    for i in range(len(CANDIDATES)):
+        candidates = CANDIDATES[i:] + CANDIDATES[:i]
+        words = list(dict.fromkeys(w for pos in ev.POS_list for w in COMMON[pos]))
+        expected[i] = expected_scores(tmp_path, words, NGRAMS, candidates)
+    responses = {}
+
+    def send(i):
+        with ps.ProfileClient(client.socket.getpeername(), timeout=30) as other:
+            responses[i] = [other.score(CANDIDATES[i:] + CANDIDATES[:i], transcript="1", timeframe=10) for _ in range(5)]
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in expected]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert responses == {i: [scores] * 5 for i, scores in expected.items()}
+    assert client.stats()["score"]["requests"] == 5 * len(expected)
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="the service is tested on a Unix socket")
+def test_live_profile_and_errors(client):
+    with pytest.raises(RuntimeError, match="KeyError"):
+        client.profile(speaker="a")
+    assert client.update("a", "Ik ga naar huis.") == {"utterances": 1}
+    assert client.update("a", "Ik ga op de fiets naar huis.") == {"utterances": 2}
+    profile = client.profile(speaker="a")
+    assert set(profile) == set(ev.POS_list) | {"ngram"}
+    scores = client.score(CANDIDATES, speaker="a")
+    assert set(scores) == {"Exact", "Lemma"}
+    assert all(len(values) == len(CANDIDATES) for metrics in scores.values() for values in metrics.values())
+
+    with pytest.raises(RuntimeError, match="Unknown op"):
+        client.request({"op": "delete"})
+    with pytest.raises(RuntimeError, match="FileNotFoundError"):
+        client.profile(transcript="2", timeframe=10)
+    # A line that is not JSON gets an error response, the connection stays usable
+    client.socket.sendall(b"{not json\n")
+    assert "JSONDecodeError" in json.loads(client.file.readline())["error"]
+    stats = client.stats()
+    assert stats["update"]["requests"] == 2
+    assert stats["profile"]["requests"] == 3
+    # The op of a line that is not JSON is unknown (null)
+    assert stats["null"]["requests"] == 1
+    assert stats["delete"]["requests"] == 1
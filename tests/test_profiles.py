@@ -0,0 +1,76 @@
+import os
+import json
+import struct
+import random
+
+import pytest
+
+from profiles import MAGIC, FORMAT, EXTENSION, Profile, write_profile, read_profile, convert
+
+POS = ["NOUN", "PRON", "ADJ", "CONJ", "VERB", "ADV"]
+WORDS = ["ja", "de", "eh", "huis", "café", "één", "zo'n", "amsterdam", "vrouw", "man", "ik", "niet"]
+
+
+def random_database(rng, transcript="1"):
+    # A profile in the form of get_lexical_features.build_profiles
+    database = {"ID": {"transcript number": transcript}}
+    for pos in POS:
+        terms = rng.sample(WORDS, rng.randint(0, len(WORDS)))
+        database[pos] = {"terms": terms, "common": terms[:rng.randint(0, len(terms))]}
+    ngrams = [" ".join(rng.choices(WORDS, k=rng.randint(2, 5))) for _ in range(rng.randint(0, 40))]
+    database["ngrams"] = {"ngrams_all": ngrams, "common": ngrams[:rng.randint(0, len(ngrams))]}
+    return database
+
+
+def test_profile_round_trip(tmp_path):
+    rng = random.Random(0)
+    for i in range(50):
+        database = random_database(rng, str(i))
+        json_path = tmp_path / f"{i}_database.json"
+        json_path.write_text(json.dumps(database, ensure_ascii=False), encoding="utf-8")
+        path = convert(str(json_path))
+        assert path == str(tmp_path / f"{i}_database{EXTENSION}")
+        os.remove(json_path)
+
+        profile = Profile(path)
+        # Only the header is read, the common lists need no section
+        assert {key: profile.common(key) for key in POS + ["ngrams"]} == \
+            {key: database[key]["common"] for key in POS + ["ngrams"]}
+        assert profile.loaded == {}
+        assert profile.to_dict() == database
+        assert read_profile(str(tmp_path / f"{i}_database.json")).to_dict() == database
+        assert read_profile(path)["ngrams"]["ngrams_all"] == database["ngrams"]["ngrams_all"]
+
+
+def test_bad_header(tmp_path):
+    path = str(tmp_path / ("profile" + EXTENSION))
+    database = random_database(random.Random(1))
+    write_profile(path, database)
+    assert Profile(path).to_dict() == database
+    with open(path, "rb") as f:
+        data = f.read()
+    # Another magic number, or another version of the format
+    for prefix in [b"JSON", MAGIC + struct.pack("<B", FORMAT + 1)]:
+        with open(path, "wb") as f:
+            f.write(prefix + data[len(prefix):])
+        with pytest.raises(ValueError):
+            Profile(path)
+
+
+def test_read_profile_uses_newer_file(tmp_path):
+    rng = random.Random(2)
+    compact_db, json_db = random_database(rng, "compact"), random_database(rng, "json")
+    base = str(tmp_path / "10_database")
+    write_profile(base + EXTENSION, compact_db)
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(json_db, f)
+
+    for path in [base, base + ".json", base + EXTENSION]:
+        os.utime(base + EXTENSION, (1000, 1000))
+        os.utime(base + ".json", (2000, 2000))
+        assert read_profile(path) == json_db
+        # The compact file is used when it is not older than the JSON file
+        os.utime(base + EXTENSION, (2000, 2000))
+        assert read_profile(path).to_dict() == compact_db
+        os.utime(base + EXTENSION, (3000, 3000))
+        assert read_profile(path).to_dict() == compact_db
@@ -0,0 +1,77 @@
+import os
+import random
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from results import COLUMNS, EXTENSIONS, ResultsWriter, read_results, results_format, results_path, convert
+
+METRICS = ["Recall", "Coverage", "Cosine"]
+POS = ["NOUN", "VERB", "ngram"]
+
+
+def random_rows(rng, n):
+    return [[rng.choice(["Random", "GPT"]), str(rng.randint(1, 9)), rng.choice([5, 10]), rng.choice(["10", "30", ""]),
+             rng.randint(0, 40), rng.randint(0, 200), rng.choice(METRICS), rng.random(), rng.choice(POS),
+             rng.choice(["Exact", "Lemma"])] for _ in range(n)]
+
+
+def typed(rows):
+    # The values as the types of their columns, the csv files are read with the types that pyarrow infers
+    return [tuple(convert(value, kind) for value, (_, kind) in zip(row, COLUMNS)) for row in rows]
+
+
+def table_rows(table, columns=COLUMNS):
+    return typed(zip(*[table.column(name).to_pylist() for name, _ in columns]))
+
+
+@pytest.mark.parametrize("format", list(EXTENSIONS))
+def test_write_and_read_back(tmp_path, format):
+    rng = random.Random(0)
+    settings = {name: random_rows(rng, rng.randint(1, 60)) for name in ["a", "b", "c"]}
+    for name, rows in settings.items():
+        # A small batch size, so the rows are written in several batches
+        with ResultsWriter(results_path(str(tmp_path), name, format), format, batch_size=7) as writer:
+            writer.writerows(rows)
+    path = results_path(str(tmp_path), "a", format)
+    assert os.listdir(os.path.dirname(path)) == ["results" + EXTENSIONS[format]]
+    assert results_format(path) == format
+    assert table_rows(read_results(path)) == typed(settings["a"])
+
+    # The directory is read as one dataset, with the setting of every row from its hive partition (setting=<name>)
+    assert results_format(str(tmp_path)) == format
+    table = read_results(str(tmp_path))
+    assert sorted(zip(table.column("setting").to_pylist(), table_rows(table)), key=repr) == \
+        sorted(((name, row) for name, rows in settings.items() for row in typed(rows)), key=repr)
+
+    table = read_results(str(tmp_path), columns=["Metric", "Value", "setting"], metric="Recall", pos="NOUN")
+    assert table.column_names == ["Metric", "Value", "setting"]
+    assert sorted(zip(table.column("setting").to_pylist(), table.column("Value").to_pylist())) == \
+        sorted((name, row[7]) for name, rows in settings.items() for row in rows if row[6] == "Recall" and row[8] == "NOUN")
+
+
+@pytest.mark.parametrize("format", list(EXTENSIONS))
+def test_failed_writer_keeps_results(tmp_path, format):
+    path = results_path(str(tmp_path), "a", format)
+    with ResultsWriter(path, format) as writer:
+        writer.writerows(random_rows(random.Random(1), 10))
+    # A run that fails leaves the former results in place, without a temporary file
+    with pytest.raises(RuntimeError):
+        with ResultsWriter(path, format) as writer:
+            writer.writerows(random_rows(random.Random(2), 10))
+            raise RuntimeError("failed")
+    assert os.listdir(os.path.dirname(path)) == ["results" + EXTENSIONS[format]]
+    assert table_rows(read_results(path)) == typed(random_rows(random.Random(1), 10))
+
+
+def test_results_format(tmp_path):
+    assert results_format("results.csv") == "csv"
+    assert results_format("results.parquet") == "parquet"
+    assert results_format("results.arrow") == "arrow"
+    with pytest.raises(ValueError):
+        results_format("results.txt")
+    with pytest.raises(FileNotFoundError):
+        results_format(str(tmp_path))
+    with pytest.raises(ValueError):
+        ResultsWriter(str(tmp_path / "results.txt"), "txt")